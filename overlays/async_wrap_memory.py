@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import ast
+import asyncio
+import dataclasses
+import inspect
+import textwrap
+import time
+from typing import (
+    Any, Awaitable, Callable, Dict, Generic, Optional, Protocol, Tuple, TypeVar, Union
+)
+
+import wrap_memory
+from wrap_memory import (
+    ClassAncestors, ClassName, Code, Dependents, Module, ReadOnlyEnv, WritableEnv, code_dependents,
+    drop_unsaved_entries, module, record_code, record_dependency, record_push, unsaved_dependents
+)
+
+
+# An asyncio version of the `wrap_memory.py` env stack.
+#
+# The async environments operate on exactly the same `WritableEnv` tables as
+# the sync ones, so a sync stack and an async stack can be built over the same
+# tables and used side by side: values (and dependencies) computed by one are
+# visible to the other. That lets us migrate one layer at a time: an
+# `AsyncEnvTable` whose `produce_value` is still synchronous can sit on top of
+# a sync upstream environment, and once the upstream layer is async the
+# `produce_value` has to become a coroutine so it can await its upstream.
+#
+# The stats of the tables (`wrap_memory.TableStats`) are shared too. The time
+# of an async `produce_value` includes whatever else ran while it awaited.
+
+
+T = TypeVar("T")
+
+
+class AsyncReadOnlyEnv(Generic[T], Protocol):
+    def __call__(self, key: str, dependency: str) -> Awaitable[T]:
+        ...
+
+
+UpstreamEnv = Union["AsyncEnvTable", wrap_memory.EnvTable]
+
+
+@dataclasses.dataclass
+class AsyncEnvTable(Generic[T]):
+    writable_env: WritableEnv[T]
+    upstream_env: Optional[UpstreamEnv] = None
+    # Computations that are currently running, keyed by
+    # (use_saved_contents, key), so that concurrent `aget`s of the same key
+    # share one `produce_value`.
+    in_flight: Dict[Tuple[bool, str], asyncio.Future] = dataclasses.field(default_factory=dict)
+    # Bumped whenever a push writes a key (with the same key layout as
+    # `in_flight`), so that an `aget` that started before the push does not
+    # overwrite the pushed value with the one it computed from older inputs.
+    generations: Dict[Tuple[bool, str], int] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def produce_value(key: str, upstream_get: Any, current_env_getter: Any) -> Union[T, Awaitable[T]]:
+        "Must be implemented by child environments; may be a coroutine"
+        raise NotImplementedError()
+
+    def bump_generation(self, use_saved_contents: bool, key: str) -> None:
+        generation_key = (use_saved_contents, key)
+        self.generations[generation_key] = self.generations.get(generation_key, 0) + 1
+
+    def bump_unsaved_generations(self, module_: str) -> None:
+        # The unsaved entries of `module_` are being dropped; results still
+        # being computed for them must not bring them back.
+        for use_saved_contents, key in list(self.in_flight):
+            if not use_saved_contents and module(key) == module_:
+                self.bump_generation(use_saved_contents, key)
+
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.produce_value)
+
+    def upstream_get(self, use_saved_contents_of_dependents: bool) -> Any:
+        if self.upstream_env is None:
+            return ...  # typing this correctly is annoying and not illuminating
+        if isinstance(self.upstream_env, AsyncEnvTable):
+            if not self.is_async():
+                raise RuntimeError(
+                    f"{type(self).__name__} sits on an async environment, "
+                    "so its produce_value must be a coroutine"
+                )
+            return self.upstream_env.aread_only(use_saved_contents_of_dependents)
+        sync_get = self.upstream_env.read_only(use_saved_contents_of_dependents)
+        if not self.is_async():
+            return sync_get
+
+        async def get(key: str, dependency: str) -> Any:
+            return sync_get(key, dependency)
+
+        return get
+
+    async def _produce(self, key: str, use_saved_contents: bool, table: Dict[str, T]) -> T:
+        stats = self.writable_env.saved_stats if use_saved_contents else self.writable_env.unsaved_stats
+        stats.produce_value_calls += 1
+        start = time.perf_counter_ns()
+        value = self.produce_value(
+            key,
+            self.upstream_get(use_saved_contents_of_dependents=use_saved_contents),
+            current_env_getter=table.get,
+        )
+        if inspect.isawaitable(value):
+            value = await value
+        stats.produce_value_ns += time.perf_counter_ns() - start
+        return value
+
+    async def aget(self, key: str, dependency: str, use_saved_contents_of_dependents: bool) -> T:
+        record_dependency(self.writable_env, key, dependency, use_saved_contents_of_dependents)
+        use_saved_contents = (
+            use_saved_contents_of_dependents or
+            module(key) not in self.writable_env.unsaved_modules
+        )
+        target_cache_table = (
+            self.writable_env.saved_contents_cache_table
+            if use_saved_contents
+            else self.writable_env.unsaved_contents_cache_table
+        )
+        stats = self.writable_env.saved_stats if use_saved_contents else self.writable_env.unsaved_stats
+        stats.gets += 1
+        is_dirty = (
+            not use_saved_contents
+            and key in self.writable_env.dirty_unsaved_keys
+        )
+        if key in target_cache_table and not is_dirty:
+            return target_cache_table[key]
+        stats.misses += 1
+
+        in_flight_key = (use_saved_contents, key)
+        if in_flight_key in self.in_flight:
+            return await self.in_flight[in_flight_key]
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[in_flight_key] = future
+        generation = self.generations.get(in_flight_key, 0)
+        try:
+            value = await self._produce(key, use_saved_contents, target_cache_table)
+            if self.generations.get(in_flight_key, 0) == generation:
+                target_cache_table[key] = value
+                if not use_saved_contents:
+                    self.writable_env.dirty_unsaved_keys.discard(key)
+            else:
+                # A push wrote this key while we were computing it, so our
+                # value is stale: read the key again instead of storing it.
+                del self.in_flight[in_flight_key]
+                value = await self.aget(key, dependency, use_saved_contents_of_dependents)
+            future.set_result(value)
+        except BaseException as exception:
+            future.set_exception(exception)
+            # Nobody else may be waiting; don't let asyncio complain about it.
+            future.exception()
+            raise
+        finally:
+            if self.in_flight.get(in_flight_key) is future:
+                del self.in_flight[in_flight_key]
+        return value
+
+    async def aupdate_for_push(
+        self,
+        keys_to_update: Dependents,
+        edited_module: str,
+        is_saved_content: bool,
+    ) -> Dependents:
+        # Same as `wrap_memory.EnvTable.update_for_push`, minus cancellation
+        # and promotion.
+        async def update_table(table: Dict[str, T], key: str, use_saved_contents: bool) -> None:
+            table[key] = await self._produce(key, use_saved_contents, table)
+            self.bump_generation(use_saved_contents, key)
+
+        saved_keys = keys_to_update.saved
+        unsaved_keys = keys_to_update.unsaved
+        if not is_saved_content:
+            unsaved_keys = unsaved_keys | self.writable_env.dirty_unsaved_keys
+
+        async def update_key(key: str) -> None:
+            # The unsaved value may depend on the saved one, so these two
+            # have to stay sequential.
+            if key in saved_keys:
+                await update_table(self.writable_env.saved_contents_cache_table, key,
+                                   use_saved_contents=True)
+            if key in unsaved_keys and module(key) in self.writable_env.unsaved_modules:
+                await update_table(self.writable_env.unsaved_contents_cache_table, key,
+                                   use_saved_contents=False)
+                self.writable_env.dirty_unsaved_keys.discard(key)
+
+        # Keys within one layer only depend on upstream layers, so they can
+        # all be recomputed concurrently.
+        await asyncio.gather(*(update_key(key) for key in saved_keys | unsaved_keys))
+
+        downstream_deps = Dependents()
+        for key in saved_keys:
+            downstream_deps.saved |= self.writable_env.dependencies.get(key, set())
+            if module(key) not in self.writable_env.unsaved_modules:
+                downstream_deps.unsaved |= self.writable_env.unsaved_dependencies.get(key, set())
+        downstream_deps.unsaved |= unsaved_dependents(
+            self.writable_env,
+            {
+                key
+                for key in unsaved_keys
+                if module(key) in self.writable_env.unsaved_modules or module(key) == edited_module
+            },
+            edited_module,
+        )
+        record_push(self.writable_env, Dependents(saved_keys, unsaved_keys), downstream_deps)
+        return downstream_deps
+
+    async def aupdate(self, module: str, code: str, is_saved_content: bool) -> Dependents:
+        # We do not keep unsaved versions here, so the ones the sync stack
+        # kept are out of date from now on.
+        self.writable_env.unsaved_versions.clear()
+        was_unsaved = module in self.writable_env.unsaved_modules
+        if is_saved_content:
+            self.writable_env.unsaved_modules.discard(module)
+        else:
+            self.writable_env.unsaved_modules.add(module)
+
+        if self.upstream_env is None:
+            raise NotImplementedError()
+        if isinstance(self.upstream_env, AsyncEnvTable):
+            keys_to_update = await self.upstream_env.aupdate(module, code, is_saved_content)
+        else:
+            # We do not detect reverts and promotions here, so make sure the
+            # synchronous layers do not either.
+            keys_to_update = self.upstream_env.update(module, code, is_saved_content, edit="change")
+        downstream_deps = await self.aupdate_for_push(keys_to_update, module, is_saved_content)
+        if was_unsaved and is_saved_content:
+            drop_unsaved_entries(self.writable_env, module)
+            self.bump_unsaved_generations(module)
+        return downstream_deps
+
+    def aread_only(self, use_saved_contents_of_dependents: bool) -> AsyncReadOnlyEnv:
+        def get(key: str, dependency: str) -> Awaitable[T]:
+            return self.aget(key, dependency, use_saved_contents_of_dependents=use_saved_contents_of_dependents)
+        return get
+
+
+# Source loader for modules that are not in the code table yet, e.g. reading
+# from disk or from a remote cache tier.
+FetchCode = Callable[[Module], Awaitable[Code]]
+
+
+@dataclasses.dataclass
+class AsyncCodeEnv(AsyncEnvTable[Code]):
+    fetch: Optional[FetchCode] = None
+
+    async def produce_value(self, key: Module, upstream_get: Any, current_env_getter: Any) -> Code:
+        code = current_env_getter(key)
+        if code is None and self.fetch is not None:
+            code = await self.fetch(key)
+        return code
+
+    async def aupdate(self, module: str, code: str, is_saved_content: bool) -> Dependents:
+        # Same as `wrap_memory.CodeEnv.update`: set the value rather than
+        # producing it.
+        self.writable_env.unsaved_versions.clear()
+        was_unsaved = module in self.writable_env.unsaved_modules
+        if is_saved_content:
+            self.writable_env.unsaved_modules.discard(module)
+        else:
+            self.writable_env.unsaved_modules.add(module)
+        record_code(self.writable_env, module, code, is_saved_content=is_saved_content)
+        self.bump_generation(is_saved_content, module)
+        downstream_deps = code_dependents(self.writable_env, module, is_saved_content, edit="change")
+        record_push(
+            self.writable_env,
+            Dependents(saved={module}) if is_saved_content else Dependents(unsaved={module}),
+            downstream_deps,
+        )
+        if was_unsaved and is_saved_content:
+            drop_unsaved_entries(self.writable_env, module)
+            self.bump_unsaved_generations(module)
+            self.writable_env.unsaved_content_hashes.pop(module, None)
+        return downstream_deps
+
+
+@dataclasses.dataclass
+class AsyncAstEnv(AsyncEnvTable[ast.AST]):
+    @staticmethod
+    async def produce_value(key: Module, upstream_get: AsyncReadOnlyEnv[Code], current_env_getter: Any) -> ast.AST:
+        code = await upstream_get(key, dependency=key)
+        return ast.parse(textwrap.dedent(code))
+
+
+@dataclasses.dataclass
+class AsyncClassBodyEnv(AsyncEnvTable[ast.ClassDef]):
+    @staticmethod
+    async def produce_value(key: ClassName, upstream_get: AsyncReadOnlyEnv[ast.AST], current_env_getter: Any):
+        module, relative_name = key.split(".")
+        ast_ = await upstream_get(key=module, dependency=key)
+        # pyre-fixme[16]: `_ast.AST` has no attribute `body`.
+        for class_def in ast_.body:
+            if class_def.name == relative_name:
+                return class_def
+
+
+@dataclasses.dataclass
+class AsyncClassParentsEnv(AsyncEnvTable[ClassAncestors]):
+    @staticmethod
+    async def produce_value(key: ClassName, upstream_get: AsyncReadOnlyEnv[ast.ClassDef], current_env_getter: Any):
+        class_def = await upstream_get(key, dependency=key)
+        return [
+            ast.unparse(b)
+            for b in class_def.bases
+        ]
+
+
+@dataclasses.dataclass
+class AsyncClassGrandparentsEnv(AsyncEnvTable[ClassAncestors]):
+    @staticmethod
+    async def produce_value(key: ClassName, upstream_get: AsyncReadOnlyEnv[ClassAncestors], current_env_getter: Any):
+        parents = await upstream_get(key, dependency=key)
+        # The per-parent lookups are independent, so fetch them concurrently.
+        grandparents_by_parent = await asyncio.gather(*(
+            upstream_get(parent, dependency=key)
+            for parent in parents
+        ))
+        return [
+            grandparent
+            for grandparents in grandparents_by_parent
+            for grandparent in grandparents
+        ]
+
+
+def create_async_env_stack(
+    sync_stack: Tuple[
+        wrap_memory.CodeEnv,
+        wrap_memory.AstEnv,
+        wrap_memory.ClassBodyEnv,
+        wrap_memory.ClassParentsEnv,
+        wrap_memory.ClassGrandparentsEnv,
+    ],
+    fetch: Optional[FetchCode] = None,
+) -> Tuple[
+    AsyncCodeEnv,
+    AsyncAstEnv,
+    AsyncClassBodyEnv,
+    AsyncClassParentsEnv,
+    AsyncClassGrandparentsEnv,
+]:
+    """Build an async stack over the same cache tables as `sync_stack`."""
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env,
+    ) = sync_stack
+    async_code_env = AsyncCodeEnv(writable_env=code_env.writable_env, fetch=fetch)
+    async_ast_env = AsyncAstEnv(writable_env=ast_env.writable_env, upstream_env=async_code_env)
+    async_class_body_env = AsyncClassBodyEnv(writable_env=class_body_env.writable_env, upstream_env=async_ast_env)
+    async_class_parents_env = AsyncClassParentsEnv(writable_env=class_parents_env.writable_env, upstream_env=async_class_body_env)
+    async_class_grandparents_env = AsyncClassGrandparentsEnv(writable_env=class_grandparents_env.writable_env, upstream_env=async_class_parents_env)
+    return (
+        async_code_env,
+        async_ast_env,
+        async_class_body_env,
+        async_class_parents_env,
+        async_class_grandparents_env,
+    )
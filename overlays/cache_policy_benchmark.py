@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Compare cache policy configurations of the `wrap_memory.py` stack on the same
+editing session: how long pushes and queries take, how many values get
+computed, and how much memory the cache tables hold on to at the end.
+
+The session opens a few unsaved buffers and then alternates unsaved edits of
+a buffer with queries of the grandparents of every class in the buffers (the
+unsaved view) and of every class in a handful of saved modules.
+
+Run it with `python cache_policy_benchmark.py [modules] [classes] [unsaved_buffers] [rounds]`.
+"""
+import contextlib
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Type
+
+import wrap_memory
+from wrap_memory import (
+    AstEnv, CachePolicy, ClassBodyEnv, ClassGrandparentsEnv, ClassParentsEnv, EnvTable, LayerCachePolicy,
+)
+
+
+CachePolicies = Dict[Type[EnvTable[Any]], LayerCachePolicy]
+
+NONE = CachePolicy("none")
+TRANSIENT = CachePolicy("transient")
+
+CONFIGURATIONS: Dict[str, CachePolicies] = {
+    "persistent": {},
+    # Unsaved trees are big and cheap to rebuild from one buffer, while class
+    # parents are small.
+    "transient unsaved asts": {
+        AstEnv: LayerCachePolicy(unsaved=TRANSIENT),
+    },
+    "no asts": {
+        AstEnv: LayerCachePolicy(saved=NONE, unsaved=NONE),
+    },
+    "transient below parents": {
+        AstEnv: LayerCachePolicy(saved=TRANSIENT, unsaved=TRANSIENT),
+        ClassBodyEnv: LayerCachePolicy(saved=TRANSIENT, unsaved=TRANSIENT),
+    },
+    "bounded": {
+        AstEnv: LayerCachePolicy(saved=CachePolicy(max_entries=20), unsaved=TRANSIENT),
+        ClassBodyEnv: LayerCachePolicy(saved=CachePolicy(max_entries=200)),
+    },
+}
+
+
+def _project(modules: int, classes: int) -> Dict[str, str]:
+    return {
+        f"m{j}": "\n".join(
+            f"class C{i}: pass" if j == 0 else f"class C{i}(m{j - 1}.C{i}): pass"
+            for i in range(classes)
+        ) + "\n"
+        for j in range(modules)
+    }
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.calls = 0
+
+
+@contextlib.contextmanager
+def counting_produce_value(counter: Counter) -> Iterator[None]:
+    classes = [AstEnv, ClassBodyEnv, ClassParentsEnv, ClassGrandparentsEnv]
+    originals = {cls: cls.__dict__["produce_value"] for cls in classes}
+
+    def counted(produce_value: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            counter.calls += 1
+            return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", staticmethod(counted(original.__func__)))
+        yield
+    finally:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", original)
+
+
+def session(
+    cache_policies: CachePolicies,
+    modules: int,
+    classes: int,
+    unsaved_buffers: int,
+    rounds: int,
+    trace_memory: bool = False,
+) -> Dict[str, float]:
+    code = _project(modules, classes)
+    buffers = [f"m{j}" for j in range(1, 1 + unsaved_buffers)]
+    saved_queries = [f"m{j}" for j in range(modules - 5, modules)]
+
+    if trace_memory:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+    *_, env = wrap_memory.create_env_stack(code=dict(code), cache_policies=cache_policies)
+    for name in code:
+        for i in range(classes):
+            env.get(f"{name}.C{i}", None, use_saved_contents_of_dependents=True)
+    for buffer in buffers:
+        env.update(buffer, code[buffer] + "# opened\n", is_saved_content=False)
+
+    counter = Counter()
+    push_latencies: List[float] = []
+    query_latencies: List[float] = []
+    with counting_produce_value(counter):
+        for round in range(rounds):
+            buffer = buffers[round % len(buffers)]
+            start = time.perf_counter()
+            env.update(buffer, code[buffer] + f"# typed {round}\n", is_saved_content=False)
+            push_latencies.append(time.perf_counter() - start)
+            for name, use_saved in [(name, False) for name in buffers] + [(name, True) for name in saved_queries]:
+                for i in range(classes):
+                    start = time.perf_counter()
+                    env.get(f"{name}.C{i}", None, use_saved_contents_of_dependents=use_saved)
+                    query_latencies.append(time.perf_counter() - start)
+    after = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+    if trace_memory:
+        tracemalloc.stop()
+
+    return {
+        "push_p50_us": 1e6 * statistics.median(push_latencies),
+        "query_p50_us": 1e6 * statistics.median(query_latencies),
+        "query_p99_us": 1e6 * sorted(query_latencies)[int(0.99 * (len(query_latencies) - 1))],
+        "produce_value_calls": counter.calls,
+        "retained_kb": (after - before) / 1024,
+    }
+
+
+def report(
+    modules: int = 50,
+    classes: int = 10,
+    unsaved_buffers: int = 5,
+    rounds: int = 20,
+) -> Dict[str, Dict[str, float]]:
+    # Latencies are measured without tracemalloc, which slows everything down.
+    return {
+        name: dict(
+            session(cache_policies, modules, classes, unsaved_buffers, rounds),
+            retained_kb=session(cache_policies, modules, classes, unsaved_buffers, rounds, trace_memory=True)["retained_kb"],
+        )
+        for name, cache_policies in CONFIGURATIONS.items()
+    }
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    modules, classes, unsaved_buffers, rounds = arguments + [50, 10, 5, 20][len(arguments):]
+    print(f"{modules} modules of {classes} classes, {unsaved_buffers} unsaved buffers, {rounds} edits")
+    for name, row in report(modules, classes, unsaved_buffers, rounds).items():
+        print(
+            f"{name:>24}: push p50 {row['push_p50_us']:.0f}us, "
+            f"query p50 {row['query_p50_us']:.1f}us / p99 {row['query_p99_us']:.1f}us, "
+            f"{row['produce_value_calls']} produce_value calls, {row['retained_kb']:.0f}KB retained"
+        )
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Replay typing traces against the `wrap_memory.py` and `overlay_keys.py` stacks,
+once letting every keystroke push to completion and once with cooperative
+cancellation, and report how many `produce_value` calls cancellation saves.
+
+There is no wall clock here: time is measured in `produce_value` calls, and
+each keystroke of a trace arrives at a fixed tick. A push that is still running
+when a newer keystroke for the same module arrives gets cancelled (if
+cancellation is enabled) and restarted from the newest text.
+
+Run it with `python cancellation_benchmark.py`.
+"""
+import contextlib
+import dataclasses
+import io
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+import overlay_keys
+import wrap_memory
+
+
+@dataclasses.dataclass(frozen=True)
+class Keystroke:
+    arrival: int  # measured in produce_value calls since the trace started
+    module: str
+    code: str
+
+
+TypingTrace = List[Keystroke]
+
+
+def _project(class_count: int) -> Dict[str, str]:
+    b_classes = "\n".join(
+        f"class B{i}(a.X): pass" if i == 0 else f"class B{i}(b.B{i - 1}): pass"
+        for i in range(class_count)
+    )
+    c_classes = "\n".join(
+        f"class C{i}(b.B{i}): pass"
+        for i in range(class_count)
+    )
+    return {
+        "a": "class X: pass\nclass Y(a.X): pass\n",
+        "b": b_classes + "\n",
+        "c": c_classes + "\n",
+    }
+
+
+def typing_trace(
+    code: Dict[str, str],
+    lines: int,
+    comment: str,
+    interval: int,
+    pause: int,
+) -> TypingTrace:
+    """
+    Simulate someone adding `lines` classes to module `b`: for each one they
+    first type `comment` one character at a time (every snapshot of which
+    parses), then replace it with the class definition and pause.
+    """
+    trace = []
+    text = code["b"]
+    tick = 0
+    for line in range(lines):
+        for length in range(1, len(comment) + 1):
+            tick += interval
+            trace.append(Keystroke(tick, "b", text + "# " + comment[:length] + "\n"))
+        text += f"class New{line}(b.B{line}): pass\n"
+        tick += interval
+        trace.append(Keystroke(tick, "b", text))
+        tick += pause
+    return trace
+
+
+def traces() -> Dict[str, Tuple[Dict[str, str], TypingTrace]]:
+    code = _project(class_count=8)
+    return {
+        "steady": (code, typing_trace(code, lines=3, comment="fix parents", interval=6, pause=0)),
+        "bursty": (code, typing_trace(code, lines=3, comment="fix parents", interval=1, pause=300)),
+    }
+
+
+class Clock:
+    """Counts produce_value calls and delivers keystrokes as they arrive."""
+
+    def __init__(self, trace: TypingTrace) -> None:
+        self.now = 0
+        self.produce_value_calls = 0
+        self.pending: Deque[Keystroke] = deque(trace)
+        self.generations: Dict[str, int] = {}
+        self.latest: Dict[str, str] = {}
+
+    def deliver(self) -> None:
+        while self.pending and self.pending[0].arrival <= self.now:
+            keystroke = self.pending.popleft()
+            self.generations[keystroke.module] = self.generations.get(keystroke.module, 0) + 1
+            self.latest[keystroke.module] = keystroke.code
+
+    def tick(self) -> None:
+        self.now += 1
+        self.produce_value_calls += 1
+        self.deliver()
+
+    def wait_until(self, arrival: int) -> None:
+        self.now = max(self.now, arrival)
+        self.deliver()
+
+
+@contextlib.contextmanager
+def counting_produce_value(classes: List[type], clock: Clock) -> Iterator[None]:
+    originals = {cls: cls.__dict__["produce_value"] for cls in classes}
+
+    def counted(produce_value: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            clock.tick()
+            return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", staticmethod(counted(original.__func__)))
+        yield
+    finally:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", original)
+
+
+@dataclasses.dataclass(frozen=True)
+class StackAdapter:
+    name: str
+    module: Any
+    update: Callable[[Any, str, str, Any], object]
+    saved_get: Callable[[Any, str], object]
+    unsaved_get: Callable[[Any, str, str], object]
+
+
+STACKS = [
+    StackAdapter(
+        name="wrap_memory",
+        module=wrap_memory,
+        update=lambda env, module, code, is_cancelled: env.update(
+            module, code, is_saved_content=False, is_cancelled=is_cancelled
+        ),
+        saved_get=lambda env, key: env.get(key, "", use_saved_contents_of_dependents=True),
+        unsaved_get=lambda env, module, key: env.get(key, "", use_saved_contents_of_dependents=False),
+    ),
+    StackAdapter(
+        name="overlay_keys",
+        module=overlay_keys,
+        update=lambda env, module, code, is_cancelled: env.update(
+            module, code, in_overlay=True, is_cancelled=is_cancelled
+        ),
+        saved_get=lambda env, key: env.get(key, ""),
+        unsaved_get=lambda env, module, key: env.children[module].get(key, ""),
+    ),
+]
+
+
+def _env_classes(module: Any) -> List[type]:
+    return [
+        module.CodeEnv,
+        module.AstEnv,
+        module.ClassBodyEnv,
+        module.ClassParentsEnv,
+        module.ClassGrandparentsEnv,
+    ]
+
+
+def _class_keys(module: str, code: str) -> List[str]:
+    return [
+        f"{module}.{line.split()[1].split('(')[0].rstrip(':')}"
+        for line in code.splitlines()
+        if line.startswith("class ")
+    ]
+
+
+def replay(
+    stack: StackAdapter,
+    code: Dict[str, str],
+    trace: TypingTrace,
+    cancellation: bool,
+) -> Dict[str, Any]:
+    """
+    Replay `trace` and return the produce_value count, the number of
+    cancelled pushes, and the final grandparents of every class in the edited
+    modules (so that runs can be checked against each other).
+    """
+    *_, class_grandparents_env = stack.module.create_env_stack(code=dict(code))
+    # Populate the dependency graph of the saved stack before typing starts.
+    for module, text in code.items():
+        for key in _class_keys(module, text):
+            stack.saved_get(class_grandparents_env, key)
+    # Open the buffers that are about to be edited and look at them once, so
+    # that there are unsaved values to push (overlays are materialized lazily).
+    with contextlib.redirect_stdout(io.StringIO()):
+        for module in sorted({keystroke.module for keystroke in trace}):
+            stack.update(class_grandparents_env, module, code[module], None)
+            for key in _class_keys(module, code[module]):
+                stack.unsaved_get(class_grandparents_env, module, key)
+
+    clock = Clock(trace)
+    cancellations = 0
+    with counting_produce_value(_env_classes(stack.module), clock), \
+            contextlib.redirect_stdout(io.StringIO()):
+        if cancellation:
+            applied: Dict[str, int] = {}
+            while clock.pending or applied != clock.generations:
+                if applied == clock.generations:
+                    clock.wait_until(clock.pending[0].arrival)
+                    continue
+                module = next(
+                    module
+                    for module, generation in clock.generations.items()
+                    if applied.get(module) != generation
+                )
+                generation = clock.generations[module]
+                try:
+                    stack.update(
+                        class_grandparents_env,
+                        module,
+                        clock.latest[module],
+                        lambda: clock.generations[module] != generation,
+                    )
+                    applied[module] = generation
+                except stack.module.UpdateCancelled:
+                    cancellations += 1
+        else:
+            # Without cancellation every keystroke is pushed, in order.
+            for keystroke in trace:
+                clock.wait_until(keystroke.arrival)
+                stack.update(class_grandparents_env, keystroke.module, keystroke.code, None)
+        produce_value_calls = clock.produce_value_calls
+
+        final_code = {keystroke.module: keystroke.code for keystroke in trace}
+        final_values = {
+            key: stack.unsaved_get(class_grandparents_env, module, key)
+            for module, text in final_code.items()
+            for key in _class_keys(module, text)
+        }
+
+    return {
+        "produce_value_calls": produce_value_calls,
+        "cancellations": cancellations,
+        "final_values": final_values,
+    }
+
+
+def report() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for trace_name, (code, trace) in traces().items():
+        for stack in STACKS:
+            without = replay(stack, code, trace, cancellation=False)
+            with_ = replay(stack, code, trace, cancellation=True)
+            if without["final_values"] != with_["final_values"]:
+                raise RuntimeError(f"{stack.name} diverged on {trace_name} with cancellation")
+            saved = without["produce_value_calls"] - with_["produce_value_calls"]
+            results.setdefault(trace_name, {})[stack.name] = {
+                "keystrokes": len(trace),
+                "produce_value_without_cancellation": without["produce_value_calls"],
+                "produce_value_with_cancellation": with_["produce_value_calls"],
+                "cancelled_pushes": with_["cancellations"],
+                "fraction_saved": saved / without["produce_value_calls"],
+            }
+    return results
+
+
+if __name__ == "__main__":
+    for trace_name, by_stack in report().items():
+        for stack_name, row in by_stack.items():
+            print(
+                f"{trace_name:>8} {stack_name:>13}: "
+                f"{row['keystrokes']} keystrokes, "
+                f"{row['produce_value_without_cancellation']} -> "
+                f"{row['produce_value_with_cancellation']} produce_value calls "
+                f"({row['fraction_saved']:.0%} saved, "
+                f"{row['cancelled_pushes']} pushes cancelled)"
+            )
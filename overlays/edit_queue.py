@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import sys
+from typing import Dict, Optional
+
+from wrap_memory import ClassGrandparentsEnv, Code, Module
+
+
+# An asyncio edit queue that sits in front of the `wrap_memory.py` env stack.
+#
+# Unsaved edits are debounced per module: each new edit of a module replaces
+# the pending text and restarts that module's timer, and only when the module
+# has been quiet for `window` seconds do we push the latest text as unsaved
+# content. Saved edits are pushed right away.
+#
+# Ordering between the two kinds of edits only matters within a module. A save
+# of module `m` supersedes any unsaved text of `m` still waiting in the queue,
+# since the editor only saves its current buffer; unsaved edits of `m` that
+# arrive later are queued behind the save as usual. Pending unsaved edits of
+# *other* modules can stay pending across the save: saved values never depend
+# on unsaved ones, and `wrap_memory.py` already pushes newly-saved content into
+# the unsaved tables of every unsaved module when the pending edit eventually
+# lands. This is exactly the "save b.py while a.py is unsaved" use case.
+
+
+@dataclasses.dataclass
+class EditQueueMetrics:
+    # modules with unsaved text waiting for their window to elapse
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    unsaved_edits_received: int = 0
+    unsaved_pushes: int = 0
+    saved_pushes: int = 0
+    # unsaved pushes that raised, e.g. on a half-typed buffer that does not
+    # parse; the next edit of the module is pushed as usual
+    failed_pushes: int = 0
+    # unsaved edits that were dropped because a save of the same module
+    # arrived while they were still pending
+    unsaved_edits_superseded_by_save: int = 0
+
+    @property
+    def coalescing_ratio(self) -> float:
+        """Unsaved edits received per unsaved push actually performed."""
+        if self.unsaved_pushes == 0:
+            return 0.0
+        return self.unsaved_edits_received / self.unsaved_pushes
+
+
+class EditQueue:
+    env: ClassGrandparentsEnv
+    window: float
+    pending: Dict[Module, Code]
+    timers: Dict[Module, asyncio.TimerHandle]
+    metrics: EditQueueMetrics
+
+    def __init__(self, env: ClassGrandparentsEnv, window: float = 0.05) -> None:
+        self.env = env
+        self.window = window
+        self.pending = {}
+        self.timers = {}
+        self.metrics = EditQueueMetrics()
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def idle(self) -> asyncio.Event:
+        # Created lazily so that the queue can be constructed outside of a
+        # running event loop.
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._idle
+
+    def submit(self, module: Module, code: Code, is_saved_content: bool) -> None:
+        if is_saved_content:
+            if self._cancel_pending(module):
+                self.metrics.unsaved_edits_superseded_by_save += 1
+            try:
+                # A save that raises is the caller's to handle.
+                self.env.update(module, code, is_saved_content=True)
+                self.metrics.saved_pushes += 1
+            finally:
+                self._record_depth()
+        else:
+            self.metrics.unsaved_edits_received += 1
+            self._cancel_pending(module)
+            self.pending[module] = code
+            self.timers[module] = asyncio.get_running_loop().call_later(
+                self.window, self._flush, module
+            )
+            self._record_depth()
+
+    def flush(self, module: Module) -> None:
+        """Push the pending unsaved edit of `module` (if any) right away."""
+        if module in self.pending:
+            self.timers.pop(module).cancel()
+            self._flush(module)
+
+    def drain(self) -> None:
+        """Push every pending unsaved edit now, without waiting for its window."""
+        for module in list(self.pending):
+            self.flush(module)
+
+    async def wait_idle(self) -> None:
+        """Wait until every pending unsaved edit has been pushed."""
+        await self.idle.wait()
+
+    def _flush(self, module: Module) -> None:
+        self.timers.pop(module, None)
+        code = self.pending.pop(module)
+        try:
+            self.env.update(module, code, is_saved_content=False)
+            self.metrics.unsaved_pushes += 1
+        except Exception as exception:
+            # This usually runs from a timer, where there is nobody to raise
+            # to, so just log it and move on.
+            self.metrics.failed_pushes += 1
+            print(f"unsaved push of {module} failed: {type(exception).__name__}: {exception}", file=sys.stderr)
+        finally:
+            self._record_depth()
+
+    def _cancel_pending(self, module: Module) -> bool:
+        timer = self.timers.pop(module, None)
+        if timer is None:
+            return False
+        timer.cancel()
+        del self.pending[module]
+        return True
+
+    def _record_depth(self) -> None:
+        self.metrics.queue_depth = len(self.pending)
+        self.metrics.max_queue_depth = max(
+            self.metrics.max_queue_depth, self.metrics.queue_depth
+        )
+        if self.pending:
+            self.idle.clear()
+        else:
+            self.idle.set()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Measure the per-call overhead of `EnvTable.get` in each prototype, i.e. what
+the framework costs on top of `produce_value`, on the class parents layer:
+
+- hit: `get` of a cached key.
+- miss: `get` of a new key, with `produce_value` replaced by a stub that
+  returns right away, so only dependency tracking, cache lookups and stores
+  and building the upstream getter are left.
+- upstream: like miss, but the stub reads one cached key of the upstream
+  layer through whatever the prototype hands `produce_value`, which adds
+  the `upstream_get`/`read_only` chain and the upstream `get` on top.
+
+Each measurement runs `calls` calls per repetition, after `warmup`
+repetitions that are thrown away, with the garbage collector off. Repetitions
+further than 3 median absolute deviations from the median are dropped as
+outliers, and the median of the rest is what a process measured. That is
+repeated in `processes` fresh processes, and the median over them is
+reported in ns per call.
+
+`--save BASELINE` writes the results as JSON, and `--check BASELINE` fails
+(with exit status 1) if any median got more than `--threshold` (20% by
+default) slower than in the baseline, so hot path optimizations can be proven
+and kept.
+
+Numbers from a busy or virtualized machine can move by 2x from one minute
+to the next; only compare runs from the same quiet machine.
+
+Run it with `python get_overhead_benchmark.py [--calls N] [--repetitions N]
+[--processes N] [--save BASELINE | --check BASELINE [--threshold 0.2]]
+[prototype ...]`.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import multiprocessing
+import statistics
+import sys
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+import basic
+import factor_out_memory
+import overlay_keys
+import read_only
+import read_only_overlay
+import wrap_env
+import wrap_memory
+from synthetic_codebase import ProjectShape, generate
+
+
+PROTOTYPES: Dict[str, ModuleType] = {
+    "basic": basic,
+    "read_only": read_only,
+    "factor_out_memory": factor_out_memory,
+    "read_only_overlay": read_only_overlay,
+    "wrap_env": wrap_env,
+    "overlay_keys": overlay_keys,
+    "wrap_memory": wrap_memory,
+}
+
+SCENARIOS = ["hit", "miss", "upstream"]
+
+HIT_KEY = "m1.C0"
+
+
+def _layer(module: ModuleType) -> Any:
+    if module is factor_out_memory:
+        # The code env is a singleton that outlives its stack.
+        factor_out_memory.WritableCodeEnv._writable_code_env = None
+    _, _, _, class_parents_env, _ = module.create_env_stack(code=dict(generate(ProjectShape(modules=4)).code))
+    return class_parents_env
+
+
+def _getter(module: ModuleType, env: Any) -> Callable[[str], Any]:
+    # Every call registers a dependency, like the `get`s of the layer below
+    # do.
+    if module is wrap_memory:
+        return lambda key: env.get(key, "dependent", True)
+    return lambda key: env.get(key, "dependent")
+
+
+@contextlib.contextmanager
+def stubbed_produce_value(module: ModuleType, reads_upstream: bool) -> Iterator[None]:
+    cls = module.ClassParentsEnv
+    original = cls.__dict__["produce_value"]
+    if module is basic:
+        # `basic.py` uses plain methods, which reach upstream themselves.
+        def stub(self: Any, key: str) -> Any:
+            if reads_upstream:
+                self.upstream_env.get(HIT_KEY, dependency=key)
+            return []
+        setattr(cls, "produce_value", stub)
+    else:
+        def static_stub(key: str, upstream_get: Any, *args: Any, **kwargs: Any) -> Any:
+            if reads_upstream:
+                upstream_get(HIT_KEY, dependency=key)
+            return []
+        setattr(cls, "produce_value", staticmethod(static_stub))
+    try:
+        yield
+    finally:
+        setattr(cls, "produce_value", original)
+
+
+def without_outliers(samples: List[float]) -> List[float]:
+    median = statistics.median(samples)
+    deviation = statistics.median(abs(sample - median) for sample in samples)
+    if deviation == 0:
+        return samples
+    return [sample for sample in samples if abs(sample - median) <= 3 * deviation]
+
+
+def sample(run: Callable[[Sequence[str]], None], batches: List[Sequence[str]], warmup: int) -> Dict[str, float]:
+    """Time `run` on each batch of keys; the first `warmup` batches only warm up."""
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for index, batch in enumerate(batches):
+            start = time.perf_counter_ns()
+            run(batch)
+            elapsed = time.perf_counter_ns() - start
+            if index >= warmup:
+                samples.append(elapsed / len(batch))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    kept = without_outliers(samples)
+    return {
+        "median_ns": statistics.median(kept),
+        "min_ns": min(kept),
+        "mad_ns": statistics.median(abs(sample - statistics.median(kept)) for sample in kept),
+        "outliers": len(samples) - len(kept),
+    }
+
+
+def measure(module: ModuleType, calls: int = 2000, warmup: int = 3, repetitions: int = 15) -> Dict[str, Dict[str, float]]:
+    results = {}
+    rounds = warmup + repetitions
+
+    env = _layer(module)
+    get = _getter(module, env)
+    get(HIT_KEY)
+
+    def run(batch: Sequence[str]) -> None:
+        for key in batch:
+            get(key)
+
+    results["hit"] = sample(run, [[HIT_KEY] * calls] * rounds, warmup)
+
+    for scenario in ["miss", "upstream"]:
+        env = _layer(module)
+        get = _getter(module, env)
+        # warm the upstream layer for the stub
+        get(HIT_KEY)
+        fresh = [f"n{round}.C{call}" for round in range(rounds) for call in range(calls)]
+        with stubbed_produce_value(module, reads_upstream=scenario == "upstream"):
+            results[scenario] = sample(
+                run,
+                [fresh[round * calls:(round + 1) * calls] for round in range(rounds)],
+                warmup,
+            )
+    return results
+
+
+def _measure_all(
+    prototypes: Sequence[str],
+    calls: int,
+    warmup: int,
+    repetitions: int,
+) -> Dict[str, Dict[str, Dict[str, float]]]:
+    return {name: measure(PROTOTYPES[name], calls, warmup, repetitions) for name in prototypes}
+
+
+def report(
+    prototypes: Sequence[str] = tuple(PROTOTYPES),
+    calls: int = 2000,
+    warmup: int = 3,
+    repetitions: int = 15,
+    processes: int = 5,
+) -> Dict[str, Dict[str, Dict[str, float]]]:
+    if processes <= 0:
+        return _measure_all(prototypes, calls, warmup, repetitions)
+    # How a process lays out its dicts and sets (hash seed, allocator state)
+    # moves these numbers by far more than the noise within the process, so
+    # every process only contributes one sample: the median of its
+    # repetitions. The processes run one after the other.
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(processes):
+        with context.Pool(1) as pool:
+            runs.append(pool.apply(_measure_all, (prototypes, calls, warmup, repetitions)))
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for name in prototypes:
+        results[name] = {}
+        for scenario in SCENARIOS:
+            medians = [run[name][scenario]["median_ns"] for run in runs]
+            median = statistics.median(medians)
+            results[name][scenario] = {
+                "median_ns": median,
+                "min_ns": min(run[name][scenario]["min_ns"] for run in runs),
+                "mad_ns": statistics.median(abs(sample - median) for sample in medians),
+                "outliers": sum(run[name][scenario]["outliers"] for run in runs),
+            }
+    return results
+
+
+def check(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    threshold: float = 0.2,
+) -> List[str]:
+    """The measurements that are more than `threshold` slower than in `baseline`."""
+    regressions = []
+    for name, scenarios in results.items():
+        for scenario, row in scenarios.items():
+            before = baseline.get(name, {}).get(scenario)
+            if before is not None and row["median_ns"] > (1 + threshold) * before["median_ns"]:
+                regressions.append(
+                    f"{name} {scenario}: {before['median_ns']:.0f}ns -> {row['median_ns']:.0f}ns"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-call overhead of EnvTable.get")
+    parser.add_argument("prototypes", nargs="*", help=f"any of {', '.join(PROTOTYPES)} (default: all)")
+    parser.add_argument("--calls", type=int, default=2000, help="calls per repetition")
+    parser.add_argument("--repetitions", type=int, default=15)
+    parser.add_argument("--processes", type=int, default=5, help="fresh processes to measure in (0: this one)")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--check", help="compare the results with this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown relative to the baseline")
+    arguments = parser.parse_args()
+
+    results = report(
+        arguments.prototypes or list(PROTOTYPES),
+        arguments.calls,
+        repetitions=arguments.repetitions,
+        processes=arguments.processes,
+    )
+    for name, scenarios in results.items():
+        print(f"{name:>18}: " + ", ".join(
+            f"{scenario} {row['median_ns']:.0f}ns (±{row['mad_ns']:.0f})"
+            for scenario, row in scenarios.items()
+        ))
+    if arguments.save is not None:
+        with open(arguments.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if arguments.check is not None:
+        with open(arguments.check) as f:
+            regressions = check(results, json.load(f), arguments.threshold)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Find the hubs of an env stack: the keys whose edits fan out the furthest,
+so that we know which of them (typically base classes that everything
+inherits from) need special handling.
+
+The dependency maps of the layers (`key -> keys of the next layer up whose
+value read it`) form one DAG over (layer, key). For every class key we
+report:
+
+- direct: how many keys read it,
+- transitive: how many keys a push starting from it reaches, across all the
+  layers above.
+
+Module keys (of the code and ast layers) are covered by the edits instead,
+i.e. what saving an edit of each module would recompute: the keys a push
+from its code reaches, per layer, and the expected time of that, from
+the mean `produce_value` time of each layer (`wrap_memory.py`'s table stats,
+which include the upstream `get`s, so this is on the high side) when the
+stack has them.
+
+Only the saved DAG is followed; `unsaved=True` follows the unsaved edges of
+`wrap_memory.py` too. Dependents of the top layer are whoever queried it,
+not keys, so they are left out.
+
+`history` replays a `session_trace.py` trace and analyzes the stack every
+`every` operations, and `compare` tells how the hubs changed between two
+analyses.
+
+Run it with `python hub_analysis.py [TRACE] [--prototype NAME] [--every N]
+[--top N]`; without a trace it records a made-up typing session on a
+synthetic project.
+"""
+import argparse
+import io
+import json
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from memory_report import layers
+from scaling_benchmark import PROTOTYPES
+from session_trace import apply, read_trace, record_typing_session
+
+
+Node = Tuple[int, str]
+
+
+def _dependency_maps(env: Any, unsaved: bool) -> List[Dict[str, Set[Any]]]:
+    holder = getattr(env, "writable_env", None) or env
+    maps = [holder.dependencies]
+    if unsaved and hasattr(holder, "unsaved_dependencies"):
+        maps.append(holder.unsaved_dependencies)
+    return maps
+
+
+def dependency_graph(env: Any, unsaved: bool = False) -> Tuple[List[str], Dict[Node, Set[Node]]]:
+    """The layers of the stack of `env` from the code up, and its edges."""
+    envs = layers(env)
+    graph: Dict[Node, Set[Node]] = {}
+    # The top layer's dependents are not keys.
+    for index, layer_env in enumerate(envs[:-1]):
+        for dependencies in _dependency_maps(layer_env, unsaved):
+            for key, dependents in dependencies.items():
+                graph.setdefault((index, key), set()).update(
+                    (index + 1, dependent) for dependent in dependents if isinstance(dependent, str)
+                )
+    return [type(layer_env).__name__ for layer_env in envs], graph
+
+
+def _reachable(graph: Dict[Node, Set[Node]], start: Node) -> Set[Node]:
+    seen: Set[Node] = set()
+    stack = list(graph.get(start, ()))
+    while stack:
+        node = stack.pop()
+        if node not in seen:
+            seen.add(node)
+            stack.extend(graph.get(node, ()))
+    return seen
+
+
+def _mean_produce_value_ms(env: Any) -> Optional[List[float]]:
+    means = []
+    for layer_env in layers(env):
+        stats = getattr(getattr(layer_env, "writable_env", None), "saved_stats", None)
+        if stats is None:
+            return None
+        means.append(stats.produce_value_ns / stats.produce_value_calls / 1e6 if stats.produce_value_calls else 0.0)
+    return means
+
+
+def analyze(env: Any, top: int = 10, unsaved: bool = False) -> Dict[str, Any]:
+    names, graph = dependency_graph(env, unsaved)
+    reachable = {node: _reachable(graph, node) for node in graph}
+    hubs = sorted(
+        (
+            {"layer": names[index], "key": key, "direct": len(graph[(index, key)]), "transitive": len(nodes)}
+            for (index, key), nodes in reachable.items()
+            if "." in key
+        ),
+        key=lambda row: (-row["transitive"], -row["direct"], row["layer"], row["key"]),
+    )
+    means = _mean_produce_value_ms(env)
+    edits = []
+    for (index, module), nodes in reachable.items():
+        if index != 0:
+            continue
+        recomputed = {name: 0 for name in names[1:]}
+        for node_index, _ in nodes:
+            recomputed[names[node_index]] += 1
+        edits.append({
+            "module": module,
+            "recomputed": recomputed,
+            "keys": len(nodes),
+            "expected_ms": (
+                None if means is None else sum(means[node_index] for node_index, _ in nodes)
+            ),
+        })
+    edits.sort(key=lambda row: (-row["keys"], row["module"]))
+    return {
+        "keys": len(graph),
+        "edges": sum(len(dependents) for dependents in graph.values()),
+        "hubs": hubs[:top],
+        "edits": edits[:top],
+    }
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """How the hubs of `after` ranked and fanned out in `before`, and the
+    hubs of `before` that dropped out of the top."""
+    def ranks(analysis: Dict[str, Any]) -> Dict[Tuple[str, str], Tuple[int, Dict[str, Any]]]:
+        return {(row["layer"], row["key"]): (rank, row) for rank, row in enumerate(analysis["hubs"])}
+
+    old, new = ranks(before), ranks(after)
+    changes = []
+    for hub in [*new, *(hub for hub in old if hub not in new)]:
+        old_rank, old_row = old.get(hub, (None, None))
+        new_rank, new_row = new.get(hub, (None, None))
+        changes.append({
+            "layer": hub[0],
+            "key": hub[1],
+            "rank": [old_rank, new_rank],
+            "transitive": [
+                old_row["transitive"] if old_row else None,
+                new_row["transitive"] if new_row else None,
+            ],
+        })
+    return changes
+
+
+def history(
+    trace: Iterable[str],
+    prototype: str = "wrap_memory",
+    every: int = 100,
+    top: int = 10,
+    unsaved: bool = False,
+) -> List[Dict[str, Any]]:
+    """Replay `trace` and analyze the stack every `every` operations, and
+    after the last one."""
+    code, operations = read_trace(trace)
+    session = PROTOTYPES[prototype](code)
+    snapshots = []
+    for index, operation in enumerate(operations, 1):
+        try:
+            apply(session, operation)
+        except Exception:
+            # e.g. a half-typed class; see `session_trace.replay`.
+            pass
+        if index % every == 0 or index == len(operations):
+            snapshots.append(dict(analyze(session.env, top, unsaved), operation=index))
+    return snapshots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the keys whose edits fan out the furthest")
+    parser.add_argument("trace", nargs="?", help="a session_trace.py trace (default: a made-up typing session)")
+    parser.add_argument("--prototype", default="wrap_memory", help=f"any of {', '.join(PROTOTYPES)}")
+    parser.add_argument("--every", type=int, default=100, help="operations between analyses")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--unsaved", action="store_true", help="also follow unsaved dependency edges")
+    arguments = parser.parse_args()
+
+    if arguments.trace is None:
+        log = io.StringIO()
+        record_typing_session(log)
+        lines: List[str] = log.getvalue().splitlines()
+    else:
+        with open(arguments.trace) as f:
+            lines = f.readlines()
+    snapshots = history(lines, arguments.prototype, arguments.every, arguments.top, arguments.unsaved)
+    json.dump(
+        {
+            "snapshots": snapshots,
+            "changes": compare(snapshots[0], snapshots[-1]),
+        },
+        sys.stdout,
+        indent=2,
+    )
+    print()
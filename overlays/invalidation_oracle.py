@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Measure how much each prototype over-invalidates: for an edit of a warm
+stack, compare the keys each layer actually recomputed with the keys whose
+values really changed.
+
+The oracle computes every value of every layer from scratch (with
+`basic.py`) before and after the edit, and diffs them; trees and class bodies
+are compared with `ast.dump`, so e.g. an edit of a comment changes nothing
+past the code. An unsaved edit only changes what the edited view shows: the
+keys of the edited module (keys of other modules keep reading saved
+contents in every prototype with unsaved views). The prototypes without one
+apply the edit as a save, so they are held to the saved oracle.
+
+Recomputed keys are the keys passed to `produce_value` while pushing the edit
+and then looking at the grandparents of every class in the edited view, so
+lazy prototypes get charged for what they compute on demand. Per layer we
+report:
+
+- changed: keys whose values changed,
+- recomputed: distinct keys recomputed (calls counts repeats too),
+- wasted: recomputed keys whose values did not change,
+- missed: changed keys that were not recomputed (0 unless something is stale),
+- over_invalidation: wasted / recomputed.
+
+Edits come from a corpus over a `synthetic_codebase.py` project: a comment in
+a module in the middle, giving one of its classes another base, and giving a
+hub base class another base, each saved and unsaved, and the hub edit saved
+while a few other buffers are open.
+
+Run it with `python invalidation_oracle.py [modules] [classes_per_module]`.
+"""
+import ast
+import contextlib
+import sys
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Type
+
+import basic
+from scaling_benchmark import PROTOTYPES, Session
+from synthetic_codebase import ProjectShape, SyntheticProject, generate
+
+
+LAYERS = ["ast", "class_body", "parents", "grandparents"]
+
+# What a layer holds for a key it cannot find (e.g. a deleted class).
+_MISSING = object()
+
+
+def _comparable(value: Any) -> Any:
+    if isinstance(value, ast.AST):
+        return ast.dump(value)
+    return value
+
+
+def _class_keys(code: Dict[str, str]) -> List[str]:
+    return [
+        f"{module}.{class_def.name}"
+        for module, text in code.items()
+        for class_def in ast.parse(text).body
+        if isinstance(class_def, ast.ClassDef)
+    ]
+
+
+def values(code: Dict[str, str], keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Every value of every layer, from scratch."""
+    _, ast_env, class_body_env, class_parents_env, class_grandparents_env = basic.create_env_stack(dict(code))
+    result: Dict[str, Dict[str, Any]] = {
+        "ast": {module: _comparable(ast_env.get(module, "")) for module in code},
+    }
+    for layer, env in [
+        ("class_body", class_body_env),
+        ("parents", class_parents_env),
+        ("grandparents", class_grandparents_env),
+    ]:
+        result[layer] = {}
+        for key in keys:
+            try:
+                result[layer][key] = _comparable(env.get(key, ""))
+            except Exception:
+                # e.g. the parents of a class that does not exist
+                result[layer][key] = _MISSING
+    return result
+
+
+def changed_keys(
+    code: Dict[str, str],
+    module: str,
+    text: str,
+    saved: bool,
+) -> Dict[str, Set[str]]:
+    """The keys of each layer whose values the edit changes, in the edited view."""
+    edited = dict(code, **{module: text})
+    keys = sorted(set(_class_keys(code)) | set(_class_keys(edited)))
+    before = values(code, keys)
+    after = values(edited, keys)
+    changed = {}
+    for layer in LAYERS:
+        changed[layer] = {
+            key
+            for key in set(before[layer]) | set(after[layer])
+            if before[layer].get(key, _MISSING) != after[layer].get(key, _MISSING)
+            and (saved or key.split(".")[0] == module)
+        }
+    return changed
+
+
+@contextlib.contextmanager
+def recording_produce_value(module: ModuleType, recomputed: Dict[str, List[str]]) -> Iterator[None]:
+    classes = dict(zip(LAYERS, [module.AstEnv, module.ClassBodyEnv, module.ClassParentsEnv, module.ClassGrandparentsEnv]))
+    originals = {cls: cls.__dict__["produce_value"] for cls in classes.values()}
+
+    def recorded(layer: str, produce_value: Callable[..., Any], is_method: bool) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            recomputed[layer].append(args[1] if is_method else args[0])
+            return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        for layer, cls in classes.items():
+            original = originals[cls]
+            # `basic.py` uses plain methods, the others static methods.
+            if isinstance(original, staticmethod):
+                setattr(cls, "produce_value", staticmethod(recorded(layer, original.__func__, False)))
+            else:
+                setattr(cls, "produce_value", recorded(layer, original, True))
+        yield
+    finally:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", original)
+
+
+def measure(
+    session_class: Type[Session],
+    code: Dict[str, str],
+    module: str,
+    text: str,
+    saved: bool,
+    open_buffers: Sequence[str] = (),
+) -> Dict[str, Dict[str, Any]]:
+    session = session_class(code)
+    keys = _class_keys(code)
+    for key in keys:
+        session.query(key)
+    # Buffers only get a comment, so that they do not change what the oracle
+    # expects; they only give the edit more tables to reach.
+    for buffer in open_buffers:
+        session.edit(buffer, code[buffer] + "# opened\n")
+        for key in keys:
+            session.query(key)
+    # Without an unsaved view, an unsaved edit is a save.
+    saved = saved or not session_class.has_overlays
+
+    recomputed: Dict[str, List[str]] = {layer: [] for layer in LAYERS}
+    with recording_produce_value(session_class.module, recomputed):
+        if saved:
+            session.save(module, text)
+        else:
+            session.edit(module, text)
+        for key in _class_keys(dict(code, **{module: text})):
+            session.query(key)
+
+    changed = changed_keys(code, module, text, saved)
+    result = {}
+    for layer in LAYERS:
+        distinct = set(recomputed[layer])
+        wasted = len(distinct - changed[layer])
+        result[layer] = {
+            "changed": len(changed[layer]),
+            "recomputed": len(distinct),
+            "calls": len(recomputed[layer]),
+            "wasted": wasted,
+            "missed": len(changed[layer] - distinct),
+            "over_invalidation": wasted / len(distinct) if distinct else 0.0,
+        }
+    return result
+
+
+Edit = Tuple[str, str, bool, Sequence[str]]
+
+
+def corpus(project: SyntheticProject) -> Dict[str, Edit]:
+    middle = f"m{project.shape.modules // 2}"
+    edits = {
+        "comment": (middle, project.code[middle] + "# a comment\n"),
+        "rebase": (middle, project.edit(middle, 0)),
+        "hub": ("m0", project.edit("m0", 0)),
+    }
+    result: Dict[str, Edit] = {
+        f"{name} ({'saved' if saved else 'unsaved'})": (module, text, saved, ())
+        for name, (module, text) in edits.items()
+        for saved in [False, True]
+    }
+    # Only for saves: with several unsaved buffers, the prototypes do not
+    # agree on what an unsaved edit should change (`wrap_env.py`'s overlays
+    # do not see each other).
+    buffers = ["m1", "m2", middle]
+    result[f"hub (saved, {len(buffers)} buffers open)"] = ("m0", project.edit("m0", 0), True, buffers)
+    return result
+
+
+def report(
+    shape: ProjectShape = ProjectShape(modules=20),
+    prototypes: Optional[List[str]] = None,
+) -> Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]:
+    project = generate(shape)
+    return {
+        edit: {
+            name: measure(PROTOTYPES[name], project.code, module, text, saved, open_buffers)
+            for name in prototypes or list(PROTOTYPES)
+        }
+        for edit, (module, text, saved, open_buffers) in corpus(project).items()
+    }
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    modules, classes_per_module = arguments + [20, 10][len(arguments):]
+    print(f"{modules} modules of {classes_per_module} classes")
+    for edit, by_prototype in report(ProjectShape(modules=modules, classes_per_module=classes_per_module)).items():
+        print(edit)
+        for name, layers in by_prototype.items():
+            print(f"  {name:>18}: " + ", ".join(
+                f"{layer} {row['recomputed']}/{row['changed']}"
+                + (f" ({row['over_invalidation']:.0%} wasted)" if row["wasted"] else "")
+                + (f" in {row['calls']} calls" if row["calls"] > row["recomputed"] else "")
+                + (f" MISSED {row['missed']}" if row["missed"] else "")
+                for layer, row in layers.items()
+            ))
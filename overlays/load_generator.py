@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from server import Server, encode_message, read_message, serve_unix
+from wrap_memory import Code, Module
+
+
+# Load generation for `server.py`: a number of simulated editors connect to a
+# server over a Unix socket, each typing into its own module and pipelining
+# queries about that module (focused) and about other modules (background).
+# We report p50/p99 latency per query, split by focused vs background.
+#
+# Run it with `python load_generator.py --editors 8 --edits 50`.
+
+
+class EditorClient:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.responses: Dict[int, asyncio.Future] = {}
+        self.sent_at: Dict[int, float] = {}
+        self.listener = asyncio.ensure_future(self.listen())
+
+    @staticmethod
+    async def connect(path: str) -> EditorClient:
+        reader, writer = await asyncio.open_unix_connection(path)
+        return EditorClient(reader, writer)
+
+    async def listen(self) -> None:
+        while True:
+            message = await read_message(self.reader)
+            if message is None:
+                return
+            # resolve with the response and how long it took to arrive
+            latency = time.perf_counter() - self.sent_at.pop(message["id"])
+            self.responses.pop(message["id"]).set_result((message, latency))
+
+    def notify(self, method: str, params: Dict[str, Any]) -> None:
+        self.writer.write(encode_message({"jsonrpc": "2.0", "method": method, "params": params}))
+
+    def request(self, method: str, params: Dict[str, Any]) -> asyncio.Future:
+        id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.responses[id] = future
+        self.sent_at[id] = time.perf_counter()
+        self.writer.write(encode_message({"jsonrpc": "2.0", "id": id, "method": method, "params": params}))
+        return future
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.listener.cancel()
+
+
+def project(module_count: int, classes_per_module: int) -> Dict[Module, Code]:
+    # Every module's first class inherits from a shared hub, and the others
+    # from the previous class in the module or in the previous module.
+    code = {"hub": "class Base: pass\nclass Mixin(hub.Base): pass\n"}
+    for index in range(module_count):
+        lines = []
+        for class_index in range(classes_per_module):
+            if class_index == 0:
+                base = "hub.Mixin"
+            elif index > 0 and class_index % 3 == 0:
+                base = f"m{index - 1}.C{class_index}"
+            else:
+                base = f"m{index}.C{class_index - 1}"
+            lines.append(f"class C{class_index}({base}): pass")
+        code[f"m{index}"] = "\n".join(lines) + "\n"
+    return code
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def editor(
+    path: str,
+    editor_index: int,
+    code: Dict[Module, Code],
+    edits: int,
+    queries_per_edit: int,
+    think_time: float,
+    latencies: Dict[str, List[float]],
+) -> None:
+    rng = random.Random(editor_index)
+    own_module = f"m{editor_index}"
+    other_modules = [module for module in code if module.startswith("m") and module != own_module]
+    class_count = code[own_module].count("class ")
+    client = await EditorClient.connect(path)
+    client.notify("textDocument/didOpen", {"module": own_module, "text": code[own_module]})
+    text = code[own_module]
+    pending: List[Tuple[str, asyncio.Future]] = []
+    for edit in range(edits):
+        # typing into a trailing comment keeps every snapshot parseable
+        text += "#" if edit % 20 else "\n#"
+        client.notify("textDocument/didChange", {"module": own_module, "text": text})
+        for _ in range(queries_per_edit):
+            method = rng.choice(["grandparents", "parents", "class_body"])
+            focused = rng.random() < 0.5 or not other_modules
+            target = own_module if focused else rng.choice(other_modules)
+            key = f"{target}.C{rng.randrange(class_count)}"
+            kind = f"{method}/{'focused' if focused else 'background'}"
+            pending.append((kind, client.request(method, {"key": key})))
+        await asyncio.sleep(think_time)
+    for kind, future in pending:
+        response, latency = await future
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        latencies.setdefault(kind, []).append(latency)
+    client.notify("textDocument/didClose", {"module": own_module})
+    await client.close()
+
+
+async def run(
+    editors: int,
+    edits: int,
+    queries_per_edit: int,
+    think_time: float,
+    window: float,
+    classes_per_module: int,
+    socket_path: Optional[str] = None,
+) -> Dict[str, Dict[str, float]]:
+    code = project(module_count=max(editors, 2), classes_per_module=classes_per_module)
+    server = Server(dict(code), window=window)
+    # Warm up the saved stack so that the benchmark measures incremental work.
+    for module, text in code.items():
+        for line in text.splitlines():
+            server.grandparents(f"{module}.{line.split()[1].split('(')[0].rstrip(':')}")
+
+    worker = asyncio.ensure_future(server.worker())
+    with tempfile.TemporaryDirectory() as directory:
+        path = socket_path or os.path.join(directory, "server.sock")
+        unix_server = await serve_unix(server, path)
+        latencies: Dict[str, List[float]] = {}
+        await asyncio.gather(*(
+            editor(path, index, code, edits, queries_per_edit, think_time, latencies)
+            for index in range(editors)
+        ))
+        unix_server.close()
+        await unix_server.wait_closed()
+    worker.cancel()
+
+    report = {}
+    for kind, samples in sorted(latencies.items()):
+        report[kind] = {
+            "count": len(samples),
+            "p50_ms": 1000 * percentile(samples, 0.50),
+            "p99_ms": 1000 * percentile(samples, 0.99),
+        }
+    report["edit_queue"] = {
+        "max_queue_depth": server.edit_queue.metrics.max_queue_depth,
+        "coalescing_ratio": server.edit_queue.metrics.coalescing_ratio,
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure server.py latency under concurrent editors")
+    parser.add_argument("--editors", type=int, default=8)
+    parser.add_argument("--edits", type=int, default=50)
+    parser.add_argument("--queries-per-edit", type=int, default=4)
+    parser.add_argument("--think-time", type=float, default=0.005, help="seconds between edits")
+    parser.add_argument("--window", type=float, default=0.05, help="debounce window for unsaved edits")
+    parser.add_argument("--classes-per-module", type=int, default=20)
+    arguments = parser.parse_args()
+    print(json.dumps(asyncio.run(run(
+        editors=arguments.editors,
+        edits=arguments.edits,
+        queries_per_edit=arguments.queries_per_edit,
+        think_time=arguments.think_time,
+        window=arguments.window,
+        classes_per_module=arguments.classes_per_module,
+    )), indent=2))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Report where the memory of an env stack goes: per layer, and per table
+within a layer, including the dependency maps.
+
+Tables are the cache tables of each prototype: `saved` and `unsaved` (and
+the recent unsaved versions) in `wrap_memory.py`, one partition per overlay
+key in `overlay_keys.py` (`saved` is the stack itself), one map per open
+overlay in `wrap_env.py`, and the single `cached` table elsewhere; every
+prototype also has `dependencies`.
+
+Sizes are estimated by walking what a table references with
+`sys.getsizeof`. An object reachable from several tables (an `ast.ClassDef`
+that is also part of its module's tree, a subtree an overlay shares with its
+parent, an interned key) is only counted in `bytes` of the first table that
+reaches it, layers from the code up and tables in the order above; the other
+tables count it in `shared_bytes`. So `bytes` add up to what the stack
+retains, and `bytes + shared_bytes` is what a table would retain on its own.
+
+`allocations(module)` measures instead of estimating: it groups the memory
+that is still allocated by the class (or function) of the prototype's code
+that allocated it. It needs `tracemalloc` to have been started (with enough frames to
+reach the prototype's code, say 32) before the stack was built.
+
+`diff(before, after)` compares two reports, e.g. from before and after an
+edit. Reports are plain JSON so they can also be saved and diffed later.
+
+Run it with `python memory_report.py [prototype] [modules] [--tracemalloc]`
+to report on a warm stack of a synthetic project, and what an unsaved edit
+adds to it.
+"""
+import ast
+import inspect
+import json
+import sys
+import tracemalloc
+import types
+from typing import Any, Dict, List, Set, Tuple, cast
+
+from synthetic_codebase import ProjectShape, generate
+
+
+Report = Dict[str, Dict[str, Dict[str, int]]]
+
+# Not data, or shared by the whole process.
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def _upstream(env: Any) -> Any:
+    upstream = getattr(env, "upstream_env", None)
+    if upstream is None:
+        # `factor_out_memory.py` keeps it with the tables.
+        upstream = getattr(getattr(env, "writable_env", None), "upstream_env", None)
+    return upstream
+
+
+def layers(env: Any) -> List[Any]:
+    """The environments of the stack, from the code up to `env`."""
+    envs = [env]
+    while _upstream(envs[-1]) is not None:
+        envs.append(_upstream(envs[-1]))
+    return list(reversed(envs))
+
+
+def tables(env: Any) -> Dict[str, List[Any]]:
+    """The tables of one environment, each as the objects it is made of."""
+    writable_env = getattr(env, "writable_env", None)
+    if hasattr(writable_env, "unsaved_contents_cache_table"):
+        # wrap_memory.py
+        return {
+            "saved": [writable_env.saved_contents_cache_table],
+            "unsaved": [writable_env.unsaved_contents_cache_table],
+            "unsaved_versions": [writable_env.unsaved_versions],
+            "dependencies": [writable_env.dependencies],
+            "unsaved_dependencies": [writable_env.unsaved_dependencies],
+            "content_hashes": [writable_env.saved_content_hashes, writable_env.unsaved_content_hashes],
+        }
+    cache = getattr(env, "cache", None)
+    partitions = getattr(getattr(cache, "cached", None), "partitions", None)
+    if partitions is not None:
+        # overlay_keys.py: the caches are global, and overlays are partitions.
+        result = {
+            ("saved" if overlay_key is None else "overlay " + "/".join(overlay_key)): [partition]
+            for overlay_key, partition in partitions.items()
+        }
+        result["dependencies"] = [cache.dependencies, cache.edge_owners, cache.overlay_edges]
+        return result
+    holder = cache if cache is not None else writable_env if writable_env is not None else env
+    result = {"cached": [holder.cached], "dependencies": [holder.dependencies]}
+    # wrap_env.py: overlays are environments of their own.
+    for overlay_module, child in getattr(env, "children", {}).items():
+        result[f"overlay {overlay_module}"] = [child.cache.cached]
+    return result
+
+
+def _children(obj: Any) -> List[Any]:
+    if isinstance(obj, dict):
+        return [*obj.keys(), *obj.values()]
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return list(obj)
+    children = []
+    if hasattr(obj, "__dict__"):
+        children.append(obj.__dict__)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            children.append(getattr(obj, slot))
+    return children
+
+
+def _measure(roots: List[Any], owners: Set[int], opaque: Set[int]) -> Tuple[int, int]:
+    """(bytes first reached from `roots`, bytes already owned by another
+    table); marks what it reaches as owned."""
+    own = shared = 0
+    visited: Set[int] = set()
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in visited or id(obj) in opaque or isinstance(obj, _OPAQUE):
+            continue
+        visited.add(id(obj))
+        size = sys.getsizeof(obj)
+        if id(obj) in owners:
+            shared += size
+        else:
+            own += size
+            owners.add(id(obj))
+        stack.extend(_children(obj))
+    return own, shared
+
+
+def report(env: Any) -> Report:
+    """Estimate the memory of the stack of `env`, layer by layer and table by
+    table."""
+    envs = layers(env)
+    # The tables of an environment must not reach into the others (e.g. an
+    # overlay remembers its parent).
+    opaque = {id(env) for env in envs}
+    for env in envs:
+        opaque |= {id(child) for child in getattr(env, "children", {}).values()}
+    owners: Set[int] = set()
+    result: Report = {}
+    for env in envs:
+        layer = result.setdefault(type(env).__name__, {})
+        for name, roots in tables(env).items():
+            own, shared = _measure(roots, owners, opaque)
+            layer[name] = {
+                "entries": sum(len(root) for root in roots if hasattr(root, "__len__")),
+                "bytes": own,
+                "shared_bytes": shared,
+            }
+    return result
+
+
+def _definitions(filename: str) -> List[Tuple[int, int, str]]:
+    with open(filename) as f:
+        tree = ast.parse(f.read())
+    return [
+        (node.lineno, cast(int, node.end_lineno), node.name)
+        for node in tree.body
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef))
+    ]
+
+
+def allocations(module: types.ModuleType) -> Dict[str, Dict[str, int]]:
+    """The memory still allocated, grouped by the class (or function) of
+    `module` whose code allocated it, i.e. the innermost frame in `module`."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Start tracemalloc before building the stack to measure its allocations")
+    filename = cast(str, inspect.getsourcefile(module))
+    definitions = _definitions(filename)
+    result: Dict[str, Dict[str, int]] = {}
+    for statistic in tracemalloc.take_snapshot().statistics("traceback"):
+        # Frames go from the oldest to the most recent.
+        frame = next((frame for frame in reversed(statistic.traceback) if frame.filename == filename), None)
+        if frame is None:
+            continue
+        owner = next((name for start, end, name in definitions if start <= frame.lineno <= end), "<module>")
+        row = result.setdefault(owner, {"bytes": 0, "blocks": 0})
+        row["bytes"] += statistic.size
+        row["blocks"] += statistic.count
+    return result
+
+
+def diff(before: Any, after: Any) -> Any:
+    """`after - before`, for every number in either report (missing numbers
+    count as 0); entries that did not change are left out."""
+    if isinstance(before, dict) or isinstance(after, dict):
+        before = before if isinstance(before, dict) else {}
+        after = after if isinstance(after, dict) else {}
+        result = {}
+        for key in [*before, *(key for key in after if key not in before)]:
+            difference = diff(before.get(key), after.get(key))
+            if difference:
+                result[key] = difference
+        return result
+    return (after or 0) - (before or 0)
+
+
+def session_report(
+    prototype: str = "wrap_memory",
+    shape: ProjectShape = ProjectShape(modules=20),
+    use_tracemalloc: bool = False,
+) -> Dict[str, Any]:
+    """Report on a warm stack of a synthetic project, and on what an unsaved
+    edit of its middle module changes."""
+    from scaling_benchmark import PROTOTYPES
+
+    session_class = PROTOTYPES[prototype]
+    project = generate(shape)
+    measure = report if not use_tracemalloc else lambda env: allocations(session_class.module)
+    if use_tracemalloc:
+        tracemalloc.start(32)
+    try:
+        session = session_class(project.code)
+        for key in project.all_keys():
+            session.query(key)
+        warm = measure(session.env)
+        middle = f"m{shape.modules // 2}"
+        session.edit(middle, project.edit(middle, 0))
+        for key in project.classes[middle]:
+            session.query(key)
+        edited = measure(session.env)
+    finally:
+        if use_tracemalloc:
+            tracemalloc.stop()
+    return {"warm": warm, "unsaved_edit": diff(warm, edited)}
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--tracemalloc"]
+    prototype = arguments[0] if arguments else "wrap_memory"
+    modules = int(arguments[1]) if len(arguments) > 1 else 20
+    json.dump(
+        session_report(prototype, ProjectShape(modules=modules), "--tracemalloc" in sys.argv),
+        sys.stdout,
+        indent=2,
+    )
+    print()
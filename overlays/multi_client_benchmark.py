@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Measure what each extra editor client costs on top of a warm project, once
+with a full `wrap_memory.py` stack per client and once with clients attached
+to one `multi_client_memory.SharedEnvStack`.
+
+Each client opens an unsaved buffer of its own module and looks at the
+grandparents of every class in the project (the saved ones through the saved
+view, its buffer through the unsaved one). At the end one client saves a
+module near the bottom of the project, which every client has to see.
+
+Run it with `python multi_client_benchmark.py [modules] [classes] [clients]`.
+"""
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import wrap_memory
+from multi_client_memory import SharedEnvStack
+
+
+def _project(modules: int, classes: int) -> Dict[str, str]:
+    return {
+        f"m{j}": "\n".join(
+            f"class C{i}: pass" if j == 0 else f"class C{i}(m{j - 1}.C{i}): pass"
+            for i in range(classes)
+        ) + "\n"
+        for j in range(modules)
+    }
+
+
+def _warm(env: Any, code: Dict[str, str], classes: int, buffer: str) -> None:
+    for name in code:
+        for i in range(classes):
+            env.get(f"{name}.C{i}", None, use_saved_contents_of_dependents=True)
+    env.update(buffer, code[buffer] + "# opened\n", is_saved_content=False)
+    for i in range(classes):
+        env.get(f"{buffer}.C{i}", None, use_saved_contents_of_dependents=False)
+
+
+def measure(shared: bool, modules: int, classes: int, clients: int) -> Dict[str, Any]:
+    code = _project(modules, classes)
+    buffers = [f"m{2 + j % (modules - 2)}" for j in range(clients)]
+    update: Callable[[Any, str, str, bool], Any]
+    if shared:
+        stack = SharedEnvStack(dict(code))
+
+        def open_client() -> Any:
+            return stack.attach()
+
+        def update(client: Any, module: str, text: str, is_saved_content: bool) -> Any:
+            return stack.update(client, module, text, is_saved_content)
+    else:
+        def open_client() -> Any:
+            return wrap_memory.create_env_stack(code=dict(code))
+
+        def update(client: Any, module: str, text: str, is_saved_content: bool) -> Any:
+            return client[-1].update(module, text, is_saved_content)
+
+    # The first client warms up the saved tables in both setups.
+    opened: List[Tuple[Any, ...]] = [open_client()]
+    _warm(opened[0][-1], code, classes, buffers[0])
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for buffer in buffers[1:]:
+        client = open_client()
+        _warm(client[-1], code, classes, buffer)
+        opened.append(client)
+    attach_s = time.perf_counter() - start
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # `m1` stops inheriting from `m0`.
+    saved, saved_text = "m1", code["m0"]
+    start = time.perf_counter()
+    if shared:
+        update(opened[0], saved, saved_text, True)
+    else:
+        # Without shared saved tables, every client has to be told.
+        for client in opened:
+            update(client, saved, saved_text, True)
+    save_s = time.perf_counter() - start
+    final_values = [
+        client[-1].get(f"{buffer}.C{i}", None, use_saved_contents_of_dependents=False)
+        for client, buffer in zip(opened, buffers)
+        for i in range(classes)
+    ]
+
+    extra = max(clients - 1, 1)
+    return {
+        "kb_per_extra_client": (after - before) / extra / 1024,
+        "attach_ms_per_extra_client": 1e3 * attach_s / extra,
+        "save_ms": 1e3 * save_s,
+        "final_values": final_values,
+    }
+
+
+def report(modules: int = 40, classes: int = 10, clients: int = 4) -> Dict[str, Dict[str, float]]:
+    separate = measure(False, modules, classes, clients)
+    shared = measure(True, modules, classes, clients)
+    if separate.pop("final_values") != shared.pop("final_values"):
+        raise RuntimeError("the shared saved tables diverged from separate stacks")
+    return {"separate": separate, "shared": shared}
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    modules, classes, clients = arguments + [40, 10, 4][len(arguments):]
+    print(f"{modules} modules of {classes} classes, {clients} clients")
+    for name, row in report(modules, classes, clients).items():
+        print(
+            f"{name:>9}: {row['kb_per_extra_client']:.0f}KB and "
+            f"{row['attach_ms_per_extra_client']:.1f}ms per extra client, save {row['save_ms']:.1f}ms"
+        )
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from wrap_memory import (
+    AstEnv, ClassBodyEnv, ClassGrandparentsEnv, ClassParentsEnv, Code, CodeEnv, Dependents,
+    EnvTable, LayerCachePolicy, Module, RequestScope, WritableEnv, make_cache_table,
+)
+
+
+# Several editor clients (say, an IDE and a code review tool) attached to the
+# same checkout, on top of the `wrap_memory.py` env stack.
+#
+# Saved values do not depend on anyone's unsaved text, so there is one set of
+# saved tables (and one saved dependency DAG) for everybody. Each client gets
+# its own `WritableEnv`s that share those, and own everything unsaved: the
+# unsaved tables, `unsaved_modules`, the unsaved DAG, dirty keys and version
+# rings. So each client also gets its own env stack, which is just a handful
+# of objects.
+#
+# Unsaved edits only ever touch the client's own tables. A saved edit is
+# pushed through the stack of the client that saved, which recomputes the
+# saved tables and its own unsaved values, and then fans out to every other
+# client with `EnvTable.follow_saved_push`, which only recomputes the unsaved
+# values that read the new saved ones. A module that another client has
+# unsaved stays unsaved for that client: its buffer has not changed.
+
+
+ClientStack = Tuple[CodeEnv, AstEnv, ClassBodyEnv, ClassParentsEnv, ClassGrandparentsEnv]
+
+LAYERS: List[Type[EnvTable[Any]]] = [CodeEnv, AstEnv, ClassBodyEnv, ClassParentsEnv, ClassGrandparentsEnv]
+
+
+class SharedEnvStack:
+    saved_envs: List[WritableEnv[Any]]
+    unsaved_policies: List[LayerCachePolicy]
+    max_unsaved_versions: int
+    clients: List[ClientStack]
+
+    def __init__(
+        self,
+        code: Dict[Module, Code],
+        cache_policies: Optional[Dict[Type[EnvTable[Any]], LayerCachePolicy]] = None,
+        max_unsaved_versions: int = 8,
+    ) -> None:
+        cache_policies = cache_policies or {}
+        if CodeEnv in cache_policies:
+            raise ValueError("The code environment holds the code itself, so it cannot be configured")
+        RequestScope.reset()
+        layer_policies = [cache_policies.get(layer, LayerCachePolicy()) for layer in LAYERS]
+        # Only the saved halves of these are ever used.
+        self.saved_envs = [WritableEnv[Code](saved_contents_cache_table=code)] + [
+            WritableEnv.with_cache_policy(policy)
+            for policy in layer_policies[1:]
+        ]
+        self.unsaved_policies = layer_policies
+        self.max_unsaved_versions = max_unsaved_versions
+        self.clients = []
+
+    def attach(self) -> ClientStack:
+        writable_envs = [
+            WritableEnv[Any](
+                saved_contents_cache_table=saved_env.saved_contents_cache_table,
+                dependencies=saved_env.dependencies,
+                saved_content_hashes=saved_env.saved_content_hashes,
+                saved_cache_policy=saved_env.saved_cache_policy,
+                unsaved_contents_cache_table=make_cache_table(policy.unsaved),
+                unsaved_cache_policy=policy.unsaved,
+                max_unsaved_versions=self.max_unsaved_versions,
+            )
+            for saved_env, policy in zip(self.saved_envs, self.unsaved_policies)
+        ]
+        code_env = CodeEnv(writable_env=writable_envs[0], upstream_env=None)
+        ast_env = AstEnv(writable_env=writable_envs[1], upstream_env=code_env)
+        class_body_env = ClassBodyEnv(writable_env=writable_envs[2], upstream_env=ast_env)
+        class_parents_env = ClassParentsEnv(writable_env=writable_envs[3], upstream_env=class_body_env)
+        class_grandparents_env = ClassGrandparentsEnv(writable_env=writable_envs[4], upstream_env=class_parents_env)
+        client = (code_env, ast_env, class_body_env, class_parents_env, class_grandparents_env)
+        self.clients.append(client)
+        return client
+
+    def detach(self, client: ClientStack) -> None:
+        # Everything the client owns goes away with its stack, except for
+        # the transient tables, which are registered globally. Empty tables
+        # compare equal, so they are told apart by identity.
+        self.clients.remove(client)
+        tables = {id(env.writable_env.unsaved_contents_cache_table) for env in client}
+        RequestScope.transient_tables = [
+            table for table in RequestScope.transient_tables if id(table) not in tables
+        ]
+
+    def update(
+        self,
+        client: ClientStack,
+        module: Module,
+        code: Code,
+        is_saved_content: bool,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Dependents:
+        saved_code = self.saved_envs[0].saved_contents_cache_table.get(module)
+        downstream_deps = client[-1].update(module, code, is_saved_content, is_cancelled)
+        if self.saved_envs[0].saved_contents_cache_table.get(module) != saved_code:
+            for other in self.clients:
+                if other is not client:
+                    other[-1].follow_saved_push(module)
+        return downstream_deps
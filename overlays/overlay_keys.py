@@ -3,12 +3,16 @@ from __future__ import annotations
 import ast
 import dataclasses
 from typing import (
-    Any, Dict, Generic, Protocol, Set, Tuple, TypeVar, List, Optional, cast, Type
+    Any, Callable, Dict, Generic, Iterator, MutableMapping, Protocol, Set, Tuple, TypeVar, List,
+    Optional, cast, Type
 )
 
 from typing_extensions import TypeAlias
 import textwrap
-from collections import defaultdict
+import time
+from collections import OrderedDict, defaultdict
+
+from wrap_memory import TableStats
 
 
 T = TypeVar("T")
@@ -24,10 +28,69 @@ def module_for_key(key) -> str:
     return key.split(".")[0]
 
 
-OverlayKey: TypeAlias = Optional[str]
+# Overlays can be stacked (e.g. a refactoring preview on top of an unsaved
+# buffer), so an overlay is identified by the chain of overlaid modules from
+# the saved stack down to it. `None` is the saved stack itself.
+OverlayKey: TypeAlias = Optional[Tuple[str, ...]]
 CacheKey: TypeAlias = Tuple[OverlayKey, str]
 
 
+class OverlayPartitionedTable(MutableMapping[CacheKey, T]):
+    # A table keyed by (overlay_key, key), stored as overlay_key -> key -> value
+    # so that dropping, measuring or copying the entries of one overlay only
+    # touches that overlay's entries rather than the whole (mostly saved)
+    # table. In shared memory this would be one table per overlay, allocated
+    # when the overlay is opened.
+    #
+    # The env stack goes through `partitions` directly; the mapping interface
+    # is for everything else (tests, debugging).
+    partitions: Dict[OverlayKey, Dict[str, T]]
+
+    def __init__(self) -> None:
+        self.partitions = {}
+
+    def __getitem__(self, cache_key: CacheKey) -> T:
+        overlay_key, key = cache_key
+        return self.partitions[overlay_key][key]
+
+    def __setitem__(self, cache_key: CacheKey, value: T) -> None:
+        overlay_key, key = cache_key
+        partition = self.partitions.get(overlay_key)
+        if partition is None:
+            partition = self.partitions[overlay_key] = {}
+        partition[key] = value
+
+    def __delitem__(self, cache_key: CacheKey) -> None:
+        overlay_key, key = cache_key
+        partition = self.partitions[overlay_key]
+        del partition[key]
+        if not partition:
+            del self.partitions[overlay_key]
+
+    def __contains__(self, cache_key: object) -> bool:
+        overlay_key, key = cast(CacheKey, cache_key)
+        partition = self.partitions.get(overlay_key)
+        return partition is not None and key in partition
+
+    def __iter__(self) -> Iterator[CacheKey]:
+        for overlay_key, partition in self.partitions.items():
+            for key in partition:
+                yield (overlay_key, key)
+
+    def __len__(self) -> int:
+        return sum(len(partition) for partition in self.partitions.values())
+
+    def partition_size(self, overlay_key: OverlayKey) -> int:
+        return len(self.partitions.get(overlay_key, ()))
+
+    def snapshot(self, overlay_key: OverlayKey) -> Dict[str, T]:
+        return dict(self.partitions.get(overlay_key, {}))
+
+    def drop_partition(self, overlay_key: OverlayKey) -> int:
+        """Remove every entry of `overlay_key`, returning how many there were."""
+        return len(self.partitions.pop(overlay_key, ()))
+
+
 
 class OverlayKeyedCache(Generic[T]):
     # note that these are class attributes, not instance attributes!
@@ -38,17 +101,116 @@ class OverlayKeyedCache(Generic[T]):
     # In order to make this global data behave like an ordinary first-class
     # mutable map, we'll include the overlay key (which represents the "identity"
     # of some particular mutable map) in all get and set requrests
-    cached: Dict[CacheKey, T] = ...
+    cached: OverlayPartitionedTable[T] = ...
     dependencies: Dict[str, Set[object]] = ...
+    # entries whose value is stale because a cancelled push never got to them
+    dirty: Set[CacheKey] = ...
+    # Dependency edges are shared by the saved stack and every overlay, so we
+    # record who registered each edge in order to remove an overlay's edges
+    # (and only those) when the overlay goes away.
+    edge_owners: Dict[Tuple[str, object], Set[OverlayKey]] = ...
+    overlay_edges: Dict[OverlayKey, Set[Tuple[str, object]]] = ...
+    # What each partition of `cached` did since the stats were last reset;
+    # they go away with the partition when its overlay is closed.
+    stats: Dict[OverlayKey, TableStats] = ...
 
     def __init__(self):
         raise RuntimeError("caches are not instantiatable!")
 
 
+class UpdateCancelled(Exception):
+    """Raised when an overlay push is aborted because a newer edit superseded it.
+
+    `stale_keys` are the keys of the next environment down the stack whose
+    overlay values can no longer be trusted.
+    """
+
+    def __init__(self, stale_keys: Set[str]) -> None:
+        super().__init__(stale_keys)
+        self.stale_keys = stale_keys
+
+
+class OverlayLifecycle:
+    # Global bookkeeping for overlay eviction, shared by every env like the
+    # caches are.
+    #
+    # Overlays are identified by overlay key; for each one we remember the envs
+    # it is stacked on at every layer it was opened from, so that closing it
+    # reaches all of its layers. `recently_used` is in least-recently-used
+    # order, and `entries` counts
+    # the cache entries each overlay holds across all layers. When the total
+    # exceeds `max_entries`, the least-recently-used overlays are closed until
+    # it fits; the overlay being used (and the overlays it is stacked on) are
+    # never evicted.
+    max_entries: Optional[int] = None
+    recently_used: OrderedDict[Tuple[str, ...], List[EnvTable]] = OrderedDict()
+    entries: Dict[Tuple[str, ...], int] = defaultdict(int)
+    evictions: int = 0
+
+    def __init__(self):
+        raise RuntimeError("OverlayLifecycle is not instantiatable!")
+
+    @classmethod
+    def reset(cls, max_entries: Optional[int] = None) -> None:
+        cls.max_entries = max_entries
+        cls.recently_used = OrderedDict()
+        cls.entries = defaultdict(int)
+        cls.evictions = 0
+
+    @classmethod
+    def touch(cls, overlay_key: Tuple[str, ...], parent_env: EnvTable) -> None:
+        parent_envs = cls.recently_used.setdefault(overlay_key, [])
+        if not any(env is parent_env for env in parent_envs):
+            parent_envs.append(parent_env)
+        # using a stacked overlay uses the overlays beneath it, too
+        for length in range(1, len(overlay_key) + 1):
+            if overlay_key[:length] in cls.recently_used:
+                cls.recently_used.move_to_end(overlay_key[:length])
+
+    @classmethod
+    def close(cls, overlay_key: Tuple[str, ...]) -> None:
+        # Discarding at a layer also discards upstream of it, which covers
+        # every layer the overlay was only materialized in.
+        for parent_env in list(cls.recently_used.get(overlay_key, ())):
+            parent_env.discard_overlay(overlay_key[-1])
+
+    @classmethod
+    def total_entries(cls) -> int:
+        return sum(cls.entries.values())
+
+    @classmethod
+    def enforce_quota(cls, in_use: OverlayKey) -> None:
+        if cls.max_entries is None:
+            return
+        protected = set() if in_use is None else {
+            in_use[:length] for length in range(1, len(in_use) + 1)
+        }
+        while cls.total_entries() > cls.max_entries:
+            victim = next(
+                (overlay_key for overlay_key in cls.recently_used if overlay_key not in protected),
+                None,
+            )
+            if victim is None:
+                return
+            cls.close(victim)
+            cls.evictions += 1
+
+
 class EnvTable(Generic[T]):
-    upstream_env: Optional[EnvTable]
     cache: Cache[T]
     overlay: Optional[Tuple[str, EnvTable[T]]]
+    overlay_key: OverlayKey
+
+    # Overlays are materialized one layer at a time: opening an overlay only
+    # creates it in the layer it was opened from, and its upstream overlay is
+    # created the first time it is needed (see `upstream_env`). Until then the
+    # overlay just remembers the newest `code` of its module, and edits have
+    # nothing to push - so opening a buffer that is only looked at in e.g.
+    # the `AstEnv` never touches the layers above it, and opening a buffer at
+    # the top of the stack costs nothing until it is queried.
+    _upstream_env: Optional[EnvTable]
+    has_upstream: bool
+    code: Optional[str]
 
     # Only needed to get clean dependency propagation; it's possible to make
     # this work without registering children if dependencies are passed around
@@ -62,9 +224,34 @@ class EnvTable(Generic[T]):
         overlay=None,
     ) -> None:
         self.cache = cache
-        self.upstream_env = upstream_env
+        self._upstream_env = upstream_env
         self.overlay = overlay
         self.children = {}
+        self.code = None
+        # An env's overlay never changes, so compute its key once rather
+        # than on every cache access.
+        if overlay is None:
+            self.overlay_key = None
+            self.has_upstream = upstream_env is not None
+        else:
+            overlay_module, parent_env = overlay
+            self.overlay_key = (parent_env.overlay_key or ()) + (overlay_module,)
+            self.has_upstream = parent_env.has_upstream
+
+    @property
+    def upstream_env(self) -> Optional[EnvTable]:
+        if self._upstream_env is None and self.has_upstream:
+            overlay_module, parent_env = cast(Tuple[str, EnvTable[T]], self.overlay)
+            self._upstream_env = parent_env.upstream_env.materialize_overlay(
+                overlay_module, cast(str, self.code)
+            )
+        return self._upstream_env
+
+    @property
+    def is_materialized(self) -> bool:
+        """Whether anything upstream of this env exists, i.e. whether it can
+        have cached anything that depends on its overlaid module."""
+        return self._upstream_env is not None or not self.has_upstream
 
     @staticmethod
     def cache() -> Type[SingletonCache[T]]:
@@ -79,23 +266,63 @@ class EnvTable(Generic[T]):
     ) -> EnvTable[T]:
         return cls(overlay=overlay, upstream_env=upstream_env)
 
-    @property
-    def overlay_key(self) -> OverlayKey:
-        return self.overlay[0] if self.overlay else None
-
     def cache_mem(self, key: str) -> bool:
-        (self.overlay_key, key) in self.cache.cached
+        partition = self.cache.cached.partitions.get(self.overlay_key)
+        return (
+            partition is not None
+            and key in partition
+            and (self.overlay_key, key) not in self.cache.dirty
+        )
 
     def cache_get_exn(self, key: str) -> T:
-        return self.cache.cached[(self.overlay_key, key)]
+        return self.cache.cached.partitions[self.overlay_key][key]
 
     def cache_set(self, key: str, value: T) -> None:
-        self.cache.cached[(self.overlay_key, key)] = value
+        overlay_key = self.overlay_key
+        partitions = self.cache.cached.partitions
+        partition = partitions.get(overlay_key)
+        if partition is None:
+            partition = partitions[overlay_key] = {}
+        if overlay_key is not None and key not in partition:
+            OverlayLifecycle.entries[overlay_key] += 1
+        partition[key] = value
+        self.cache.dirty.discard((overlay_key, key))
+
+    def owns_key(self, key: str) -> bool:
+        return self.overlay is None or module_for_key(key) == self.overlay[0]
+
+    def mark_dirty(self, keys: Set[str]) -> Set[str]:
+        """Mark the keys we own as dirty, returning their dependents."""
+        downstream_deps = set()
+        for key in keys:
+            if self.owns_key(key):
+                self.cache.dirty.add((self.overlay_key, key))
+            downstream_deps |= self.dependencies.get(key, set())
+        return downstream_deps
 
     @property
     def dependencies(self) -> Dict[str, Set[str]]:
         return self.cache.dependencies
 
+    @property
+    def table_stats(self) -> TableStats:
+        stats = self.cache.stats.get(self.overlay_key)
+        if stats is None:
+            stats = self.cache.stats[self.overlay_key] = TableStats()
+        return stats
+
+    def produce(self, key: str, stats: TableStats) -> T:
+        # A `produce_value` that raises is counted, but its time is not.
+        stats.produce_value_calls += 1
+        start = time.perf_counter_ns()
+        value = self.produce_value(
+            key,
+            self.upstream_get,
+            current_env_getter=self.cache_get_exn,
+        )
+        stats.produce_value_ns += time.perf_counter_ns() - start
+        return value
+
     @property
     def upstream_get(self) -> ReadOnlyEnv:
         if self.upstream_env is None:
@@ -108,33 +335,48 @@ class EnvTable(Generic[T]):
         "Must be implemented by child environments"
         raise NotImplementedError()
 
-    def register_dependency(self, key: str, dependency: str) -> None:
+    def register_dependency(
+        self, key: str, dependency: str, registered_by: OverlayKey = None
+    ) -> None:
         self.dependencies[key] = self.dependencies.get(key, set())
+        overlay_key = registered_by or self.overlay_key
+        edge = (key, dependency)
+        # Edges only registered by the saved stack have no owners entry, so
+        # that tracking ownership costs nothing until overlays are involved.
+        owners = self.cache.edge_owners.get(edge)
+        if overlay_key is None:
+            if owners is not None:
+                owners.add(None)
+        elif owners is None or overlay_key not in owners:
+            if owners is None:
+                owners = self.cache.edge_owners[edge] = (
+                    {None} if dependency in self.dependencies[key] else set()
+                )
+            owners.add(overlay_key)
+            self.cache.overlay_edges.setdefault(overlay_key, set()).add(edge)
         self.dependencies[key].add(dependency)
 
-    def get(self, key: str, dependency: str) -> T:
+    def get(self, key: str, dependency: str, registered_by: OverlayKey = None) -> T:
 
         # first check whether we own the key - do nothing at all if not!
+        # (except remember that the dependency edge is the overlay's)
         if self.overlay is not None:
             overlay_module, parent_env = self.overlay
             if module_for_key(key) != overlay_module:
-                return parent_env.get(key, dependency)
+                return parent_env.get(key, dependency, registered_by or self.overlay_key)
         # otherwise, do exactly the same thing `factor_out_memory.py` did
-        self.register_dependency(key, dependency)
+        self.register_dependency(key, dependency, registered_by)
+        stats = self.table_stats
+        stats.gets += 1
         if not self.cache_mem(key):
-            self.cache_set(
-                key=key,
-                value=self.produce_value(
-                    key,
-                    self.upstream_get,
-                    current_env_getter=self.cache_get_exn,
-                ),
-            )
+            stats.misses += 1
+            self.cache_set(key=key, value=self.produce(key, stats))
         return self.cache_get_exn(key)
 
     def update_for_push(
         self,
-        keys_to_update: Set[str]
+        keys_to_update: Set[str],
+        is_cancelled: Optional[Callable[[], bool]] = None,
     ) -> Set[str]:
         overlay_module = (
             None
@@ -143,18 +385,36 @@ class EnvTable(Generic[T]):
         )
         downstream_deps = set()
 
+        if overlay_module is not None and not self.is_materialized:
+            # Nothing of ours is cached yet (see `upstream_env`), and so
+            # nothing of the overlays stacked on us either.
+            return downstream_deps
+        if overlay_module is not None:
+            # Pick up whatever a previously-cancelled push left unfinished.
+            keys_to_update = keys_to_update | {
+                key
+                for overlay_key, key in self.cache.dirty
+                if overlay_key == self.overlay_key
+            }
+
         # update as before, if this module owns the key
-        for key in keys_to_update:
-            if overlay_module is None or module_for_key(key) == overlay_module:
-                self.cache_set(
-                    key=key,
-                    value=self.produce_value(
-                        key,
-                        self.upstream_get,
-                        current_env_getter=self.cache_get_exn,
-                    ),
+        stats = self.table_stats
+        keys_pushed = stats.keys_pushed
+        ordered_keys = list(keys_to_update)
+        for index, key in enumerate(ordered_keys):
+            # Only overlay pushes can be cancelled; pushes to the saved stack
+            # always run to completion.
+            if overlay_module is not None and is_cancelled is not None and is_cancelled():
+                raise UpdateCancelled(
+                    downstream_deps | self.mark_dirty(set(ordered_keys[index:]))
                 )
+            if overlay_module is None or module_for_key(key) == overlay_module:
+                self.cache_set(key=key, value=self.produce(key, stats))
+                stats.keys_pushed += 1
                 downstream_deps |= self.dependencies[key]
+        if stats.keys_pushed > keys_pushed:
+            stats.push_waves += 1
+        stats.dependents += len(downstream_deps)
 
         # Propagate the dependencies to child environments as well, and track all
         # of those triggered dependencies as well. Note that we're
@@ -179,17 +439,28 @@ class EnvTable(Generic[T]):
         return downstream_deps
 
     def create_overlay(self, module: str, code: str) -> EnvTable[T]:
-        if self.upstream_env is None:
-            upstream_overlay = None
-        else:
-            upstream_overlay = self.upstream_env.create_overlay(module, code)
-
-        self.children[module] = self.new(
-            upstream_env=upstream_overlay,
+        # Only this layer; the upstream overlay is created on first use.
+        child = self.new(
+            upstream_env=None,
             overlay=(module, self),
             code=code,
         )
-        return self.children[module]
+        child.code = code
+        self.children[module] = child
+        return child
+
+    def materialize_overlay(self, module: str, code: str) -> EnvTable[T]:
+        # Unlike `get_overlay` this is not a use of the overlay by the user,
+        # so it does not count for eviction.
+        child = self.children.get(module)
+        if child is None:
+            child = self.create_overlay(module, code)
+        elif child.code != code:
+            # The overlay was opened here too, and the edits since only
+            # reached the overlays stacked on top of it.
+            child.update(module, code)
+            child.code = code
+        return child
 
     def get_overlay(self, module: str, code: str) -> EnvTable[T]:
         if module in self.children:
@@ -200,21 +471,121 @@ class EnvTable(Generic[T]):
             child = self.create_overlay(module=module, code=code)
         if child.overlay is None:
             raise RuntimeError()
+        OverlayLifecycle.touch(child.overlay_key, self)
+        OverlayLifecycle.enforce_quota(in_use=child.overlay_key)
         return child
 
-    def update(self, module: str, code: str, in_overlay: bool = False) -> Set[str]:
-        if self.upstream_env is None:
+    def close_overlay(self, module: str) -> None:
+        """Close the overlay of `module` stacked on this env, e.g. when the
+        user closes the buffer, dropping its cache entries and dependency
+        edges (and those of any overlay stacked on it) in every layer."""
+        OverlayLifecycle.close((self.overlay_key or ()) + (module,))
+        self.discard_overlay(module)
+
+    def discard_overlay(self, module: str) -> None:
+        # Drop the overlay of `module` stacked directly on this env, along
+        # with everything stacked on top of it, in every layer.
+        child = self.children.pop(module, None)
+        if child is not None:
+            child.discard()
+        if self._upstream_env is not None:
+            self._upstream_env.discard_overlay(module)
+
+    def discard(self) -> None:
+        for child in self.children.values():
+            child.discard()
+        self.children = {}
+        overlay_key = self.overlay_key
+        discarded = self.cache.cached.drop_partition(overlay_key)
+        self.cache.stats.pop(overlay_key, None)
+        self.cache.dirty.difference_update(
+            [cache_key for cache_key in self.cache.dirty if cache_key[0] == overlay_key]
+        )
+        for edge in self.cache.overlay_edges.pop(overlay_key, set()):
+            owners = self.cache.edge_owners[edge]
+            owners.discard(overlay_key)
+            if not owners:
+                del self.cache.edge_owners[edge]
+                key, dependency = edge
+                self.dependencies[key].discard(dependency)
+        if overlay_key is not None:
+            OverlayLifecycle.recently_used.pop(overlay_key, None)
+            OverlayLifecycle.entries[overlay_key] -= discarded
+            if OverlayLifecycle.entries[overlay_key] <= 0:
+                del OverlayLifecycle.entries[overlay_key]
+
+    def update(
+        self,
+        module: str,
+        code: str,
+        in_overlay: bool = False,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Set[str]:
+        """Push an edit of `module` down the stack.
+
+        Overlay pushes poll `is_cancelled` before every key; once it returns
+        True the push stops, the keys it did not get to are marked dirty in
+        every overlay environment and `UpdateCancelled` is raised. The caller
+        is expected to retry with the newest text of the module.
+        """
+        if not self.has_upstream:
             raise NotImplementedError()
         # switch to the child and update that. Note that upstream environments are
         # created via get_overlay, and so the update itself happens without `in_overlay`
         if in_overlay:
-            child = self.get_overlay(module, code)
-            keys_to_update = child.upstream_env.update(module, code)
-            return child.update_for_push(keys_to_update)
+            env = self.get_overlay(module, code)
         # update this stack (which will also update children)
         else:
-            keys_to_update = self.upstream_env.update(module, code)
-            return self.update_for_push(keys_to_update)
+            env = self
+        if env.overlay is not None:
+            env.code = code
+            if not env.is_materialized:
+                # Nothing has been read from this overlay yet, so there is
+                # nothing to push; the upstream overlays pick up the newest
+                # text when they are first needed.
+                return set()
+        try:
+            keys_to_update = env.upstream_env.update(module, code, is_cancelled=is_cancelled)
+        except UpdateCancelled as cancelled:
+            raise UpdateCancelled(env.mark_dirty(cancelled.stale_keys))
+        downstream_deps = env.update_for_push(keys_to_update, is_cancelled)
+        if in_overlay:
+            OverlayLifecycle.enforce_quota(in_use=env.overlay_key)
+        return downstream_deps
+
+    def stats(self) -> Dict[str, Dict[OverlayKey, Dict[str, int]]]:
+        """The stats of every environment from the code environment down to
+        this one, by environment class and then by overlay key (`None` for
+        the saved stack), for every partition of their tables. Sizes are
+        counted when this is called."""
+        result = {}
+        for env in reversed(self.saved_stack()):
+            cache = env.cache
+            partitions = result[type(env).__name__] = {}
+            overlay_keys = set(cache.stats) | set(cache.cached.partitions)
+            for overlay_key in sorted(overlay_keys, key=lambda overlay_key: overlay_key or ()):
+                stats = cache.stats.get(overlay_key, TableStats())
+                partitions[overlay_key] = dict(
+                    dataclasses.asdict(stats),
+                    hits=stats.hits,
+                    size=cache.cached.partition_size(overlay_key),
+                )
+        return result
+
+    def reset_stats(self) -> None:
+        for env in self.saved_stack():
+            env.cache.stats = {}
+
+    def saved_stack(self) -> List[EnvTable]:
+        # The saved environments from this layer up to the code environment;
+        # their caches hold the partitions of every overlay as well.
+        env = self
+        while env.overlay is not None:
+            env = env.overlay[1]
+        envs = [env]
+        while envs[-1]._upstream_env is not None:
+            envs.append(envs[-1]._upstream_env)
+        return envs
 
     def read_only(self) -> ReadOnlyEnv:
         return self.get
@@ -225,8 +596,12 @@ Module: TypeAlias = str
 Code: TypeAlias = str
 
 class CodeCache(OverlayKeyedCache[Code]):
-    cached: Dict[CacheKey, T] = {}
+    cached: OverlayPartitionedTable[T] = OverlayPartitionedTable()
     dependencies: Dict[str, Set[object]] = defaultdict(lambda: set())
+    dirty: Set[CacheKey] = set()
+    edge_owners: Dict[Tuple[str, object], Set[OverlayKey]] = {}
+    overlay_edges: Dict[OverlayKey, Set[Tuple[str, object]]] = {}
+    stats: Dict[OverlayKey, TableStats] = {}
 
 
 class CodeEnv(EnvTable[Code]):
@@ -258,7 +633,13 @@ class CodeEnv(EnvTable[Code]):
         return current_env_getter(key)
 
 
-    def update(self, module: str, code: str, in_overlay: bool=False) -> Set[str]:
+    def update(
+        self,
+        module: str,
+        code: str,
+        in_overlay: bool = False,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Set[str]:
         # `CodeEnv` does not have an upstream environment. So, we have to
         # override the default `update` method to set the value before we
         # "produce" it. (This is what `basic.py` does too.)
@@ -266,18 +647,27 @@ class CodeEnv(EnvTable[Code]):
             raise RuntimeError("We should never directly be updating in overlay!")
         else:
             self.cache_set(key=module, value=code)
-            return cast(Set[str], self.dependencies[module])
+            downstream_deps = cast(Set[str], self.dependencies[module])
+            stats = self.table_stats
+            stats.push_waves += 1
+            stats.keys_pushed += 1
+            stats.dependents += len(downstream_deps)
+            return downstream_deps
 
 
 class AstCache(OverlayKeyedCache[ast.AST]):
-    cached: Dict[CacheKey, T] = {}
+    cached: OverlayPartitionedTable[T] = OverlayPartitionedTable()
     dependencies: Dict[str, Set[object]] = defaultdict(lambda: set())
+    dirty: Set[CacheKey] = set()
+    edge_owners: Dict[Tuple[str, object], Set[OverlayKey]] = {}
+    overlay_edges: Dict[OverlayKey, Set[Tuple[str, object]]] = {}
+    stats: Dict[OverlayKey, TableStats] = {}
 
 
 class AstEnv(EnvTable[ast.AST]):
 
     def __init__(self, upstream_env, overlay=None):
-        if not isinstance(upstream_env, CodeEnv):
+        if overlay is None and not isinstance(upstream_env, CodeEnv):
             raise RuntimeError()
         super().__init__(upstream_env=upstream_env, overlay=overlay, cache=AstCache)
 
@@ -291,8 +681,12 @@ class AstEnv(EnvTable[ast.AST]):
 ClassName: TypeAlias = str
 
 class ClassBodyCache(OverlayKeyedCache[ast.ClassDef]):
-    cached: Dict[CacheKey, T] = {}
+    cached: OverlayPartitionedTable[T] = OverlayPartitionedTable()
     dependencies: Dict[str, Set[object]] = defaultdict(lambda: set())
+    dirty: Set[CacheKey] = set()
+    edge_owners: Dict[Tuple[str, object], Set[OverlayKey]] = {}
+    overlay_edges: Dict[OverlayKey, Set[Tuple[str, object]]] = {}
+    stats: Dict[OverlayKey, TableStats] = {}
 
 
 
@@ -300,7 +694,7 @@ class ClassBodyEnv(EnvTable[ast.ClassDef]):
 
     def __init__(self, upstream_env, overlay=None):
         super().__init__(upstream_env=upstream_env, overlay=overlay, cache=ClassBodyCache)
-        if not isinstance(self.upstream_env, AstEnv):
+        if overlay is None and not isinstance(upstream_env, AstEnv):
             raise RuntimeError()
 
     @staticmethod
@@ -317,8 +711,12 @@ ClassAncestors: TypeAlias = List[str]
 
 
 class ClassParentsCache(OverlayKeyedCache[ClassAncestors]):
-    cached: Dict[CacheKey, T] = {}
+    cached: OverlayPartitionedTable[T] = OverlayPartitionedTable()
     dependencies: Dict[str, Set[object]] = defaultdict(lambda: set())
+    dirty: Set[CacheKey] = set()
+    edge_owners: Dict[Tuple[str, object], Set[OverlayKey]] = {}
+    overlay_edges: Dict[OverlayKey, Set[Tuple[str, object]]] = {}
+    stats: Dict[OverlayKey, TableStats] = {}
 
 
 
@@ -326,7 +724,7 @@ class ClassParentsEnv(EnvTable[ClassAncestors]):
 
     def __init__(self, upstream_env, overlay=None):
         super().__init__(upstream_env=upstream_env, overlay=overlay, cache=ClassParentsCache)
-        if not isinstance(self.upstream_env, ClassBodyEnv):
+        if overlay is None and not isinstance(upstream_env, ClassBodyEnv):
             raise RuntimeError()
 
     @staticmethod
@@ -339,8 +737,12 @@ class ClassParentsEnv(EnvTable[ClassAncestors]):
 
 
 class ClassGrandparentsCache(OverlayKeyedCache[ClassAncestors]):
-    cached: Dict[CacheKey, T] = {}
+    cached: OverlayPartitionedTable[T] = OverlayPartitionedTable()
     dependencies: Dict[str, Set[object]] = defaultdict(lambda: set())
+    dirty: Set[CacheKey] = set()
+    edge_owners: Dict[Tuple[str, object], Set[OverlayKey]] = {}
+    overlay_edges: Dict[OverlayKey, Set[Tuple[str, object]]] = {}
+    stats: Dict[OverlayKey, TableStats] = {}
 
 
 
@@ -348,7 +750,7 @@ class ClassGrandparentsEnv(EnvTable[ClassAncestors]):
 
     def __init__(self, upstream_env, overlay=None):
         super().__init__(upstream_env=upstream_env, overlay=overlay, cache=ClassGrandparentsCache)
-        if not isinstance(self.upstream_env, ClassParentsEnv):
+        if overlay is None and not isinstance(upstream_env, ClassParentsEnv):
             raise RuntimeError()
 
     @staticmethod
@@ -363,11 +765,15 @@ class ClassGrandparentsEnv(EnvTable[ClassAncestors]):
 
 def clear_caches(*caches: Type[OverlayKeyedCache]):
     for cache in caches:
-        cache.cache = {}
+        cache.cached = OverlayPartitionedTable()
         cache.dependencies = defaultdict(lambda: set())
+        cache.dirty = set()
+        cache.edge_owners = {}
+        cache.overlay_edges = {}
+        cache.stats = {}
 
 
-def create_env_stack(code: Dict[str, str]) -> Tuple[
+def create_env_stack(code: Dict[str, str], max_overlay_entries: Optional[int] = None) -> Tuple[
     CodeEnv,
     AstEnv,
     ClassBodyEnv,
@@ -377,6 +783,7 @@ def create_env_stack(code: Dict[str, str]) -> Tuple[
     clear_caches(
         CodeCache, AstCache, ClassBodyCache, ClassParentsCache, ClassGrandparentsCache,
     )
+    OverlayLifecycle.reset(max_entries=max_overlay_entries)
     code_env = CodeEnv(code=code)
     ast_env = AstEnv(code_env)
     class_body_env = ClassBodyEnv(ast_env)
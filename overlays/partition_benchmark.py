@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Compare a flat `(overlay_key, key) -> value` table with the
+overlay-partitioned table that `overlay_keys.py` uses, on a large saved table
+with many small overlays.
+
+Dropping, measuring and snapshotting one overlay scan the whole flat table but
+only the overlay's own entries in the partitioned one; lookups trade building a
+tuple key for one more dict access.
+
+Run it with `python partition_benchmark.py [saved_keys] [overlays] [keys_per_overlay]`.
+"""
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from overlay_keys import CacheKey, OverlayKey, OverlayPartitionedTable
+
+
+class FlatTable:
+    # What `OverlayKeyedCache.cached` used to be.
+    def __init__(self) -> None:
+        self.cached: Dict[CacheKey, Any] = {}
+
+    def set(self, overlay_key: OverlayKey, key: str, value: Any) -> None:
+        self.cached[(overlay_key, key)] = value
+
+    def get(self, overlay_key: OverlayKey, key: str) -> Any:
+        return self.cached[(overlay_key, key)]
+
+    def size(self, overlay_key: OverlayKey) -> int:
+        return sum(1 for cache_key in self.cached if cache_key[0] == overlay_key)
+
+    def snapshot(self, overlay_key: OverlayKey) -> Dict[str, Any]:
+        return {
+            key: value
+            for (entry_overlay_key, key), value in self.cached.items()
+            if entry_overlay_key == overlay_key
+        }
+
+    def drop(self, overlay_key: OverlayKey) -> None:
+        for cache_key in [cache_key for cache_key in self.cached if cache_key[0] == overlay_key]:
+            del self.cached[cache_key]
+
+
+class PartitionedTable:
+    # The access pattern of `EnvTable.cache_set`, `cache_get_exn` etc.
+    def __init__(self) -> None:
+        self.cached: OverlayPartitionedTable[Any] = OverlayPartitionedTable()
+
+    def set(self, overlay_key: OverlayKey, key: str, value: Any) -> None:
+        partitions = self.cached.partitions
+        partition = partitions.get(overlay_key)
+        if partition is None:
+            partition = partitions[overlay_key] = {}
+        partition[key] = value
+
+    def get(self, overlay_key: OverlayKey, key: str) -> Any:
+        return self.cached.partitions[overlay_key][key]
+
+    def size(self, overlay_key: OverlayKey) -> int:
+        return self.cached.partition_size(overlay_key)
+
+    def snapshot(self, overlay_key: OverlayKey) -> Dict[str, Any]:
+        return self.cached.snapshot(overlay_key)
+
+    def drop(self, overlay_key: OverlayKey) -> None:
+        self.cached.drop_partition(overlay_key)
+
+
+def timed(f: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def measure(
+    table_class: Callable[[], Any],
+    saved_keys: int,
+    overlays: int,
+    keys_per_overlay: int,
+) -> Dict[str, float]:
+    table = table_class()
+    keys = [f"m{index // 10}.C{index % 10}" for index in range(saved_keys)]
+    overlay_keys: List[Tuple[str, ...]] = [(f"m{index}",) for index in range(overlays)]
+
+    def fill() -> None:
+        for key in keys:
+            table.set(None, key, key)
+        for overlay_key in overlay_keys:
+            for key in keys[:keys_per_overlay]:
+                table.set(overlay_key, key, key)
+
+    def lookups() -> None:
+        for key in keys:
+            table.get(None, key)
+        for overlay_key in overlay_keys:
+            for key in keys[:keys_per_overlay]:
+                table.get(overlay_key, key)
+
+    # per-overlay operations are averaged over a handful of overlays
+    sample = overlay_keys[:: max(1, overlays // 10)]
+    return {
+        "fill_s": timed(fill),
+        "lookups_s": timed(lookups),
+        "size_ms": 1000 * timed(lambda: [table.size(key) for key in sample]) / len(sample),
+        "snapshot_ms": 1000 * timed(lambda: [table.snapshot(key) for key in sample]) / len(sample),
+        "drop_ms": 1000 * timed(lambda: [table.drop(key) for key in sample]) / len(sample),
+    }
+
+
+def report(saved_keys: int = 100_000, overlays: int = 200, keys_per_overlay: int = 50) -> Dict[str, Dict[str, float]]:
+    return {
+        name: measure(table_class, saved_keys, overlays, keys_per_overlay)
+        for name, table_class in [("flat", FlatTable), ("partitioned", PartitionedTable)]
+    }
+
+
+if __name__ == "__main__":
+    saved_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    overlays = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    keys_per_overlay = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    print(f"{saved_keys} saved keys, {overlays} overlays of {keys_per_overlay} keys")
+    for name, row in report(saved_keys, overlays, keys_per_overlay).items():
+        print(
+            f"{name:>12}: fill {row['fill_s']:.3f}s, lookups {row['lookups_s']:.3f}s, "
+            f"per overlay: size {row['size_ms']:.3f}ms, snapshot {row['snapshot_ms']:.3f}ms, "
+            f"drop {row['drop_ms']:.3f}ms"
+        )
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Generic, Iterator, Optional, Tuple, TypeVar, Union
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+# A persistent (immutable) hash map, as a hash array mapped trie. `set` and
+# `delete` return a new map that shares everything but the path to the
+# changed entry with the old one, so keeping old versions around is cheap.
+#
+# This is what `wrap_env.py` uses to let an overlay share its parent's cache:
+# the overlay starts out as the parent's map and only copies the paths to the
+# entries it overrides. In ocaml we would reach for a `Map` (or a HAMT
+# library) instead.
+#
+# Each level of the trie consumes 5 bits of the key's hash; leaves are
+# `(hash, key, value)` tuples, and keys whose (full) hashes collide share a
+# `_Collision` node.
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+
+_Leaf = Tuple[int, Any, Any]
+
+
+class _Node:
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap: int, entries: Tuple[Union[_Leaf, "_Node", "_Collision"], ...]) -> None:
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class _Collision:
+    __slots__ = ("hash", "leaves")
+
+    def __init__(self, hash: int, leaves: Tuple[_Leaf, ...]) -> None:
+        self.hash = hash
+        self.leaves = leaves
+
+
+_EMPTY_NODE = _Node(0, ())
+_MISSING = object()
+
+
+def _hash(key: Any) -> int:
+    return hash(key) & _HASH_MASK
+
+
+def _entry_hash(entry: Union[_Leaf, _Node, _Collision]) -> int:
+    return entry.hash if type(entry) is _Collision else entry[0]
+
+
+def _merge(first: Union[_Leaf, _Collision], second: _Leaf, shift: int) -> Union[_Node, _Collision]:
+    first_hash = _entry_hash(first)
+    second_hash = second[0]
+    if first_hash == second_hash:
+        leaves = first.leaves if type(first) is _Collision else (first,)
+        return _Collision(first_hash, leaves + (second,))
+    first_index = (first_hash >> shift) & _MASK
+    second_index = (second_hash >> shift) & _MASK
+    if first_index == second_index:
+        return _Node(1 << first_index, (_merge(first, second, shift + _BITS),))
+    if first_index < second_index:
+        return _Node((1 << first_index) | (1 << second_index), (first, second))
+    return _Node((1 << first_index) | (1 << second_index), (second, first))
+
+
+def _set(node: Union[_Node, _Collision], shift: int, leaf: _Leaf) -> Tuple[Union[_Node, _Collision], bool]:
+    """Return the new node and whether the key was added (rather than replaced)."""
+    hash, key, value = leaf
+    if type(node) is _Collision:
+        if hash != node.hash:
+            return _merge(node, leaf, shift), True
+        for index, (_, existing_key, _) in enumerate(node.leaves):
+            if existing_key == key:
+                return _Collision(hash, node.leaves[:index] + (leaf,) + node.leaves[index + 1:]), False
+        return _Collision(hash, node.leaves + (leaf,)), True
+    bit = 1 << ((hash >> shift) & _MASK)
+    index = (node.bitmap & (bit - 1)).bit_count()
+    entries = node.entries
+    if not node.bitmap & bit:
+        return _Node(node.bitmap | bit, entries[:index] + (leaf,) + entries[index:]), True
+    entry = entries[index]
+    if type(entry) is tuple:
+        if entry[1] == key:
+            if entry[2] is value:
+                return node, False
+            new_entry, added = leaf, False
+        else:
+            new_entry, added = _merge(entry, leaf, shift + _BITS), True
+    else:
+        new_entry, added = _set(entry, shift + _BITS, leaf)
+        if new_entry is entry:
+            return node, False
+    return _Node(node.bitmap, entries[:index] + (new_entry,) + entries[index + 1:]), added
+
+
+def _delete(node: Union[_Node, _Collision], shift: int, hash: int, key: Any) -> Optional[Union[_Node, _Collision, _Leaf]]:
+    """Return the new node (`node` itself if `key` is absent), or None if it is now empty.
+
+    A node left with a single leaf collapses into that leaf, so that the trie
+    stays as shallow as if the key had never been added.
+    """
+    if type(node) is _Collision:
+        leaves = tuple(leaf for leaf in node.leaves if leaf[1] != key)
+        if len(leaves) == len(node.leaves):
+            return node
+        return leaves[0] if len(leaves) == 1 else _Collision(hash, leaves)
+    bit = 1 << ((hash >> shift) & _MASK)
+    if not node.bitmap & bit:
+        return node
+    index = (node.bitmap & (bit - 1)).bit_count()
+    entries = node.entries
+    entry = entries[index]
+    if type(entry) is tuple:
+        if entry[1] != key:
+            return node
+        new_entry = None
+    else:
+        new_entry = _delete(entry, shift + _BITS, hash, key)
+        if new_entry is entry:
+            return node
+    if new_entry is None:
+        if len(entries) == 1:
+            return None
+        remaining = entries[:index] + entries[index + 1:]
+        if len(remaining) == 1 and type(remaining[0]) is tuple and shift > 0:
+            return remaining[0]
+        return _Node(node.bitmap & ~bit, remaining)
+    if len(entries) == 1 and type(new_entry) is tuple and shift > 0:
+        return new_entry
+    return _Node(node.bitmap, entries[:index] + (new_entry,) + entries[index + 1:])
+
+
+def _iterate(node: Union[_Node, _Collision]) -> Iterator[_Leaf]:
+    if type(node) is _Collision:
+        yield from node.leaves
+        return
+    for entry in node.entries:
+        if type(entry) is tuple:
+            yield entry
+        else:
+            yield from _iterate(entry)
+
+
+class PersistentMap(Generic[K, V]):
+    __slots__ = ("root", "size")
+
+    root: _Node
+    size: int
+
+    def __init__(self, root: _Node = _EMPTY_NODE, size: int = 0) -> None:
+        self.root = root
+        self.size = size
+
+    @staticmethod
+    def from_dict(items: Dict[K, V]) -> PersistentMap[K, V]:
+        result: PersistentMap[K, V] = PersistentMap()
+        for key, value in items.items():
+            result = result.set(key, value)
+        return result
+
+    def get(self, key: K, default: Any = None) -> Any:
+        hash = _hash(key)
+        node: Any = self.root
+        shift = 0
+        while True:
+            if type(node) is _Collision:
+                for _, existing_key, value in node.leaves:
+                    if existing_key == key:
+                        return value
+                return default
+            bit = 1 << ((hash >> shift) & _MASK)
+            if not node.bitmap & bit:
+                return default
+            entry = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+            if type(entry) is tuple:
+                return entry[2] if entry[1] == key else default
+            node = entry
+            shift += _BITS
+
+    def __getitem__(self, key: K) -> V:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[K]:
+        for _, key, _ in _iterate(self.root):
+            yield key
+
+    def items(self) -> Iterator[Tuple[K, V]]:
+        for _, key, value in _iterate(self.root):
+            yield key, value
+
+    def set(self, key: K, value: V) -> PersistentMap[K, V]:
+        root, added = _set(self.root, 0, (_hash(key), key, value))
+        if root is self.root:
+            return self
+        return PersistentMap(root, self.size + added)
+
+    def update(self, items: Dict[K, V]) -> PersistentMap[K, V]:
+        result = self
+        for key, value in items.items():
+            result = result.set(key, value)
+        return result
+
+    def delete(self, key: K) -> PersistentMap[K, V]:
+        root = _delete(self.root, 0, _hash(key), key)
+        if root is self.root:
+            return self
+        if root is None:
+            return PersistentMap()
+        return PersistentMap(root, self.size - 1)
+
+    def __repr__(self) -> str:
+        return f"PersistentMap({dict(self.items())!r})"
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways `wrap_env.py` has stored overlays, on a saved table with
+many overlays that each override a few keys:
+
+- chained: each overlay has its own dict of the keys it owns, and lookups of
+  any other key dispatch to the parent after a `module_for_key` check (what
+  `wrap_env.py` used to do).
+- persistent: each overlay is a `PersistentMap` that shares the parent's map
+  and only copies the paths to its overridden entries (what it does now).
+
+Run it with `python persistent_overlay_benchmark.py [saved_keys] [overlays] [keys_per_overlay]`.
+"""
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from persistent_map import PersistentMap
+
+
+def module_for_key(key: str) -> str:
+    return key.split(".")[0]
+
+
+class ChainedOverlay:
+    def __init__(self, parent: Dict[str, Any], module: str) -> None:
+        self.parent = parent
+        self.module = module
+        self.cached: Dict[str, Any] = {}
+
+    def set(self, key: str, value: Any) -> None:
+        self.cached[key] = value
+
+    def get(self, key: str) -> Any:
+        if module_for_key(key) != self.module:
+            return self.parent[key]
+        return self.cached[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.parent, **self.cached)
+
+
+class PersistentOverlay:
+    def __init__(self, parent: PersistentMap[str, Any], module: str) -> None:
+        self.cached = parent
+
+    def set(self, key: str, value: Any) -> None:
+        self.cached = self.cached.set(key, value)
+
+    def get(self, key: str) -> Any:
+        return self.cached[key]
+
+    def snapshot(self) -> PersistentMap[str, Any]:
+        return self.cached
+
+
+def timed(f: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def measure(
+    persistent: bool,
+    saved_keys: int,
+    overlays: int,
+    keys_per_overlay: int,
+) -> Dict[str, float]:
+    keys = [f"m{index // keys_per_overlay}.C{index % keys_per_overlay}" for index in range(saved_keys)]
+    saved_dict = {key: key for key in keys}
+    parent: Any = PersistentMap.from_dict(saved_dict) if persistent else saved_dict
+    overlay_class = PersistentOverlay if persistent else ChainedOverlay
+    modules = [f"m{index}" for index in range(overlays)]
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    opened: List[Any] = [overlay_class(parent, module) for module in modules]
+    create_s = time.perf_counter() - start
+    for overlay, module in zip(opened, modules):
+        for index in range(keys_per_overlay):
+            overlay.set(f"{module}.C{index}", "overridden")
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sample = opened[:10]
+    owned = [f"m{index}.C0" for index in range(10)]
+    lookups = 20_000
+
+    def owned_lookups() -> None:
+        for _ in range(lookups // len(sample)):
+            for overlay, key in zip(sample, owned):
+                overlay.get(key)
+
+    def shared_lookups() -> None:
+        for _ in range(lookups // len(sample)):
+            for overlay, key in zip(sample, keys[-len(sample):]):
+                overlay.get(key)
+
+    return {
+        "create_us_per_overlay": 1e6 * create_s / overlays,
+        "kb_per_overlay": (after - before) / overlays / 1024,
+        "owned_lookup_ns": 1e9 * timed(owned_lookups) / lookups,
+        "shared_lookup_ns": 1e9 * timed(shared_lookups) / lookups,
+        "snapshot_us": 1e6 * timed(lambda: [overlay.snapshot() for overlay in sample]) / len(sample),
+    }
+
+
+def report(saved_keys: int = 100_000, overlays: int = 200, keys_per_overlay: int = 10) -> Dict[str, Dict[str, float]]:
+    return {
+        name: measure(persistent, saved_keys, overlays, keys_per_overlay)
+        for name, persistent in [("chained", False), ("persistent", True)]
+    }
+
+
+if __name__ == "__main__":
+    saved_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    overlays = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    keys_per_overlay = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f"{saved_keys} saved keys, {overlays} overlays overriding {keys_per_overlay} keys each")
+    for name, row in report(saved_keys, overlays, keys_per_overlay).items():
+        print(
+            f"{name:>11}: create {row['create_us_per_overlay']:.2f}us, {row['kb_per_overlay']:.1f}KB per overlay, "
+            f"lookup owned {row['owned_lookup_ns']:.0f}ns / shared {row['shared_lookup_ns']:.0f}ns, "
+            f"snapshot {row['snapshot_us']:.1f}us"
+        )
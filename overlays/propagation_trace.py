@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Trace what an env stack does, as nested spans in the Chrome trace-event
+format, so that a slow edit can be taken apart in Perfetto
+(https://ui.perfetto.dev) or `chrome://tracing`: which layers it went
+through, which keys it recomputed, and which dependency edges fanned it out.
+
+`tracing(module, tracer)` patches the environment classes of any prototype
+(e.g. `wrap_memory`) while it is active, so it works on every stack built by
+that module's `create_env_stack`, and costs nothing once it is done. It
+records a span for every
+
+- `update`: the arguments of the edit, except the code.
+- `update_for_push`: the keys pushed to the layer, and the dependency edges
+  out of them it fans out over (`fan_out`, as `key -> dependents`).
+- `get`: the key, the key of the reader that asked for it (`dependency`,
+  i.e. what triggered it), and whether it was a cache `hit` or `miss` (it
+  missed if `produce_value` ran for the same key right under it).
+- `produce_value`: the key, and whether a push or a `get` asked for it.
+
+Spans are named `<layer>.<method> <key>` and carry the overlay they ran in
+where the prototype has a notion of one: the overlay key in
+`overlay_keys.py`, the overlaid modules in `wrap_env.py`, and the table
+("saved" or "unsaved") in `wrap_memory.py`. The overlays of
+`read_only_overlay.py` are closures rather than environments, so their
+lookups only show up as `produce_value` spans with no `get` around them.
+
+The tracer is not thread-safe; trace one stack at a time.
+
+Run it with `python propagation_trace.py TRACE.json [prototype] [modules]` to
+trace a save of the hub module of a synthetic project on a warm stack.
+"""
+import contextlib
+import inspect
+import json
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional
+
+from synthetic_codebase import ProjectShape, generate
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.events: List[Dict[str, Any]] = []
+        self.stack: List[Dict[str, Any]] = []
+        self.origin = time.perf_counter_ns()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, args: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Record a span around the block; `args` can still be filled in
+        while it runs."""
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (time.perf_counter_ns() - self.origin) / 1e3,
+            "pid": 1,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        self.stack.append(event)
+        try:
+            yield args
+        finally:
+            self.stack.pop()
+            event["dur"] = (time.perf_counter_ns() - self.origin) / 1e3 - event["ts"]
+            self.events.append(event)
+
+    @property
+    def current(self) -> Optional[Dict[str, Any]]:
+        return self.stack[-1] if self.stack else None
+
+    def export(self) -> Dict[str, Any]:
+        return {
+            "traceEvents": sorted(self.events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ns",
+        }
+
+    def write(self, file: IO[str]) -> None:
+        json.dump(self.export(), file)
+
+
+def _layers(module: ModuleType) -> List[type]:
+    return [module.CodeEnv, module.AstEnv, module.ClassBodyEnv, module.ClassParentsEnv, module.ClassGrandparentsEnv]
+
+
+def _overlay(env: Any, key: Optional[str], use_saved_contents_of_dependents: Optional[bool]) -> Optional[str]:
+    overlay_key = getattr(env, "overlay_key", None)
+    if overlay_key is not None:
+        return "/".join(overlay_key)
+    overlay = getattr(env, "overlay", None)
+    if isinstance(overlay, tuple):
+        modules = []
+        while isinstance(overlay, tuple):
+            modules.append(overlay[0])
+            overlay = getattr(overlay[1], "overlay", None)
+        return "/".join(reversed(modules))
+    unsaved_modules = getattr(getattr(env, "writable_env", None), "unsaved_modules", None)
+    if unsaved_modules is not None and key is not None and use_saved_contents_of_dependents is not None:
+        if use_saved_contents_of_dependents or key.split(".")[0] not in unsaved_modules:
+            return "saved"
+        return "unsaved"
+    return None
+
+
+def _keys(keys_to_update: Any) -> List[str]:
+    # `wrap_memory.Dependents` or a plain set
+    if hasattr(keys_to_update, "saved"):
+        return sorted(keys_to_update.saved | keys_to_update.unsaved)
+    return sorted(keys_to_update)
+
+
+def _fan_out(env: Any, keys: List[str]) -> Dict[str, List[str]]:
+    writable_env = getattr(env, "writable_env", None)
+    if writable_env is not None:
+        edges = [
+            table
+            for table in [getattr(writable_env, "dependencies", None), getattr(writable_env, "unsaved_dependencies", None)]
+            if table is not None
+        ]
+    else:
+        edges = [env.dependencies]
+    fan_out = {}
+    for key in keys:
+        dependents = set()
+        for table in edges:
+            dependents |= table.get(key, set())
+        if dependents:
+            fan_out[key] = sorted(str(dependent) for dependent in dependents)
+    return fan_out
+
+
+def _argument(args: Any, kwargs: Dict[str, Any], index: int, name: str) -> Any:
+    if len(args) > index:
+        return args[index]
+    return kwargs.get(name)
+
+
+@contextlib.contextmanager
+def tracing(module: ModuleType, tracer: Tracer) -> Iterator[Tracer]:
+    """Trace every stack of `module` into `tracer` for the duration."""
+    originals = []
+
+    def patch(cls: type, name: str, make: Callable[[Any], Any]) -> None:
+        if name in cls.__dict__:
+            original = cls.__dict__[name]
+            originals.append((cls, name, original))
+            setattr(cls, name, make(original))
+
+    def traced_get(get: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            key = _argument(args, kwargs, 0, "key")
+            layer = type(self).__name__
+            span_args = {
+                "key": key,
+                "dependency": _argument(args, kwargs, 1, "dependency"),
+                "overlay": _overlay(self, key, _argument(args, kwargs, 2, "use_saved_contents_of_dependents")),
+                "cache": "hit",
+            }
+            with tracer.span(f"{layer}.get {key}", "get", span_args):
+                return get(self, *args, **kwargs)
+        return wrapper
+
+    def traced_update_for_push(update_for_push: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(self: Any, keys_to_update: Any, *args: Any, **kwargs: Any) -> Any:
+            keys = _keys(keys_to_update)
+            layer = type(self).__name__
+            span_args = {
+                "keys": keys,
+                "overlay": _overlay(self, None, None),
+                "fan_out": _fan_out(self, keys),
+            }
+            with tracer.span(f"{layer}.update_for_push", "update_for_push", span_args):
+                downstream_deps = update_for_push(self, keys_to_update, *args, **kwargs)
+                span_args["dependents"] = len(_keys(downstream_deps))
+                return downstream_deps
+        return wrapper
+
+    def traced_update(update: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            arguments = inspect.signature(update).bind(self, *args, **kwargs).arguments
+            span_args = {
+                name: value
+                for name, value in arguments.items()
+                if name not in ("self", "code") and isinstance(value, (str, bool, int, type(None)))
+            }
+            with tracer.span(f"{type(self).__name__}.update {arguments.get('module')}", "update", span_args):
+                return update(self, *args, **kwargs)
+        return wrapper
+
+    def traced_produce_value(layer: str, produce_value: Callable[..., Any], is_method: bool) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = args[1] if is_method else args[0]
+            parent = tracer.current
+            span_args: Dict[str, Any] = {"key": key}
+            if parent is not None and parent["cat"] == "get" and parent["args"]["key"] == key:
+                parent["args"]["cache"] = "miss"
+                span_args["overlay"] = parent["args"]["overlay"]
+                span_args["by"] = "get"
+            elif parent is not None and parent["cat"] == "update_for_push":
+                span_args["overlay"] = parent["args"]["overlay"]
+                span_args["by"] = "push"
+            with tracer.span(f"{layer}.produce_value {key}", "produce_value", span_args):
+                return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        for cls in [module.EnvTable] + _layers(module):
+            patch(cls, "get", traced_get)
+            patch(cls, "update_for_push", traced_update_for_push)
+            patch(cls, "update", traced_update)
+        for cls in _layers(module):
+            # `basic.py` uses plain methods, the others static methods.
+            patch(cls, "produce_value", lambda original, layer=cls.__name__: (
+                staticmethod(traced_produce_value(layer, original.__func__, False))
+                if isinstance(original, staticmethod)
+                else traced_produce_value(layer, original, True)
+            ))
+        yield tracer
+    finally:
+        for cls, name, original in reversed(originals):
+            setattr(cls, name, original)
+
+
+def trace_hub_save(prototype: str = "wrap_memory", shape: ProjectShape = ProjectShape(modules=20)) -> Tracer:
+    """Trace saving an edit of the hub module `m0` on a warm stack, and
+    looking at every class afterwards."""
+    from scaling_benchmark import PROTOTYPES
+
+    session_class = PROTOTYPES[prototype]
+    project = generate(shape)
+    session = session_class(project.code)
+    for key in project.all_keys():
+        session.query(key)
+    tracer = Tracer()
+    with tracing(session_class.module, tracer):
+        session.save("m0", project.edit("m0", 0))
+        for key in project.all_keys():
+            session.query(key)
+    return tracer
+
+
+if __name__ == "__main__":
+    path, *rest = sys.argv[1:]
+    prototype = rest[0] if rest else "wrap_memory"
+    modules = int(rest[1]) if len(rest) > 1 else 20
+    tracer = trace_hub_save(prototype, ProjectShape(modules=modules))
+    with open(path, "w") as f:
+        tracer.write(f)
+    print(f"{len(tracer.events)} spans written to {path}")
@@ -1,7 +1,10 @@
 import ast
 import dataclasses
+import multiprocessing
+import os
+from collections import OrderedDict, deque
 from typing import (
-    Any, Dict, Generic, Protocol, Set, Tuple, TypeVar, List, Optional
+    Any, Callable, Deque, Dict, Generic, Protocol, Sequence, Set, Tuple, TypeVar, List, Optional, Union
 )
 
 from typing_extensions import TypeAlias
@@ -11,12 +14,89 @@ import textwrap
 T = TypeVar("T")
 
 
-
 class ReadOnlyEnv(Generic[T], Protocol):
     def __call__(key: str, dependency: str) -> T:
         ...
 
 
+@dataclasses.dataclass(frozen=True)
+class QueryStats:
+    key: str
+    parses: int
+    reparses_avoided: int
+
+
+class OverlayMemo:
+    # A bounded (least-recently-used) table of overlaid values for one overlay,
+    # keyed by (environment, key) and shared by every layer of the overlay.
+    #
+    # A memo belongs to one text of the overlaid module: when the text changes,
+    # call `invalidate` before building the new overlay. Saved updates can
+    # change overlaid values too, so the memo also clears itself whenever the
+    # saved code has changed since it was filled.
+
+    values: OrderedDict[Tuple["EnvTable", str], Any]
+
+    def __init__(self, max_entries: int = 1024, max_queries: int = 256) -> None:
+        self.max_entries = max_entries
+        self.values = OrderedDict()
+        self.overlay_code: Optional[Tuple[str, str]] = None
+        self.saved_generation = CodeEnv.generation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # `AstEnv` lookups, i.e. the reparses of the overlaid module
+        self.parses = 0
+        self.reparses_avoided = 0
+        self.queries: Deque[QueryStats] = deque(maxlen=max_queries)
+
+    def bind(self, module: str, code: str) -> None:
+        if self.overlay_code is None:
+            self.overlay_code = (module, code)
+        elif self.overlay_code != (module, code):
+            raise RuntimeError(
+                f"This memo holds values for another text of `{self.overlay_code[0]}`; "
+                "call `invalidate` before reusing it"
+            )
+
+    def invalidate(self) -> None:
+        self.values.clear()
+        self.overlay_code = None
+        self.invalidations += 1
+
+    def lookup(self, env: "EnvTable", key: str, produce_value: Callable[[str], Any]) -> Any:
+        if self.saved_generation != CodeEnv.generation:
+            self.values.clear()
+            self.saved_generation = CodeEnv.generation
+        memo_key = (env, key)
+        is_ast = isinstance(env, AstEnv)
+        if memo_key in self.values:
+            self.values.move_to_end(memo_key)
+            self.hits += 1
+            self.reparses_avoided += is_ast
+            return self.values[memo_key]
+        self.misses += 1
+        self.parses += is_ast
+        value = produce_value(key)
+        self.values[memo_key] = value
+        if len(self.values) > self.max_entries:
+            self.values.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def query(self, get: ReadOnlyEnv, key: str) -> Any:
+        """Look up `key` through the overlay `get`, recording parse counts for it."""
+        parses, reparses_avoided = self.parses, self.reparses_avoided
+        value = get(key, "")
+        self.queries.append(QueryStats(
+            key=key,
+            parses=self.parses - parses,
+            reparses_avoided=self.reparses_avoided - reparses_avoided,
+        ))
+        return value
+
+
 class EnvTable(Generic[T]):
     # It's a pain to type this well so I'll place fast and loose
     # with the types here to avoid an explosion of generics
@@ -73,19 +153,22 @@ class EnvTable(Generic[T]):
     def read_only(self) -> ReadOnlyEnv[T]:
         return self.get
 
-    def overlay(self, module:str, code: str) -> ReadOnlyEnv[T]:
+    def overlay(self, module:str, code: str, memo: Optional[OverlayMemo] = None) -> ReadOnlyEnv[T]:
         if self.upstream_env is None:
             raise NotImplementedError()
         else:
             upstream_get = self.upstream_env.overlay(
                 module=module,
                 code=code,
+                memo=memo,
             )
             produce_value = lambda key: self.produce_value(key, upstream_get)
 
             def get(key: str, dependency: str):
                 if key.startswith(module):
-                    return produce_value(key)
+                    if memo is None:
+                        return produce_value(key)
+                    return memo.lookup(self, key, produce_value)
                 else:
                     # we do not register dependencies; this avoids edge cases in our
                     # toy implementation but registering them in ocaml would be okay
@@ -93,6 +176,78 @@ class EnvTable(Generic[T]):
 
             return get
 
+    def evaluate_candidates(
+        self,
+        module: str,
+        codes: Sequence[str],
+        queries: Sequence[str],
+        processes: Optional[int] = None,
+    ) -> List[Dict[str, Union[T, Exception]]]:
+        """
+        Evaluate `queries` in an overlay of `module` for each candidate text in
+        `codes`, e.g. to rank quick-fixes. A query that fails for a candidate
+        gets the exception in place of its value, and the candidate's other
+        queries are still evaluated.
+
+        Lookups of keys outside `module` go through the (shared) saved caches,
+        and overlaid values are memoized within each candidate. The first
+        candidate is evaluated in this process so that it warms the saved
+        caches; the rest are spread over `processes` forked workers, which
+        inherit the warm caches.
+        """
+        if not codes:
+            return []
+        first = _evaluate_candidate(self, module, codes[0], queries)
+        rest = list(codes[1:])
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(rest))
+        if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return [first] + [
+                _evaluate_candidate(self, module, code, queries)
+                for code in rest
+            ]
+        global _candidate_batch
+        _candidate_batch = (self, module, queries)
+        try:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                return [first] + pool.map(
+                    _evaluate_forked_candidate,
+                    rest,
+                    chunksize=max(1, len(rest) // (4 * processes)),
+                )
+        finally:
+            _candidate_batch = None
+
+
+def _evaluate_candidate(
+    env: EnvTable[T],
+    module: str,
+    code: str,
+    queries: Sequence[str],
+) -> Dict[str, Union[T, Exception]]:
+    memo = OverlayMemo()
+    get = env.overlay(module, code, memo=memo)
+    results: Dict[str, Union[T, Exception]] = {}
+    for query in queries:
+        try:
+            results[query] = memo.query(get, query)
+        except Exception as exception:
+            results[query] = exception
+    return results
+
+
+# The env and queries of the batch being evaluated; forked workers inherit it
+# instead of having to pickle the whole env stack.
+_candidate_batch: Optional[Tuple[EnvTable, str, Sequence[str]]] = None
+
+
+def _evaluate_forked_candidate(code: str) -> Dict[str, Any]:
+    if _candidate_batch is None:
+        raise RuntimeError("Not inside evaluate_candidates")
+    env, module, queries = _candidate_batch
+    return _evaluate_candidate(env, module, code, queries)
+
 
 # "module_name"
 Module: TypeAlias = str
@@ -101,6 +256,8 @@ Code: TypeAlias = str
 
 class CodeEnv(EnvTable[Code]):
     codes: Dict[Module, Code] = {}
+    # bumped on every saved update, so that overlay memos know to clear
+    generation: int = 0
 
     def __init__(self, codes: Dict[Module, Code]) -> None:
         super().__init__()
@@ -115,10 +272,13 @@ class CodeEnv(EnvTable[Code]):
 
     def update(self, module: str, code: str) -> Set[str]:
         CodeEnv.codes[module] = code
+        CodeEnv.generation += 1
         self.cached[module] = self.produce_value(module, upstream_get=None)
         return self.dependencies[module]
 
-    def overlay(self, module: str, code: str) -> ReadOnlyEnv[Code]:
+    def overlay(self, module: str, code: str, memo: Optional[OverlayMemo] = None) -> ReadOnlyEnv[Code]:
+        if memo is not None:
+            memo.bind(module, code)
 
         def get(key, dependency):
             if key == module:
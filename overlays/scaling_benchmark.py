@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Run every prototype's `create_env_stack` on synthetic projects
+(`synthetic_codebase.py`) of growing size, and report wall time,
+`produce_value` calls and peak memory of each scenario as JSON. This is the
+baseline the other benchmarks and optimizations should be judged against.
+
+Each scenario except `cold` starts from a fresh stack on which the
+grandparents of every class have been looked at once:
+
+- cold: build the stack and look at the grandparents of every class.
+- single_edit: edit a module in the middle of the project once, and look at
+  the grandparents of its classes.
+- burst_edit: edit the same module `burst` times in a row, looking at its
+  classes after each edit, like typing.
+- save: save an edit of the hub module `m0`, and look at every class.
+- overlay: look at the classes of the middle module for `candidates`
+  candidate texts without keeping any of them, e.g. to rank quick fixes.
+
+An edit goes through each prototype's own path for unsaved text: an overlay
+for `read_only_overlay.py`, `wrap_env.py` and `overlay_keys.py`, an unsaved
+update for `wrap_memory.py`, and a plain update for the prototypes that have
+no notion of unsaved text. Those have no overlay scenario either.
+
+Wall times are measured on their own, and `produce_value` calls and peak
+memory (above what the stack held when the scenario started) in a second run.
+
+Run it with `python scaling_benchmark.py [modules ...]`, e.g.
+`python scaling_benchmark.py 10 40 160 > baseline.json`.
+"""
+import contextlib
+import dataclasses
+import io
+import json
+import sys
+import time
+import tracemalloc
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Type
+
+import basic
+import factor_out_memory
+import overlay_keys
+import read_only
+import read_only_overlay
+import wrap_env
+import wrap_memory
+from synthetic_codebase import ProjectShape, SyntheticProject, generate
+
+
+SCENARIOS = ["cold", "single_edit", "burst_edit", "save", "overlay"]
+
+
+class Session:
+    """One prototype's stack, driven through a common interface."""
+
+    module: ModuleType
+    has_overlays = False
+
+    def __init__(self, code: Dict[str, str]) -> None:
+        *_, self.env = self.module.create_env_stack(code=dict(code))
+
+    def query(self, key: str) -> Any:
+        return self.env.get(key, "")
+
+    def query_saved(self, key: str) -> Any:
+        # The stack itself is the saved view (or the only one).
+        return self.env.get(key, "")
+
+    def edit(self, module: str, text: str) -> None:
+        self.env.update(module, text)
+
+    def save(self, module: str, text: str) -> None:
+        self.env.update(module, text)
+
+    def overlay(self, module: str, texts: Sequence[str], keys: Sequence[str]) -> List[List[Any]]:
+        raise NotImplementedError()
+
+
+class BasicSession(Session):
+    module = basic
+
+
+class ReadOnlySession(Session):
+    module = read_only
+
+
+class FactorOutMemorySession(Session):
+    module = factor_out_memory
+
+    def __init__(self, code: Dict[str, str]) -> None:
+        # The code env is a singleton that outlives its stack, dependencies
+        # included; start every session from a fresh one.
+        factor_out_memory.WritableCodeEnv._writable_code_env = None
+        super().__init__(code)
+
+
+class ReadOnlyOverlaySession(Session):
+    module = read_only_overlay
+    has_overlays = True
+
+    def __init__(self, code: Dict[str, str]) -> None:
+        super().__init__(code)
+        self.overlay_get: Optional[Callable[[str, str], Any]] = None
+
+    def query(self, key: str) -> Any:
+        if self.overlay_get is None:
+            return super().query(key)
+        return self.overlay_get(key, "")
+
+    def edit(self, module: str, text: str) -> None:
+        self.overlay_get = self.env.overlay(module, text, memo=read_only_overlay.OverlayMemo())
+
+    def overlay(self, module: str, texts: Sequence[str], keys: Sequence[str]) -> List[List[Any]]:
+        results = []
+        for text in texts:
+            get = self.env.overlay(module, text, memo=read_only_overlay.OverlayMemo())
+            results.append([get(key, "") for key in keys])
+        return results
+
+
+class WrapEnvSession(Session):
+    module = wrap_env
+    has_overlays = True
+
+    def __init__(self, code: Dict[str, str]) -> None:
+        super().__init__(code)
+        self.edited: Optional[str] = None
+
+    def query(self, key: str) -> Any:
+        if self.edited is None:
+            return super().query(key)
+        return self.env.children[self.edited].get(key, "")
+
+    def edit(self, module: str, text: str) -> None:
+        # `get_overlay` reports whether it reused an overlay on stdout.
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.env.update(module, text, in_overlay=True)
+        self.edited = module
+
+    def overlay(self, module: str, texts: Sequence[str], keys: Sequence[str]) -> List[List[Any]]:
+        results = []
+        for text in texts:
+            self.edit(module, text)
+            results.append([self.query(key) for key in keys])
+        self.close(module)
+        return results
+
+    def close(self, module: str) -> None:
+        # `wrap_env.py` cannot close overlays; it keeps the last one around.
+        self.edited = None
+
+
+class OverlayKeysSession(WrapEnvSession):
+    module = overlay_keys
+
+    def close(self, module: str) -> None:
+        self.env.close_overlay(module)
+        self.edited = None
+
+
+class WrapMemorySession(Session):
+    module = wrap_memory
+    has_overlays = True
+
+    def __init__(self, code: Dict[str, str]) -> None:
+        super().__init__(code)
+        self.saved_code = dict(code)
+
+    def query(self, key: str) -> Any:
+        return self.env.get(key, None, use_saved_contents_of_dependents=False)
+
+    def query_saved(self, key: str) -> Any:
+        return self.env.get(key, None, use_saved_contents_of_dependents=True)
+
+    def edit(self, module: str, text: str) -> None:
+        self.env.update(module, text, is_saved_content=False)
+
+    def save(self, module: str, text: str) -> None:
+        self.env.update(module, text, is_saved_content=True)
+        self.saved_code[module] = text
+
+    def overlay(self, module: str, texts: Sequence[str], keys: Sequence[str]) -> List[List[Any]]:
+        results = []
+        for text in texts:
+            self.edit(module, text)
+            results.append([self.query(key) for key in keys])
+        # Reverting to the saved text drops the unsaved values.
+        self.edit(module, self.saved_code[module])
+        return results
+
+
+PROTOTYPES: Dict[str, Type[Session]] = {
+    "basic": BasicSession,
+    "read_only": ReadOnlySession,
+    "factor_out_memory": FactorOutMemorySession,
+    "read_only_overlay": ReadOnlyOverlaySession,
+    "wrap_env": WrapEnvSession,
+    "overlay_keys": OverlayKeysSession,
+    "wrap_memory": WrapMemorySession,
+}
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.calls = 0
+
+
+@contextlib.contextmanager
+def counting_produce_value(module: ModuleType, counter: Counter) -> Iterator[None]:
+    classes = [module.AstEnv, module.ClassBodyEnv, module.ClassParentsEnv, module.ClassGrandparentsEnv]
+    originals = {cls: cls.__dict__["produce_value"] for cls in classes}
+
+    def counted(produce_value: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            counter.calls += 1
+            return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        for cls, original in originals.items():
+            # `basic.py` uses plain methods, the others static methods.
+            if isinstance(original, staticmethod):
+                setattr(cls, "produce_value", staticmethod(counted(original.__func__)))
+            else:
+                setattr(cls, "produce_value", counted(original))
+        yield
+    finally:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", original)
+
+
+def _scenario(
+    session_class: Type[Session],
+    project: SyntheticProject,
+    scenario: str,
+    burst: int,
+    candidates: int,
+) -> Callable[[], List[Any]]:
+    """Set up `scenario` and return the part of it that is measured, which
+    returns the values it looked at."""
+    keys = project.all_keys()
+    middle = f"m{project.shape.modules // 2}"
+    middle_keys = project.classes[middle]
+    if scenario == "cold":
+        return lambda: [session_class(project.code).query(key) for key in keys]
+
+    session = session_class(project.code)
+    for key in keys:
+        session.query(key)
+
+    def single_edit() -> List[Any]:
+        session.edit(middle, project.edit(middle, 0))
+        return [session.query(key) for key in middle_keys]
+
+    def burst_edit() -> List[Any]:
+        values = []
+        for step in range(burst):
+            session.edit(middle, project.edit(middle, step))
+            values = [session.query(key) for key in middle_keys]
+        return values
+
+    def save() -> List[Any]:
+        session.save("m0", project.edit("m0", 0))
+        return [session.query(key) for key in keys]
+
+    def overlay() -> List[Any]:
+        texts = [project.edit(middle, step) for step in range(candidates)]
+        return session.overlay(middle, texts, middle_keys)
+
+    return {"single_edit": single_edit, "burst_edit": burst_edit, "save": save, "overlay": overlay}[scenario]
+
+
+def measure(
+    session_class: Type[Session],
+    project: SyntheticProject,
+    scenario: str,
+    burst: int = 20,
+    candidates: int = 10,
+) -> Dict[str, Any]:
+    run = _scenario(session_class, project, scenario, burst, candidates)
+    start = time.perf_counter()
+    values = run()
+    wall_s = time.perf_counter() - start
+
+    run = _scenario(session_class, project, scenario, burst, candidates)
+    counter = Counter()
+    with counting_produce_value(session_class.module, counter):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "wall_ms": 1e3 * wall_s,
+        "produce_value_calls": counter.calls,
+        "peak_kb": (peak - before) / 1024,
+        "values": values,
+    }
+
+
+def report(
+    sizes: Sequence[int] = (10, 40, 160),
+    shape: ProjectShape = ProjectShape(),
+    prototypes: Sequence[str] = tuple(PROTOTYPES),
+    burst: int = 20,
+    candidates: int = 10,
+) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    # Get the one-time allocations of the first run out of the way.
+    tiny = generate(dataclasses.replace(shape, modules=2))
+    for name in prototypes:
+        measure(PROTOTYPES[name], tiny, "cold")
+    for modules in sizes:
+        project = generate(dataclasses.replace(shape, modules=modules))
+        by_prototype: Dict[str, Dict[str, Any]] = {}
+        expected: Dict[str, Any] = {}
+        for name in prototypes:
+            session_class = PROTOTYPES[name]
+            by_prototype[name] = {}
+            for scenario in SCENARIOS:
+                if scenario == "overlay" and not session_class.has_overlays:
+                    continue
+                row = measure(session_class, project, scenario, burst, candidates)
+                values = row.pop("values")
+                if expected.setdefault(scenario, values) != values:
+                    raise RuntimeError(f"{name} diverged from the other prototypes on {scenario}")
+                by_prototype[name][scenario] = row
+        results[str(modules)] = by_prototype
+    return {
+        "shape": dict(dataclasses.asdict(shape), modules=list(sizes)),
+        "burst": burst,
+        "candidates": candidates,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    sizes = [int(argument) for argument in sys.argv[1:]] or [10, 40, 160]
+    json.dump(report(sizes), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import ast
+import dataclasses
+import heapq
+import itertools
+import json
+import sys
+from typing import IO, Any, Awaitable, Callable, Dict, List, Optional
+
+from edit_queue import EditQueue
+from session_trace import Recorder
+from wrap_memory import Code, Module, SlowOperationLog, create_env_stack, module
+
+
+# A small LSP-style front-end for the `wrap_memory.py` env stack.
+#
+# Messages are JSON-RPC 2.0 with LSP's `Content-Length` framing, over stdio or
+# a Unix socket. Parameters are simplified: documents are identified by module
+# name rather than by uri, and edits always carry the full text.
+#
+# Notifications (no response):
+# - `textDocument/didOpen`   {"module", "text"}: focuses the module, and is an
+#                             unsaved edit if `text` is not what we have
+# - `textDocument/didChange` {"module", "text"}: an unsaved edit
+# - `textDocument/didSave`   {"module", "text"}: a saved edit
+# - `textDocument/didClose`  {"module"}: drops the unsaved contents
+#
+# Requests (the unsaved view of `key`, a "module.ClassName"):
+# - `grandparents` {"key"}: list of class names
+# - `parents`      {"key"}: list of class names
+# - `class_body`   {"key"}: the unparsed class definition, or null
+#
+# and, for diagnostics, `slow_operations` {"key"?}: the recent edits and
+# queries that took longer than `--slow-operation-ms` (see
+# `wrap_memory.SlowOperationLog`), only those of the module of `key` if given.
+#
+# Edits are handled as soon as they are read, in order, and go through an
+# `EditQueue` so that bursts of unsaved edits are coalesced. Requests are
+# pipelined: the connection keeps reading while earlier requests are pending,
+# and a single worker answers them in priority order, where requests about the
+# module that the client most recently opened or edited come first. Before
+# answering, the worker flushes any pending edit of the requested module so
+# that the answer reflects the newest text we have received.
+
+
+JSON_RPC_METHOD_NOT_FOUND = -32601
+JSON_RPC_INTERNAL_ERROR = -32603
+
+FOCUSED_PRIORITY = 0
+BACKGROUND_PRIORITY = 1
+
+
+async def read_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    content_length = None
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.decode("ascii").partition(":")
+        if name.lower() == "content-length":
+            content_length = int(value)
+    if content_length is None:
+        raise RuntimeError("Message without a Content-Length header")
+    body = await reader.readexactly(content_length)
+    return json.loads(body)
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message).encode("utf-8")
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+@dataclasses.dataclass
+class Connection:
+    write: Callable[[bytes], None]
+    focused_module: Optional[Module] = None
+
+    def respond(self, id: Any, result: Any = None, error: Optional[Dict[str, Any]] = None) -> None:
+        message: Dict[str, Any] = {"jsonrpc": "2.0", "id": id}
+        if error is None:
+            message["result"] = result
+        else:
+            message["error"] = error
+        self.write(encode_message(message))
+
+
+@dataclasses.dataclass(order=True)
+class PendingRequest:
+    priority: int
+    sequence: int
+    connection: Connection = dataclasses.field(compare=False)
+    message: Dict[str, Any] = dataclasses.field(compare=False)
+
+
+class Server:
+    def __init__(
+        self,
+        code: Dict[Module, Code],
+        window: float = 0.05,
+        record: Optional[IO[str]] = None,
+        slow_operation_ms: Optional[float] = None,
+    ) -> None:
+        SlowOperationLog.configure(slow_operation_ms)
+        (
+            _,
+            _,
+            self.class_body_env,
+            self.class_parents_env,
+            self.class_grandparents_env,
+        ) = create_env_stack(code=code)
+        if record is not None:
+            # Edits and `grandparents` queries go through the top env, so
+            # that is what a trace for `session_trace.py` is made of.
+            self.class_grandparents_env = Recorder(self.class_grandparents_env, code, record)
+        self.edit_queue = EditQueue(self.class_grandparents_env, window=window)
+        self.requests: List[PendingRequest] = []
+        self.sequence = itertools.count()
+        self.has_requests: Optional[asyncio.Event] = None
+        self.queries: Dict[str, Callable[[str], Any]] = {
+            "grandparents": self.grandparents,
+            "parents": self.parents,
+            "class_body": self.class_body,
+            "slow_operations": self.slow_operations,
+        }
+
+    # queries
+
+    def grandparents(self, key: str) -> List[str]:
+        return self.class_grandparents_env.get(key, None, use_saved_contents_of_dependents=False)
+
+    def parents(self, key: str) -> List[str]:
+        return self.class_parents_env.get(key, None, use_saved_contents_of_dependents=False)
+
+    def class_body(self, key: str) -> Optional[str]:
+        class_def = self.class_body_env.get(key, None, use_saved_contents_of_dependents=False)
+        return None if class_def is None else ast.unparse(class_def)
+
+    def slow_operations(self, key: str) -> List[Dict[str, Any]]:
+        return [
+            dataclasses.asdict(entry)
+            for entry in SlowOperationLog.entries
+            if not key or module(entry.key) == module(key)
+        ]
+
+    # notifications
+
+    def did_open(self, connection: Connection, params: Dict[str, Any]) -> None:
+        opened_module = params["module"]
+        connection.focused_module = opened_module
+        # A buffer can open with text that was never saved (e.g. restored by
+        # the editor), which has to be analysed like any other unsaved edit.
+        if params["text"] != self.current_code(opened_module):
+            self.edit_queue.submit(opened_module, params["text"], is_saved_content=False)
+
+    def did_change(self, connection: Connection, params: Dict[str, Any]) -> None:
+        connection.focused_module = params["module"]
+        self.edit_queue.submit(params["module"], params["text"], is_saved_content=False)
+
+    def did_save(self, connection: Connection, params: Dict[str, Any]) -> None:
+        self.edit_queue.submit(params["module"], params["text"], is_saved_content=True)
+
+    def did_close(self, connection: Connection, params: Dict[str, Any]) -> None:
+        # Closing a buffer throws away its unsaved contents, which amounts to
+        # saving the text that is already on disk.
+        closed_module = params["module"]
+        if connection.focused_module == closed_module:
+            connection.focused_module = None
+        code_env = self.code_env()
+        if closed_module in code_env.writable_env.unsaved_modules or closed_module in self.edit_queue.pending:
+            saved_code = code_env.writable_env.saved_contents_cache_table[closed_module]
+            self.edit_queue.submit(closed_module, saved_code, is_saved_content=True)
+
+    def code_env(self) -> Any:
+        code_env = self.class_grandparents_env
+        while code_env.upstream_env is not None:
+            code_env = code_env.upstream_env
+        return code_env
+
+    def current_code(self, module_: Module) -> Optional[Code]:
+        """The newest text of `module_` that the server has been sent."""
+        if module_ in self.edit_queue.pending:
+            return self.edit_queue.pending[module_]
+        writable_env = self.code_env().writable_env
+        if module_ in writable_env.unsaved_modules:
+            return writable_env.unsaved_contents_cache_table.get(module_)
+        return writable_env.saved_contents_cache_table.get(module_)
+
+    # dispatch
+
+    def handle_message(self, connection: Connection, message: Dict[str, Any]) -> None:
+        method = message.get("method")
+        notifications = {
+            "textDocument/didOpen": self.did_open,
+            "textDocument/didChange": self.did_change,
+            "textDocument/didSave": self.did_save,
+            "textDocument/didClose": self.did_close,
+        }
+        if method in notifications:
+            try:
+                notifications[method](connection, message.get("params", {}))
+            except Exception as exception:
+                # There is nobody to respond to, so just log it and move on.
+                print(f"{method} failed: {type(exception).__name__}: {exception}", file=sys.stderr)
+            return
+        if "id" not in message:
+            return  # unknown notifications are ignored, as in LSP
+        key = message.get("params", {}).get("key", "")
+        priority = (
+            FOCUSED_PRIORITY
+            if connection.focused_module is not None and module(key) == connection.focused_module
+            else BACKGROUND_PRIORITY
+        )
+        heapq.heappush(
+            self.requests,
+            PendingRequest(priority, next(self.sequence), connection, message),
+        )
+        self._requests_available().set()
+
+    def answer(self, request: PendingRequest) -> None:
+        message = request.message
+        query = self.queries.get(message["method"])
+        if query is None:
+            request.connection.respond(message["id"], error={
+                "code": JSON_RPC_METHOD_NOT_FOUND,
+                "message": f"Unknown method {message['method']}",
+            })
+            return
+        key = message.get("params", {}).get("key", "")
+        try:
+            self.edit_queue.flush(module(key))
+            result = query(key)
+        except Exception as exception:
+            request.connection.respond(message["id"], error={
+                "code": JSON_RPC_INTERNAL_ERROR,
+                "message": f"{type(exception).__name__}: {exception}",
+            })
+            return
+        request.connection.respond(message["id"], result=result)
+
+    def _requests_available(self) -> asyncio.Event:
+        if self.has_requests is None:
+            self.has_requests = asyncio.Event()
+        return self.has_requests
+
+    async def worker(self) -> None:
+        has_requests = self._requests_available()
+        while True:
+            await has_requests.wait()
+            while self.requests:
+                self.answer(heapq.heappop(self.requests))
+                # let the connections read (and reprioritize) in between
+                await asyncio.sleep(0)
+            has_requests.clear()
+
+    async def handle_connection(
+        self,
+        reader: asyncio.StreamReader,
+        write: Callable[[bytes], None],
+        drain: Callable[[], Awaitable[None]],
+    ) -> None:
+        connection = Connection(write=write)
+        while True:
+            message = await read_message(reader)
+            if message is None:
+                break
+            self.handle_message(connection, message)
+            await drain()
+
+
+async def serve_unix(server: Server, path: str) -> asyncio.AbstractServer:
+    async def on_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await server.handle_connection(reader, writer.write, writer.drain)
+        finally:
+            writer.close()
+
+    return await asyncio.start_unix_server(on_connect, path=path)
+
+
+async def serve_stdio(server: Server) -> None:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    await server.handle_connection(reader, writer.write, writer.drain)
+
+
+def load_project(paths: List[str]) -> Dict[Module, Code]:
+    code = {}
+    for path in paths:
+        name = path.rsplit("/", 1)[-1]
+        if name.endswith(".py"):
+            name = name[:-3]
+        with open(path) as f:
+            code[name] = f.read()
+    return code
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    record = None if arguments.record is None else open(arguments.record, "w", buffering=1)
+    server = Server(
+        load_project(arguments.modules),
+        window=arguments.window,
+        record=record,
+        slow_operation_ms=arguments.slow_operation_ms,
+    )
+    worker = asyncio.ensure_future(server.worker())
+    try:
+        if arguments.socket is None:
+            await serve_stdio(server)
+        else:
+            unix_server = await serve_unix(server, arguments.socket)
+            async with unix_server:
+                await unix_server.serve_forever()
+    finally:
+        worker.cancel()
+        if record is not None:
+            record.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve queries on the wrap_memory.py env stack")
+    parser.add_argument("modules", nargs="*", help="python files making up the project")
+    parser.add_argument("--socket", help="listen on this Unix socket instead of stdio")
+    parser.add_argument("--window", type=float, default=0.05, help="debounce window for unsaved edits, in seconds")
+    parser.add_argument("--record", help="record the session to this trace file (see session_trace.py)")
+    parser.add_argument(
+        "--slow-operation-ms",
+        type=float,
+        help="log the edits and queries that take longer than this, for the slow_operations request",
+    )
+    asyncio.run(main(parser.parse_args()))
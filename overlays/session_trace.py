@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Record editing sessions against an env stack, and replay them against any of
+the prototypes (`scaling_benchmark.PROTOTYPES`) to compare their latency on
+identical workloads.
+
+`Recorder` wraps the top env of a stack and logs every `update` (saved, or
+unsaved / `in_overlay`) and `get` that goes through it; `server.py --record`
+uses it to collect traces from real sessions. A trace is JSON lines: a header
+with the initial code, then one line per operation:
+
+    {"code": {"a": "class X: pass\\n", ...}}
+    ["u", module, start, end, inserted, saved]
+    ["g", key, saved]
+
+An update only stores how the new text differs from the module's previous
+text (`previous[:start] + inserted + previous[end:]`), which keeps traces of
+typing small. `saved` on a `get` says whether it looked at the saved view.
+
+Replaying reports latency percentiles and `produce_value` calls per kind of
+operation. Unsaved updates go through each prototype's own path for unsaved
+text (see `scaling_benchmark.py`).
+
+Run it with `python session_trace.py replay TRACE [prototype ...]`, or
+`python session_trace.py synthesize TRACE [modules]` to record a typing
+session on a synthetic project.
+"""
+import argparse
+import dataclasses
+import inspect
+import json
+import statistics
+import sys
+import time
+from typing import IO, Any, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+import wrap_memory
+from scaling_benchmark import PROTOTYPES, Counter, Session, counting_produce_value
+from synthetic_codebase import ProjectShape, generate
+
+
+@dataclasses.dataclass(frozen=True)
+class Operation:
+    kind: str  # "update" or "get"
+    name: str  # the module of an update, the key of a get
+    saved: bool
+    text: Optional[str] = None
+
+
+def splice(old: str, new: str) -> Tuple[int, int, str]:
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    suffix = 0
+    while suffix < limit - start and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return start, len(old) - suffix, new[start:len(new) - suffix]
+
+
+class Recorder:
+    """Logs the `update`s and `get`s of `env` to `log`, and passes everything
+    through to it."""
+
+    def __init__(self, env: Any, code: Dict[str, str], log: IO[str]) -> None:
+        self.env = env
+        self.log = log
+        self.texts = dict(code)
+        self._write({"code": code})
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.env, name)
+
+    def _write(self, entry: Any) -> None:
+        self.log.write(json.dumps(entry) + "\n")
+
+    def update(self, module: str, code: str, *args: Any, **kwargs: Any) -> Any:
+        arguments = inspect.signature(self.env.update).bind(module, code, *args, **kwargs).arguments
+        saved = (
+            arguments["is_saved_content"]
+            if "is_saved_content" in arguments
+            else not arguments.get("in_overlay", False)
+        )
+        start, end, inserted = splice(self.texts.get(module, ""), code)
+        self.texts[module] = code
+        self._write(["u", module, start, end, inserted, saved])
+        return self.env.update(module, code, *args, **kwargs)
+
+    def get(self, key: str, dependency: Any, *args: Any, **kwargs: Any) -> Any:
+        arguments = inspect.signature(self.env.get).bind(key, dependency, *args, **kwargs).arguments
+        self._write(["g", key, arguments.get("use_saved_contents_of_dependents", True)])
+        return self.env.get(key, dependency, *args, **kwargs)
+
+
+def read_trace(lines: Iterable[str]) -> Tuple[Dict[str, str], List[Operation]]:
+    entries = (json.loads(line) for line in lines if line.strip())
+    code = next(entries)["code"]
+    texts = dict(code)
+    operations = []
+    for entry in entries:
+        if entry[0] == "u":
+            _, module, start, end, inserted, saved = entry
+            previous = texts.get(module, "")
+            texts[module] = previous[:start] + inserted + previous[end:]
+            operations.append(Operation("update", module, saved, texts[module]))
+        elif entry[0] == "g":
+            _, key, saved = entry
+            operations.append(Operation("get", key, saved))
+        else:
+            raise ValueError(f"Unknown trace entry {entry!r}")
+    return code, operations
+
+
+def _kind(operation: Operation) -> str:
+    if operation.kind == "update":
+        return "saved_update" if operation.saved else "unsaved_update"
+    return "saved_get" if operation.saved else "get"
+
+
+def apply(session: Session, operation: Operation) -> None:
+    kind = _kind(operation)
+    if kind == "saved_update":
+        session.save(operation.name, operation.text)
+    elif kind == "unsaved_update":
+        session.edit(operation.name, operation.text)
+    elif kind == "saved_get":
+        session.query_saved(operation.name)
+    else:
+        session.query(operation.name)
+
+
+def replay(session_class: Type[Session], code: Dict[str, str], operations: Sequence[Operation]) -> Dict[str, Dict[str, float]]:
+    session = session_class(code)
+    latencies: Dict[str, List[float]] = {}
+    calls: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    counter = Counter()
+    with counting_produce_value(session_class.module, counter):
+        for operation in operations:
+            kind = _kind(operation)
+            before = counter.calls
+            start = time.perf_counter()
+            try:
+                apply(session, operation)
+            except Exception:
+                # e.g. a half-typed class that does not parse; the recorded
+                # session went on, and so do we.
+                errors[kind] = errors.get(kind, 0) + 1
+            latencies.setdefault(kind, []).append(time.perf_counter() - start)
+            calls[kind] = calls.get(kind, 0) + counter.calls - before
+    return {
+        kind: {
+            "count": len(samples),
+            "p50_us": 1e6 * statistics.median(samples),
+            "p90_us": 1e6 * _percentile(samples, 0.9),
+            "p99_us": 1e6 * _percentile(samples, 0.99),
+            "max_us": 1e6 * max(samples),
+            "produce_value_calls": calls[kind],
+            "errors": errors.get(kind, 0),
+        }
+        for kind, samples in latencies.items()
+    }
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    return sorted(samples)[int(fraction * (len(samples) - 1))]
+
+
+def report(trace: Iterable[str], prototypes: Sequence[str] = tuple(PROTOTYPES)) -> Dict[str, Dict[str, Dict[str, float]]]:
+    code, operations = read_trace(trace)
+    return {name: replay(PROTOTYPES[name], code, operations) for name in prototypes}
+
+
+def record_typing_session(log: IO[str], shape: ProjectShape = ProjectShape(modules=20)) -> None:
+    """Record a made-up session on the `wrap_memory.py` stack: type a comment
+    and an edit into a module, looking at its classes after every keystroke,
+    then save it."""
+    project = generate(shape)
+    *_, env = wrap_memory.create_env_stack(code=dict(project.code))
+    recorder = Recorder(env, project.code, log)
+    for key in project.all_keys():
+        recorder.get(key, None, use_saved_contents_of_dependents=True)
+    module = f"m{shape.modules // 2}"
+    keys = project.classes[module]
+    text = project.code[module]
+    for typed in "# try another base":
+        text += typed
+        recorder.update(module, text, is_saved_content=False)
+        for key in keys:
+            recorder.get(key, None, use_saved_contents_of_dependents=False)
+    # A complete edit, e.g. from a code action.
+    text = project.edit(module, 0)
+    recorder.update(module, text, is_saved_content=False)
+    for key in keys:
+        recorder.get(key, None, use_saved_contents_of_dependents=False)
+    recorder.update(module, text, is_saved_content=True)
+    for key in project.all_keys():
+        recorder.get(key, None, use_saved_contents_of_dependents=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and replay editing sessions on the env stacks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="replay a trace against prototypes")
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument("prototypes", nargs="*", help=f"any of {', '.join(PROTOTYPES)} (default: all)")
+    synthesize_parser = commands.add_parser("synthesize", help="record a typing session on a synthetic project")
+    synthesize_parser.add_argument("trace")
+    synthesize_parser.add_argument("modules", nargs="?", type=int, default=20)
+    arguments = parser.parse_args()
+
+    if arguments.command == "synthesize":
+        with open(arguments.trace, "w") as log:
+            record_typing_session(log, ProjectShape(modules=arguments.modules))
+        sys.exit()
+    with open(arguments.trace) as trace:
+        results = report(trace, arguments.prototypes or list(PROTOTYPES))
+    for name, kinds in results.items():
+        print(name)
+        for kind, row in kinds.items():
+            print(
+                f"  {kind:>14}: {row['count']:>5} ops, p50 {row['p50_us']:.0f}us / p90 {row['p90_us']:.0f}us / "
+                f"p99 {row['p99_us']:.0f}us / max {row['max_us']:.0f}us, "
+                f"{row['produce_value_calls']} produce_value calls, {row['errors']} errors"
+            )
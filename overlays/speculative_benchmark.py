@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Measure how many candidate edits per second `read_only_overlay.py`'s
+`evaluate_candidates` can evaluate, with and without worker processes.
+
+Run it with `python speculative_benchmark.py [candidates] [processes]`.
+"""
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from read_only_overlay import create_env_stack
+
+
+def project(class_count: int) -> Dict[str, str]:
+    return {
+        "a": "\n".join(
+            ["class A0: pass"] + [f"class A{i}(a.A{i - 1}): pass" for i in range(1, class_count)]
+        ),
+        "b": "\n".join(
+            [f"class B{i}(a.A{i}): pass" for i in range(class_count)]
+        ),
+    }
+
+
+def candidates(code: str, count: int, class_count: int) -> List[str]:
+    # each candidate rebases one class of `b` onto a different class of `a`
+    lines = code.splitlines()
+    result = []
+    for index in range(count):
+        line = index % class_count
+        new_lines = list(lines)
+        new_lines[line] = f"class B{line}(a.A{(line * 7 + index) % class_count}): pass"
+        result.append("\n".join(new_lines))
+    return result
+
+
+def measure(
+    candidate_count: int,
+    processes: Optional[int],
+    class_count: int = 200,
+    query_count: int = 20,
+) -> Tuple[float, int]:
+    code = project(class_count)
+    *_, class_grandparents_env = create_env_stack(code=code)
+    queries = [f"b.B{i}" for i in range(query_count)]
+    codes = candidates(code["b"], candidate_count, class_count)
+    start = time.perf_counter()
+    results = class_grandparents_env.evaluate_candidates("b", codes, queries, processes=processes)
+    elapsed = time.perf_counter() - start
+    return len(results) / elapsed, len(results)
+
+
+if __name__ == "__main__":
+    candidate_count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    for label, process_count in [("sequential", 1), (f"{processes} processes", processes)]:
+        throughput, evaluated = measure(candidate_count, process_count)
+        print(f"{label:>14}: {evaluated} candidates, {throughput:.0f} candidates/s")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic projects for the toy env stacks, so that benchmarks can see
+how the prototypes scale beyond the two or three modules of the tests.
+
+A project is fully determined by its `ProjectShape` (including the seed):
+
+- modules `m0`, `m1`, ... each with `classes_per_module` classes `C0`, `C1`, ...
+- every class outside `m0` inherits from 1 to `max_bases` classes of the
+  `window` modules before it (the fan-in), so that bases are always defined
+  and there are no cycles,
+- `m0` also defines `hubs` classes `Hub0`, `Hub1`, ..., and a `hub_ratio` of
+  the other classes inherit from one of them too: that is where the fan-out
+  comes from.
+
+Run it with `python synthetic_codebase.py [modules] [classes_per_module]` to
+print a project.
+"""
+import dataclasses
+import random
+import sys
+from typing import Dict, List
+
+
+@dataclasses.dataclass(frozen=True)
+class ProjectShape:
+    modules: int = 40
+    classes_per_module: int = 10
+    max_bases: int = 2
+    window: int = 3
+    hubs: int = 4
+    hub_ratio: float = 0.2
+    seed: int = 0
+
+
+@dataclasses.dataclass
+class SyntheticProject:
+    shape: ProjectShape
+    # class key -> base class keys, in definition order
+    bases: Dict[str, List[str]]
+    # module -> class keys, in definition order
+    classes: Dict[str, List[str]]
+    code: Dict[str, str]
+
+    @property
+    def hub_keys(self) -> List[str]:
+        return [key for key in self.classes["m0"] if key.startswith("m0.Hub")]
+
+    def all_keys(self) -> List[str]:
+        return [key for keys in self.classes.values() for key in keys]
+
+    def _candidate_bases(self, key: str) -> List[str]:
+        # Everything defined before `key` (within the window), so an edit
+        # never introduces a cycle or an undefined base.
+        module = key.split(".")[0]
+        index = int(module[1:])
+        earlier = [
+            candidate
+            for other in range(max(0, index - self.shape.window), index)
+            for candidate in self.classes[f"m{other}"]
+        ]
+        own = self.classes[module]
+        return earlier + own[:own.index(key)]
+
+    def edit_class(self, key: str, step: int) -> str:
+        """The text of `key`'s module after the `step`th edit of `key`: the
+        class gets one more base, a different one for each step."""
+        module = key.split(".")[0]
+        candidates = [base for base in self._candidate_bases(key) if base not in self.bases[key]]
+        bases = dict(self.bases)
+        if candidates:
+            bases[key] = self.bases[key] + [candidates[step % len(candidates)]]
+        return _render(self.classes[module], bases)
+
+    def edit(self, module: str, step: int) -> str:
+        """The text of `module` after its `step`th edit. Successive steps edit
+        successive classes, so no two successive texts are the same."""
+        keys = [key for key in self.classes[module] if self._candidate_bases(key)]
+        if not keys:
+            raise ValueError(f"No class of `{module}` can be given another base")
+        return self.edit_class(keys[step % len(keys)], step // len(keys))
+
+
+def _render(keys: List[str], bases: Dict[str, List[str]]) -> str:
+    return "".join(
+        f"class {key.split('.')[1]}({', '.join(bases[key])}): pass\n"
+        if bases[key]
+        else f"class {key.split('.')[1]}: pass\n"
+        for key in keys
+    )
+
+
+def generate(shape: ProjectShape = ProjectShape()) -> SyntheticProject:
+    rng = random.Random(shape.seed)
+    hubs = [f"m0.Hub{index}" for index in range(shape.hubs)]
+    bases: Dict[str, List[str]] = {hub: [] for hub in hubs}
+    classes: Dict[str, List[str]] = {}
+    for index in range(shape.modules):
+        keys = [f"m{index}.C{i}" for i in range(shape.classes_per_module)]
+        earlier = [
+            key
+            for other in range(max(0, index - shape.window), index)
+            for key in classes[f"m{other}"]
+            if key not in hubs
+        ]
+        for key in keys:
+            chosen: List[str] = []
+            if earlier:
+                chosen = rng.sample(earlier, min(len(earlier), rng.randint(1, shape.max_bases)))
+            if hubs and rng.random() < shape.hub_ratio:
+                chosen.append(rng.choice(hubs))
+            bases[key] = chosen
+        classes[f"m{index}"] = (hubs if index == 0 else []) + keys
+    code = {module: _render(keys, bases) for module, keys in classes.items()}
+    return SyntheticProject(shape=shape, bases=bases, classes=classes, code=code)
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    modules, classes_per_module = arguments + [4, 3][len(arguments):]
+    project = generate(ProjectShape(modules=modules, classes_per_module=classes_per_module))
+    for module, text in project.code.items():
+        print(f"# {module}")
+        print(text)
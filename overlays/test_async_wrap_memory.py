@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import asyncio
+import ast
+
+import wrap_memory
+from async_wrap_memory import (
+    AsyncEnvTable, AsyncClassGrandparentsEnv, create_async_env_stack
+)
+from wrap_memory import create_env_stack
+
+
+CODE = {
+    "a": """
+        class X: pass
+        class Y(a.X): pass
+    """,
+    "b": """
+        class Z(a.X): pass
+        class W(b.Z): pass
+    """,
+    "c": """
+        class V(a.Y, b.Z, b.W): pass
+    """,
+}
+
+
+def test_async_stack_shares_tables_with_sync_stack():
+    sync_stack = create_env_stack(code=dict(CODE))
+    *_, class_grandparents_env = sync_stack
+    *_, async_class_grandparents_env = create_async_env_stack(sync_stack)
+
+    async def session():
+        # Do a couple of `get`s so that dependencies are set.
+        assert await async_class_grandparents_env.aget("a.Y", "", use_saved_contents_of_dependents=True) == []
+        assert await async_class_grandparents_env.aget("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+        await async_class_grandparents_env.aupdate("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False)
+        assert await async_class_grandparents_env.aget("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+        assert await async_class_grandparents_env.aget("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+    asyncio.run(session())
+    # values computed by the async stack are visible to the sync one...
+    assert class_grandparents_env.writable_env.saved_contents_cache_table["b.W"] == ["a.X"]
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+
+    # ... and sync pushes are visible to the async one.
+    class_grandparents_env.update("a", code="""
+        class X(a.Y): pass
+        class Y: pass
+    """, is_saved_content=True)
+
+    async def after_save():
+        return await async_class_grandparents_env.aget("b.W", "", use_saved_contents_of_dependents=False)
+
+    assert asyncio.run(after_save()) == ["a.Y"]
+
+
+def test_upstream_fetches_run_concurrently():
+    running = 0
+    max_running = 0
+    fetched = []
+
+    async def fetch(module):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        fetched.append(module)
+        return CODE[module]
+
+    # Start with an empty code table so every module has to be fetched.
+    sync_stack = create_env_stack(code={})
+    *_, async_class_grandparents_env = create_async_env_stack(sync_stack, fetch=fetch)
+
+    async def session():
+        return await async_class_grandparents_env.aget("c.V", "", use_saved_contents_of_dependents=True)
+
+    assert asyncio.run(session()) == ["a.X", "a.X", "b.Z"]
+    # `a` and `b` were fetched at the same time, and `b` only once even
+    # though both `b.Z` and `b.W` needed it.
+    assert max_running == 2
+    assert sorted(fetched) == ["a", "b", "c"]
+
+
+def test_push_during_pending_fetch_is_not_overwritten():
+    fetch_started = asyncio.Event()
+    release_fetch = asyncio.Event()
+
+    async def fetch(module):
+        fetch_started.set()
+        await release_fetch.wait()
+        return "class K: pass"
+
+    sync_stack = create_env_stack(code={"a": "class X: pass"})
+    code_env, _, _, parents_env, _ = sync_stack
+    _, _, _, async_parents_env, _ = create_async_env_stack(sync_stack, fetch=fetch)
+
+    async def session():
+        pending_get = asyncio.create_task(
+            async_parents_env.aget("c.K", "", use_saved_contents_of_dependents=True)
+        )
+        await fetch_started.wait()
+        await async_parents_env.aupdate("c", "class K(a.X): pass", is_saved_content=True)
+        release_fetch.set()
+        return await pending_get
+
+    # The fetch started before the save, so its result is dropped.
+    assert asyncio.run(session()) == ["a.X"]
+    assert code_env.writable_env.saved_contents_cache_table["c"] == "class K(a.X): pass"
+    assert parents_env.get("c.K", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+
+def test_migrate_one_layer_at_a_time():
+    # Only the top layer is async, and its produce_value can stay synchronous
+    # because it sits on the sync `ClassParentsEnv`.
+    class HalfMigratedGrandparentsEnv(AsyncEnvTable):
+        produce_value = staticmethod(wrap_memory.ClassGrandparentsEnv.produce_value)
+
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code=dict(CODE))
+    grandparents_env = HalfMigratedGrandparentsEnv(
+        writable_env=class_grandparents_env.writable_env,
+        upstream_env=class_parents_env,
+    )
+
+    async def session():
+        assert await grandparents_env.aget("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+        await grandparents_env.aupdate("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=True)
+        return await grandparents_env.aget("b.W", "", use_saved_contents_of_dependents=True)
+
+    assert asyncio.run(session()) == ["a.Y"]
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.Y"]
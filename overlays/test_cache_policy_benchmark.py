@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+import wrap_memory
+from cache_policy_benchmark import CONFIGURATIONS, _project
+
+
+def test_bounded_configuration_holds_at_most_max_entries():
+    # More modules than the 20 asts the configuration keeps.
+    code = _project(modules=30, classes=2)
+    *_, env = wrap_memory.create_env_stack(code=dict(code), cache_policies=CONFIGURATIONS["bounded"])
+    for _ in range(2):
+        for name in code:
+            for i in range(2):
+                env.get(f"{name}.C{i}", None, use_saved_contents_of_dependents=True)
+    asts = env.stats()["AstEnv"]["saved"]
+    assert (asts["size"], asts["evictions"]) == (20, 10)
+    # The class bodies above are all kept, so nothing is recomputed.
+    assert asts["produce_value_calls"] == 30
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+from cancellation_benchmark import STACKS, replay, report, traces
+from wrap_memory import create_env_stack
+
+
+def test_cancellation_matches_pushing_every_keystroke():
+    code, trace = traces()["steady"]
+    final_code = dict(code, b=trace[-1].code)
+    *_, class_grandparents_env = create_env_stack(code=final_code)
+    for stack in STACKS:
+        with_cancellation = replay(stack, code, trace, cancellation=True)
+        assert with_cancellation["cancellations"] > 0
+        # the overlay ends up where a from-scratch computation of the final
+        # text would be
+        for key, value in with_cancellation["final_values"].items():
+            assert value == class_grandparents_env.get(key, "", use_saved_contents_of_dependents=True)
+
+
+def test_report_shows_savings():
+    for by_stack in report().values():
+        for row in by_stack.values():
+            assert row["produce_value_with_cancellation"] < row["produce_value_without_cancellation"]
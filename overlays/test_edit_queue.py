@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import asyncio
+
+from edit_queue import EditQueue
+from wrap_memory import create_env_stack
+
+
+def set_up():
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    # Do a couple of `get`s so that dependencies are set.
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=True) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    assert class_grandparents_env.get("a.Y", "", use_saved_contents_of_dependents=True) == []
+    return class_grandparents_env
+
+
+def test_unsaved_edits_are_coalesced():
+    class_grandparents_env = set_up()
+
+    async def session():
+        queue = EditQueue(class_grandparents_env, window=0.01)
+        for base in ["a.X", "a.Y", "a.X", "a.Y"]:
+            queue.submit("b", code=f"""
+                class Z({base}): pass
+                class W(b.Z): pass
+            """, is_saved_content=False)
+        assert queue.metrics.queue_depth == 1
+        # nothing is pushed until the window elapses
+        assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.X"]
+        await queue.wait_idle()
+        return queue
+
+    queue = asyncio.run(session())
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    assert queue.metrics.unsaved_edits_received == 4
+    assert queue.metrics.unsaved_pushes == 1
+    assert queue.metrics.coalescing_ratio == 4.0
+    assert queue.metrics.queue_depth == 0
+
+
+def test_save_other_file_while_unsaved_edit_is_pending():
+    class_grandparents_env = set_up()
+
+    async def session():
+        queue = EditQueue(class_grandparents_env, window=0.01)
+        queue.submit("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False)
+        # Saves are pushed immediately, even though `b` is still pending.
+        queue.submit("a", code="""
+            class X(a.Y): pass
+            class Y: pass
+        """, is_saved_content=True)
+        assert queue.metrics.saved_pushes == 1
+        assert queue.metrics.queue_depth == 1
+        assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=True) == ["a.Y"]
+        await queue.wait_idle()
+
+    asyncio.run(session())
+    # The unsaved `b` sees the newly-saved `a`...
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=False) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+    # ... and the saved `b` is unaffected by the unsaved edit.
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+
+def test_save_supersedes_pending_unsaved_edit():
+    class_grandparents_env = set_up()
+
+    async def session():
+        queue = EditQueue(class_grandparents_env, window=0.01)
+        queue.submit("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False)
+        queue.submit("b", code="""
+            class Z: pass
+            class W(b.Z): pass
+        """, is_saved_content=True)
+        assert queue.metrics.queue_depth == 0
+        # an edit after the save is queued behind it
+        queue.submit("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False)
+        queue.drain()
+        return queue
+
+    queue = asyncio.run(session())
+    assert queue.metrics.unsaved_edits_superseded_by_save == 1
+    assert queue.metrics.unsaved_pushes == 1
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+
+
+def test_failed_push_leaves_the_queue_idle():
+    class_grandparents_env = set_up()
+
+    async def session():
+        queue = EditQueue(class_grandparents_env, window=0.01)
+        queue.submit("b", code="class Z(a.Y", is_saved_content=False)
+        await asyncio.wait_for(queue.wait_idle(), timeout=1)
+        return queue
+
+    queue = asyncio.run(session())
+    assert queue.metrics.failed_pushes == 1
+    assert queue.metrics.unsaved_pushes == 0
+    assert queue.metrics.queue_depth == 0
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import pytest
+
+from get_overhead_benchmark import PROTOTYPES, _getter, _layer, check, stubbed_produce_value, without_outliers
+
+
+def test_misses_only_measure_the_framework():
+    for module in PROTOTYPES.values():
+        env = _layer(module)
+        get = _getter(module, env)
+        with stubbed_produce_value(module, reads_upstream=True):
+            # The real `produce_value` would fail on a class that does not
+            # exist.
+            assert get("n0.C0") == []
+        with pytest.raises((KeyError, TypeError)):
+            get("n0.C1")
+
+
+def test_outliers_are_dropped():
+    assert without_outliers([10, 11, 10, 12, 11, 50]) == [10, 11, 10, 12, 11]
+    assert without_outliers([10, 10, 10]) == [10, 10, 10]
+
+
+def test_check_reports_regressions_beyond_the_threshold():
+    baseline = {"basic": {"hit": {"median_ns": 100.0}, "miss": {"median_ns": 100.0}}}
+    results = {
+        "basic": {"hit": {"median_ns": 119.0}, "miss": {"median_ns": 150.0}},
+        "wrap_memory": {"hit": {"median_ns": 1000.0}},
+    }
+    assert check(results, baseline, threshold=0.2) == ["basic miss: 100ns -> 150ns"]
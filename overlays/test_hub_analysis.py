@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import io
+
+from hub_analysis import analyze, compare, dependency_graph, history
+from scaling_benchmark import PROTOTYPES
+from session_trace import record_typing_session
+from synthetic_codebase import ProjectShape, generate
+
+
+CODE = {
+    "a": "class X: pass\nclass Y(a.X): pass\n",
+    "b": "class Z(a.Y): pass\nclass W(a.Y): pass\n",
+}
+
+
+def test_fan_out_of_a_base_class():
+    for name, session_class in PROTOTYPES.items():
+        session = session_class(CODE)
+        for key in ["a.X", "a.Y", "b.Z", "b.W"]:
+            session.query(key)
+        analysis = analyze(session.env)
+        hubs = {(row["layer"], row["key"]): row for row in analysis["hubs"]}
+        # The grandparents of b.Z and b.W read the parents of a.Y.
+        assert hubs[("ClassParentsEnv", "a.Y")]["direct"] == 3, name
+        assert hubs[("ClassBodyEnv", "a.Y")]["transitive"] == 4, name
+        edits = {row["module"]: row for row in analysis["edits"]}
+        assert edits["a"]["recomputed"] == {
+            "AstEnv": 1, "ClassBodyEnv": 2, "ClassParentsEnv": 2, "ClassGrandparentsEnv": 4,
+        }, name
+        assert (edits["a"]["expected_ms"] is None) == (name != "wrap_memory"), name
+
+
+def test_unsaved_edges_are_opt_in():
+    session = PROTOTYPES["wrap_memory"](CODE)
+    session.edit("b", "class Z(a.X): pass\nclass W(a.Y): pass\n")
+    session.query("b.Z")
+    _, saved = dependency_graph(session.env)
+    _, both = dependency_graph(session.env, unsaved=True)
+    assert (3, "b.Z") not in saved.get((2, "b.Z"), set())
+    assert (3, "b.Z") in both[(2, "b.Z")]
+
+
+def test_history_follows_a_session():
+    log = io.StringIO()
+    record_typing_session(log, ProjectShape(modules=6, classes_per_module=4))
+    snapshots = history(log.getvalue().splitlines(), every=20, top=3)
+    assert [snapshot["operation"] for snapshot in snapshots][:2] == [20, 40]
+    assert snapshots[-1]["keys"] >= snapshots[0]["keys"]
+    changes = compare(snapshots[0], snapshots[-1])
+    assert {(change["layer"], change["key"]) for change in changes} >= {
+        (row["layer"], row["key"]) for row in snapshots[-1]["hubs"]
+    }
+    project = generate(ProjectShape(modules=6, classes_per_module=4))
+    assert snapshots[-1]["edits"][0]["module"] in project.classes
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+from invalidation_oracle import LAYERS, changed_keys, corpus, measure
+from scaling_benchmark import PROTOTYPES
+from synthetic_codebase import ProjectShape, generate
+
+
+SHAPE = ProjectShape(modules=6, classes_per_module=4)
+
+
+def test_changed_keys():
+    project = generate(SHAPE)
+    comment = changed_keys(project.code, "m3", project.code["m3"] + "# a comment\n", saved=True)
+    assert all(not comment[layer] for layer in LAYERS)
+
+    text = project.edit_class("m3.C1", 0)
+    saved = changed_keys(project.code, "m3", text, saved=True)
+    assert saved["ast"] == {"m3"}
+    assert saved["parents"] == {"m3.C1"}
+    # Only the grandparents of the classes that inherit from m3.C1 change,
+    # and those are in other modules, which only see the edit once saved.
+    assert saved["grandparents"] == {"m5.C2"}
+    unsaved = changed_keys(project.code, "m3", text, saved=False)
+    assert unsaved["parents"] == {"m3.C1"}
+    assert unsaved["grandparents"] == set()
+
+
+def test_rebase_recomputes_every_class_of_the_module():
+    project = generate(SHAPE)
+    module, text, saved, open_buffers = corpus(project)["rebase (saved)"]
+    layers = measure(PROTOTYPES["wrap_memory"], project.code, module, text, saved, open_buffers)
+    # Pushes do not stop at values that came out the same, so one changed
+    # class body costs the 4 of its module, and so on up.
+    assert layers["class_body"] == dict(layers["class_body"], changed=1, recomputed=4, wasted=3)
+    assert all(row["missed"] == 0 for row in layers.values())
+
+
+def test_comment_edits_are_all_waste():
+    project = generate(SHAPE)
+    module, text, saved, open_buffers = corpus(project)["comment (saved)"]
+    for session_class in PROTOTYPES.values():
+        layers = measure(session_class, project.code, module, text, saved, open_buffers)
+        assert layers["ast"] == dict(layers["ast"], changed=0, recomputed=1, wasted=1, over_invalidation=1.0)
+        assert all(row["wasted"] == row["recomputed"] for row in layers.values())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import tracemalloc
+
+import wrap_memory
+from memory_report import allocations, diff, report
+from scaling_benchmark import PROTOTYPES
+
+
+CODE = {
+    "a": "class X: pass\nclass Y(a.X): pass\n",
+    "b": "class Z(a.Y): pass\n",
+}
+
+
+def test_report_covers_every_layer_and_table():
+    for name, session_class in PROTOTYPES.items():
+        session = session_class(CODE)
+        session.query("b.Z")
+        layers = report(session.env)
+        assert list(layers) == ["CodeEnv", "AstEnv", "ClassBodyEnv", "ClassParentsEnv", "ClassGrandparentsEnv"], name
+        for tables in layers.values():
+            assert "dependencies" in tables, name
+        ast_tables = layers["AstEnv"]
+        table = ast_tables.get("saved", ast_tables.get("cached"))
+        assert table["entries"] == 2 and table["bytes"] > 0, name
+
+
+def test_class_bodies_are_shared_with_the_trees():
+    session = PROTOTYPES["wrap_memory"](CODE)
+    session.query("b.Z")
+    layers = report(session.env)
+    class_bodies = layers["ClassBodyEnv"]["saved"]
+    # The class bodies are part of the trees, which are counted first.
+    assert class_bodies["shared_bytes"] > class_bodies["bytes"]
+
+
+def test_diff_shows_what_an_overlay_adds():
+    for name in ["wrap_memory", "overlay_keys", "wrap_env"]:
+        session = PROTOTYPES[name](CODE)
+        session.query("b.Z")
+        before = report(session.env)
+        session.edit("b", "class Z(a.X): pass\n")
+        session.query("b.Z")
+        added = diff(before, report(session.env))
+        table = "unsaved" if name == "wrap_memory" else "overlay b"
+        assert added["AstEnv"][table]["bytes"] > 0, name
+        assert "CodeEnv" in added, name
+    assert diff({"a": {"x": 1, "y": 2}}, {"a": {"x": 1, "y": 3}, "b": {"x": 4}}) == {"a": {"y": 1}, "b": {"x": 4}}
+
+
+def test_allocations():
+    tracemalloc.start(32)
+    try:
+        *_, env = wrap_memory.create_env_stack(code=dict(CODE))
+        env.get("b.Z", None, use_saved_contents_of_dependents=True)
+        allocated = allocations(wrap_memory)
+    finally:
+        tracemalloc.stop()
+    assert allocated["AstEnv"]["bytes"] > 0
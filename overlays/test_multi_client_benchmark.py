@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import wrap_memory
+from multi_client_benchmark import _project, _warm
+from multi_client_memory import SharedEnvStack
+
+
+def saved_produce_value_calls(client):
+    return sum(tables["saved"]["produce_value_calls"] for tables in client[-1].stats().values())
+
+
+def test_an_extra_shared_client_computes_no_saved_values():
+    code = _project(modules=6, classes=2)
+    stack = SharedEnvStack(dict(code))
+    _warm(stack.attach()[-1], code, 2, "m2")
+    shared = stack.attach()
+    _warm(shared[-1], code, 2, "m3")
+    separate = wrap_memory.create_env_stack(code=dict(code))
+    _warm(separate[-1], code, 2, "m3")
+
+    assert saved_produce_value_calls(shared) == 0
+    assert saved_produce_value_calls(separate) > 0
+    # Either way the buffer's own unsaved values are computed.
+    assert shared[-1].stats()["ClassGrandparentsEnv"]["unsaved"]["produce_value_calls"] == 2
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+from multi_client_memory import SharedEnvStack
+from wrap_memory import CachePolicy, ClassParentsEnv, LayerCachePolicy, RequestScope
+
+
+CODE = {
+    "a": """
+        class X: pass
+        class Y(a.X): pass
+    """,
+    "b": """
+        class Z(a.X): pass
+        class W(b.Z): pass
+    """,
+    "c": """
+        class V(b.W): pass
+    """,
+}
+
+
+def unsaved(client, key):
+    return client[-1].get(key, None, use_saved_contents_of_dependents=False)
+
+
+def test_clients_share_saved_tables_but_not_unsaved_ones():
+    stack = SharedEnvStack(dict(CODE))
+    ide = stack.attach()
+    review = stack.attach()
+    for key in ["a.Y", "b.W", "c.V"]:
+        assert ide[-1].get(key, None, use_saved_contents_of_dependents=True) is not None
+    for ide_env, review_env in zip(ide, review):
+        assert ide_env.writable_env.saved_contents_cache_table is review_env.writable_env.saved_contents_cache_table
+        assert ide_env.writable_env.unsaved_contents_cache_table is not review_env.writable_env.unsaved_contents_cache_table
+    # ... so the review tool finds the saved values the IDE computed.
+    saved_v = ide[-1].writable_env.saved_contents_cache_table["c.V"]
+    assert review[-1].get("c.V", None, use_saved_contents_of_dependents=True) is saved_v
+
+    stack.update(ide, "b", """
+        class Z(a.X): pass
+        class W(a.Y): pass
+    """, is_saved_content=False)
+    stack.update(review, "c", """
+        class V(b.Z): pass
+    """, is_saved_content=False)
+    assert unsaved(ide, "c.V") == ["b.Z"]
+    assert unsaved(review, "c.V") == ["a.X"]
+    assert unsaved(ide, "b.W") == ["a.X"]
+    assert unsaved(review, "b.W") == ["a.X"]
+    assert ide[0].writable_env.unsaved_modules == {"b"}
+    assert review[0].writable_env.unsaved_modules == {"c"}
+
+
+def test_saved_edits_fan_out_to_every_client():
+    stack = SharedEnvStack(dict(CODE))
+    ide = stack.attach()
+    review = stack.attach()
+    for key in ["a.Y", "b.W", "c.V"]:
+        ide[-1].get(key, None, use_saved_contents_of_dependents=True)
+    stack.update(ide, "b", """
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, is_saved_content=False)
+    stack.update(review, "c", """
+        class V(b.W): pass
+        class U: pass
+    """, is_saved_content=False)
+    assert unsaved(ide, "b.Z") == ["a.X"]
+    assert unsaved(review, "c.V") == ["b.Z"]
+
+    # The review tool saves `a`: both clients see it.
+    stack.update(review, "a", """
+        class X(a.Y): pass
+        class Y: pass
+    """, is_saved_content=True)
+    assert ide[-1].writable_env.unsaved_contents_cache_table["b.Z"] == []
+    assert unsaved(ide, "b.W") == ["a.Y"]
+
+    # The IDE saves `b` while the review tool has its own `c` open: the
+    # review tool's unsaved `c.V` reads the new saved `b`.
+    stack.update(ide, "b", """
+        class Z(a.X): pass
+        class W(a.X): pass
+    """, is_saved_content=True)
+    assert review[-1].writable_env.unsaved_contents_cache_table["c.V"] == ["a.X"]
+    assert ide[0].writable_env.unsaved_modules == set()
+    assert review[0].writable_env.unsaved_modules == {"c"}
+
+
+def test_saving_a_module_another_client_has_unsaved():
+    stack = SharedEnvStack(dict(CODE))
+    ide = stack.attach()
+    review = stack.attach()
+    for key in ["a.Y", "b.W", "c.V"]:
+        ide[-1].get(key, None, use_saved_contents_of_dependents=True)
+    stack.update(review, "b", """
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, is_saved_content=False)
+    assert unsaved(review, "b.W") == ["a.Y"]
+
+    stack.update(ide, "b", """
+        class Z: pass
+        class W(b.Z): pass
+    """, is_saved_content=True)
+    assert ide[-1].get("b.W", None, use_saved_contents_of_dependents=True) == []
+    # The review tool still sees its own buffer.
+    assert review[0].writable_env.unsaved_modules == {"b"}
+    assert unsaved(review, "b.W") == ["a.Y"]
+
+    stack.detach(review)
+    assert stack.clients == [ide]
+
+
+def test_detach_drops_transient_tables():
+    stack = SharedEnvStack(dict(CODE), cache_policies={
+        ClassParentsEnv: LayerCachePolicy(unsaved=CachePolicy("transient")),
+    })
+    before = len(RequestScope.transient_tables)
+    ide = stack.attach()
+    review = stack.attach()
+    assert len(RequestScope.transient_tables) == before + 2
+    stack.detach(review)
+    assert len(RequestScope.transient_tables) == before + 1
+    assert RequestScope.transient_tables[-1] is ide[3].writable_env.unsaved_contents_cache_table
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
-from overlay_keys import create_env_stack
+from overlay_keys import (
+    AstCache, ClassBodyCache, ClassGrandparentsCache, ClassParentsCache, CodeCache,
+    OverlayLifecycle, OverlayPartitionedTable, UpdateCancelled, create_env_stack,
+)
 import pytest
 
 
@@ -360,3 +363,424 @@ def test_edge_case__now_fixed() -> None:
     assert class_grandparents_env.get("b.B1", "") == ["a.X"]
     with pytest.raises(KeyError):
         class_grandparents_env.children["b"]
+
+
+def test_cancelled_overlay_push_marks_keys_dirty() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.Z", "") == []
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    # Open `b` and look at it, so that there is something to push.
+    class_grandparents_env.update("b", code="""
+        class Z(a.X): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    assert class_grandparents_env.children["b"].get("b.W", "") == ["a.X"]
+
+    # Edit 1 is superseded before the overlay push gets anywhere.
+    with pytest.raises(UpdateCancelled):
+        class_grandparents_env.update("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, in_overlay=True, is_cancelled=lambda: True)
+    assert (("b",), "b.W") in ClassGrandparentsCache.dirty
+
+    # The restarted push with the newest text picks up the dirty keys.
+    class_grandparents_env.update("b", code="""
+        class Z: pass
+        class W(b.Z): pass
+    """, in_overlay=True, is_cancelled=lambda: False)
+    assert ClassGrandparentsCache.dirty == set()
+    assert class_grandparents_env.children["b"].get("b.Z", "") == []
+    assert class_grandparents_env.children["b"].get("b.W", "") == []
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+
+def test_nested_overlay_for_speculative_edit() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+        "c": """
+            class V(b.W): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+    assert class_grandparents_env.get("c.V", "") == ["b.Z"]
+    assert class_grandparents_env.get("a.Y", "") == []
+
+    # An unsaved edit to `b`...
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    unsaved_b = class_grandparents_env.children["b"]
+    assert unsaved_b.get("b.W", "") == ["a.Y"]
+
+    # ... and a code action previewing a further change to `b` on top of it.
+    unsaved_b.update("b", code="""
+        class Z(a.Y): pass
+        class W(a.Y): pass
+    """, in_overlay=True)
+    preview = unsaved_b.children["b"]
+    assert preview.overlay_key == ("b", "b")
+    assert preview.get("b.W", "") == ["a.X"]
+    assert preview.get("b.Z", "") == ["a.X"]
+    # keys of other modules fall through to the parent overlay (and from
+    # there to the saved stack)
+    assert preview.get("a.Y", "") == []
+    assert ((("b", "b"), "a.Y")) not in ClassGrandparentsCache.cached
+
+    # a preview of an edit to another module, stacked on the unsaved `b`
+    unsaved_b.update("a", code="""
+        class X: pass
+        class Y: pass
+    """, in_overlay=True)
+    assert unsaved_b.children["a"].get("a.Y", "") == []
+    assert unsaved_b.children["a"].get("b.W", "") == ["a.Y"]
+
+    # neither the unsaved overlay nor the saved stack see the previews
+    assert unsaved_b.get("b.W", "") == ["a.Y"]
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    # saved changes propagate all the way into the previews
+    class_grandparents_env.update("a", code="""
+        class X(a.Y): pass
+        class Y: pass
+    """, in_overlay=False)
+    assert preview.get("b.W", "") == []
+    assert unsaved_b.get("b.W", "") == ["a.Y"]
+
+    # discarding the preview drops all of its entries in every layer
+    unsaved_b.discard_overlay("b")
+    assert "b" not in unsaved_b.children
+    assert "b" in class_grandparents_env.children
+    for cache in (CodeCache, AstCache, ClassBodyCache, ClassParentsCache, ClassGrandparentsCache):
+        assert not any(overlay_key == ("b", "b") for overlay_key, _ in cache.cached)
+        assert any(overlay_key == ("b",) for overlay_key, _ in cache.cached)
+
+    class_grandparents_env.discard_overlay("b")
+    for cache in (CodeCache, AstCache, ClassBodyCache, ClassParentsCache, ClassGrandparentsCache):
+        assert not any(
+            overlay_key is not None and overlay_key[0] == "b"
+            for overlay_key, _ in cache.cached
+        )
+
+
+def test_close_overlay_drops_entries_and_dependency_edges() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+        "c": """
+            class V: pass
+        """,
+    })
+    assert class_grandparents_env.get("b.Z", "") == []
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    class_grandparents_env.update("b", code="""
+        class Z(c.V): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    assert class_grandparents_env.children["b"].get("b.W", "") == ["c.V"]
+    assert class_grandparents_env.children["b"].get("b.Z", "") == []
+    # only the overlay depends on `c.V`
+    assert "b.Z" in ClassParentsCache.dependencies["c.V"]
+    assert OverlayLifecycle.entries[("b",)] > 0
+
+    class_grandparents_env.close_overlay("b")
+    assert "b" not in class_grandparents_env.children
+    assert "b" not in ast_env.children
+    assert ("b",) not in OverlayLifecycle.entries
+    assert ("b",) not in OverlayLifecycle.recently_used
+    for cache in (CodeCache, AstCache, ClassBodyCache, ClassParentsCache, ClassGrandparentsCache):
+        assert all(overlay_key is None for overlay_key, _ in cache.cached)
+        assert all(overlay_key is None for overlay_key in cache.overlay_edges)
+    # edges registered by the overlay are gone; edges that the saved stack
+    # registered too are kept
+    assert "b.Z" not in ClassParentsCache.dependencies["c.V"]
+    assert "b.W" in ClassParentsCache.dependencies["b.Z"]
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+
+def test_close_overlay_from_lower_layer_drops_every_layer() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+        """,
+        "b": """
+            class Z: pass
+        """,
+    })
+    edited = """
+        class Z(a.X): pass
+    """
+    ast_env.update("b", code=edited, in_overlay=True)
+    class_grandparents_env.update("b", code=edited, in_overlay=True)
+    assert class_grandparents_env.children["b"].get("b.Z", "") == []
+    assert OverlayLifecycle.entries[("b",)] > 0
+
+    ast_env.close_overlay("b")
+    for env in (ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        assert "b" not in env.children
+    for cache in (CodeCache, AstCache, ClassBodyCache, ClassParentsCache, ClassGrandparentsCache):
+        assert list(cache.cached.partitions) in ([], [None])
+    assert ("b",) not in OverlayLifecycle.entries
+    assert ("b",) not in OverlayLifecycle.recently_used
+
+
+def test_idle_overlays_are_evicted_under_quota() -> None:
+    modules = [f"m{index}" for index in range(20)]
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(
+        code={module: f"class A: pass\nclass B({module}.A): pass\n" for module in modules},
+        max_overlay_entries=40,
+    )
+    for module in modules:
+        assert class_grandparents_env.get(f"{module}.B", "") == []
+
+    # Open and look at a buffer per module, as over a long editing session;
+    # each overlay holds 8 entries (code, ast, and two classes in three layers).
+    for module in modules:
+        class_grandparents_env.update(
+            module,
+            code=f"class A: pass\nclass B({module}.A): pass\nclass C({module}.B): pass\n",
+            in_overlay=True,
+        )
+        class_grandparents_env.children[module].get(f"{module}.A", "")
+        class_grandparents_env.children[module].get(f"{module}.B", "")
+        # keep going back to the first buffer, so it is never idle for long
+        class_grandparents_env.get_overlay(modules[0], code="")
+        assert OverlayLifecycle.total_entries() <= 40
+        assert module in class_grandparents_env.children
+
+    assert modules[0] in class_grandparents_env.children
+    assert modules[1] not in class_grandparents_env.children
+    assert OverlayLifecycle.evictions == len(modules) - len(class_grandparents_env.children)
+    overlay_entries = sum(
+        overlay_key is not None
+        for cache in (CodeCache, AstCache, ClassBodyCache, ClassParentsCache, ClassGrandparentsCache)
+        for overlay_key, _ in cache.cached
+    )
+    assert overlay_entries == OverlayLifecycle.total_entries()
+
+
+def test_overlay_partitioned_table() -> None:
+    table = OverlayPartitionedTable()
+    table[(None, "a.X")] = 1
+    table[(("b",), "b.Z")] = 2
+    table[(("b",), "b.W")] = 3
+    table[(("b", "b"), "b.W")] = 4
+    assert (("b",), "b.Z") in table
+    assert (("b",), "a.X") not in table
+    assert (("c",), "c.V") not in table
+    assert len(table) == 4
+    assert table.partition_size(("b",)) == 2
+    assert table.snapshot(("b",)) == {"b.Z": 2, "b.W": 3}
+
+    del table[(("b", "b"), "b.W")]
+    assert ("b", "b") not in table.partitions
+    assert table.drop_partition(("b",)) == 2
+    assert list(table) == [(None, "a.X")]
+    assert table.drop_partition(("b",)) == 0
+
+
+def test_overlay_layers_are_materialized_on_first_use() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    # opening a buffer at the top only creates the top overlay, and edits
+    # before it is read are just remembered
+    for code in ["class Z(a.Y): pass", "class Z(a.Y): pass\nclass W(b.Z): pass"]:
+        class_grandparents_env.update("b", code=code, in_overlay=True)
+        assert "b" not in code_env.children and "b" not in class_parents_env.children
+        assert OverlayLifecycle.total_entries() == 0
+    assert class_grandparents_env.children["b"].get("b.W", "") == ["a.Y"]
+    assert "b" in code_env.children
+
+    # a buffer that is only looked at in the `AstEnv` never reaches past it
+    ast_env.update("a", code="class X: pass", in_overlay=True)
+    assert [class_def.name for class_def in ast_env.children["a"].get("a", "").body] == ["X"]
+    assert "a" in code_env.children
+    assert "a" not in class_body_env.children
+    assert not any(overlay_key == ("a",) for overlay_key, _ in ClassBodyCache.cached)
+
+
+def test_overlay_edited_after_a_lower_layer_read_it() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    # the `AstEnv` overlay of `b` is read with the first text...
+    ast_env.update("b", code="""
+        class Z(a.X): pass
+        class W(b.Z): pass
+        # opened
+    """, in_overlay=True)
+    assert len(ast_env.children["b"].get("b", "b.Z").body) == 2
+    # ... and reused, with the second, by the overlay at the top
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    assert class_grandparents_env.children["b"].get("b.W", "") == ["a.Y"]
+
+
+def test_save_while_an_unread_overlay_is_open() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(b.Z): pass
+        """,
+        "b": """
+            class Z: pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == []
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y(b.Z): pass
+        # opened
+    """, in_overlay=True)
+    class_grandparents_env.update("b", code="""
+        class Q: pass
+        class Z(b.Q): pass
+        class W(b.Z): pass
+    """, in_overlay=False)
+    assert class_grandparents_env.children["a"].get("b.W", "") == ["b.Q"]
+    assert class_grandparents_env.children["a"].get("a.Y", "") == ["b.Q"]
+
+
+def test_stats_by_overlay_key() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+        """,
+        "b": """
+            class Z: pass
+        """,
+    })
+    assert class_grandparents_env.get("b.Z", "") == []
+    class_grandparents_env.update("b", code="""
+        class Z(a.X): pass
+    """, in_overlay=True)
+    overlay = class_grandparents_env.children["b"]
+    assert overlay.get("b.Z", "") == []
+    assert overlay.get("a.X", "") == []
+
+    stats = overlay.stats()
+    assert list(stats) == ["CodeEnv", "AstEnv", "ClassBodyEnv", "ClassParentsEnv", "ClassGrandparentsEnv"]
+    grandparents = stats["ClassGrandparentsEnv"]
+    assert list(grandparents) == [None, ("b",)]
+    # `a.X` is not the overlay's, so its get counts against the saved stack
+    assert (grandparents[None]["gets"], grandparents[None]["misses"]) == (2, 2)
+    assert (grandparents[("b",)]["gets"], grandparents[("b",)]["hits"]) == (1, 0)
+    assert stats["ClassParentsEnv"][("b",)]["produce_value_calls"] == 1
+    assert stats["CodeEnv"][("b",)]["size"] == 1
+
+    class_grandparents_env.update("b", code="""
+        class Z: pass
+    """, in_overlay=True)
+    stats = class_grandparents_env.stats()
+    assert stats["ClassParentsEnv"][("b",)]["push_waves"] == 1
+    assert stats["ClassParentsEnv"][("b",)]["keys_pushed"] == 1
+    assert stats["ClassGrandparentsEnv"][("b",)]["keys_pushed"] == 1
+    assert stats["ClassParentsEnv"][None]["push_waves"] == 0
+
+    class_grandparents_env.reset_stats()
+    stats = class_grandparents_env.stats()
+    assert stats["ClassGrandparentsEnv"][("b",)]["gets"] == 0
+    assert stats["ClassGrandparentsEnv"][("b",)]["size"] == 1
+    class_grandparents_env.close_overlay("b")
+    assert list(class_grandparents_env.stats()["ClassGrandparentsEnv"]) == [None]
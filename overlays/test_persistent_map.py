@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+from persistent_map import PersistentMap
+
+
+class CollidingKey:
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    def __hash__(self) -> int:
+        return self.value % 3
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CollidingKey) and other.value == self.value
+
+
+def test_versions_are_independent():
+    empty = PersistentMap()
+    one = empty.set("a", 1)
+    two = one.set("b", 2)
+    replaced = two.set("a", 3)
+    assert len(empty) == 0 and "a" not in empty
+    assert dict(one.items()) == {"a": 1}
+    assert dict(two.items()) == {"a": 1, "b": 2}
+    assert dict(replaced.items()) == {"a": 3, "b": 2}
+    assert dict(replaced.delete("a").items()) == {"b": 2}
+    assert two.delete("missing") is two
+    assert two.set("b", two["b"]) is two
+
+
+def test_many_keys_and_collisions():
+    keys = [CollidingKey(value) for value in range(30)] + list(range(2000))
+    table = PersistentMap.from_dict({key: index for index, key in enumerate(keys)})
+    assert len(table) == len(keys)
+    for index, key in enumerate(keys):
+        assert table[key] == index
+    for key in keys[::2]:
+        table = table.delete(key)
+    assert len(table) == len(keys) // 2
+    assert set(table) == set(keys[1::2])
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import io
+import json
+
+import overlay_keys
+import wrap_memory
+from propagation_trace import Tracer, trace_hub_save, tracing
+from scaling_benchmark import PROTOTYPES
+from synthetic_codebase import ProjectShape, generate
+
+
+CODE = {
+    "a": "class X: pass\nclass Y(a.X): pass\n",
+    "b": "class Z(a.Y): pass\n",
+}
+
+
+def test_get_spans_nest_and_tell_hits_from_misses():
+    for name, session_class in PROTOTYPES.items():
+        originals = {cls: dict(cls.__dict__) for cls in [session_class.module.EnvTable, session_class.module.AstEnv]}
+        session = session_class(CODE)
+        tracer = Tracer()
+        with tracing(session_class.module, tracer):
+            session.query("b.Z")
+            session.query("b.Z")
+        gets = [event for event in tracer.export()["traceEvents"] if event["name"] == "ClassGrandparentsEnv.get b.Z"]
+        assert [get["args"]["cache"] for get in gets] == ["miss", "hit"], name
+        first, second = gets
+        # The parents of b.Z and of a.Y were looked at within the first get.
+        within = [
+            event for event in tracer.events
+            if first["ts"] <= event["ts"] and event["ts"] + event["dur"] <= first["ts"] + first["dur"]
+        ]
+        assert {"ClassParentsEnv.get b.Z", "ClassParentsEnv.get a.Y"} <= {event["name"] for event in within}, name
+        assert any(event["args"].get("dependency") == "b.Z" for event in within if event["cat"] == "get"), name
+        for cls, attributes in originals.items():
+            assert dict(cls.__dict__) == attributes, name
+
+
+def test_overlays_and_tables():
+    session = PROTOTYPES["wrap_memory"](CODE)
+    tracer = Tracer()
+    with tracing(wrap_memory, tracer):
+        session.edit("a", "class X: pass\nclass Y: pass\n")
+        session.query("a.Y")
+        session.query_saved("a.Y")
+    overlays = {event["args"]["overlay"] for event in tracer.events if event["cat"] == "get"}
+    assert overlays == {"saved", "unsaved"}
+    update = next(event for event in tracer.events if event["name"] == "ClassGrandparentsEnv.update a")
+    assert update["args"] == {"module": "a", "is_saved_content": False}
+
+    session = PROTOTYPES["overlay_keys"](CODE)
+    session.query("b.Z")
+    tracer = Tracer()
+    with tracing(overlay_keys, tracer):
+        session.edit("a", "class X: pass\nclass Y: pass\n")
+        session.query("a.Y")
+    assert "a" in {event["args"]["overlay"] for event in tracer.events if event["cat"] == "get"}
+
+
+def test_push_spans_show_the_fan_out():
+    tracer = trace_hub_save("basic", ProjectShape(modules=4, classes_per_module=3))
+    pushes = {event["name"]: event["args"] for event in tracer.events if event["cat"] == "update_for_push"}
+    project = generate(ProjectShape(modules=4, classes_per_module=3))
+    assert pushes["AstEnv.update_for_push"]["fan_out"] == {"m0": sorted(project.classes["m0"])}
+    assert any(event["args"].get("by") == "push" for event in tracer.events if event["cat"] == "produce_value")
+    f = io.StringIO()
+    tracer.write(f)
+    assert len(json.loads(f.getvalue())["traceEvents"]) == len(tracer.events)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import functools
-from read_only_overlay import create_env_stack
+import pytest
+
+from read_only_overlay import OverlayMemo, create_env_stack
 
 
 def debug(f):
@@ -99,3 +101,146 @@ def test_overlay():
 
     assert class_grandparents_overlay_get("b.Z", "") == []
     assert class_grandparents_overlay_get("b.W", "") == ["a.Y"]
+
+
+@debug
+def test_evaluate_candidates():
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    codes = [
+        """
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """,
+        """
+            class Z(a.X): pass
+            class W(a.Y): pass
+        """,
+        """
+            class Z(: pass
+        """,
+        """
+            class Z: pass
+            class W(b.Z): pass
+        """,
+    ]
+    expected = [
+        {"b.Z": ["a.X"], "b.W": ["a.Y"]},
+        {"b.Z": [], "b.W": ["a.X"]},
+        None,
+        {"b.Z": [], "b.W": []},
+    ]
+    for processes in [1, 2]:
+        results = class_grandparents_env.evaluate_candidates(
+            "b", codes, ["b.Z", "b.W"], processes=processes,
+        )
+        assert len(results) == len(codes)
+        for result, expected_result in zip(results, expected):
+            if expected_result is None:
+                assert isinstance(result["b.Z"], SyntaxError)
+            else:
+                assert result == expected_result
+
+    # the saved stack is untouched
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+    assert code_env.cached["b"].strip().startswith("class Z(a.X)")
+
+
+@debug
+def test_overlay_memo_is_shared_across_layers():
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    memo = OverlayMemo()
+    get = class_grandparents_env.overlay("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, memo=memo)
+    assert memo.query(get, "b.W") == ["a.Y"]
+    assert (ast_env, "b") in memo.values
+    assert (class_parents_env, "b.Z") in memo.values
+    assert memo.values[(class_grandparents_env, "b.W")] == ["a.Y"]
+    # `b` is parsed once for `b.W`, and the lookup of `b.Z` reuses the parse
+    assert memo.queries[-1].parses == 1
+    assert memo.queries[-1].reparses_avoided == 1
+
+
+@debug
+def test_overlay_memo_is_bounded_and_invalidated():
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    # Do a couple of `get`s so that dependencies are set.
+    assert class_grandparents_env.get("a.Y", "") == []
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    overlaid_code = """
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """
+    memo = OverlayMemo(max_entries=3)
+    get = class_grandparents_env.overlay("b", code=overlaid_code, memo=memo)
+    assert get("b.W", "") == ["a.Y"]
+    assert len(memo.values) == 3
+    assert memo.evictions > 0
+
+    # the memo cannot be reused for another text without being invalidated
+    with pytest.raises(RuntimeError):
+        class_grandparents_env.overlay("b", code="class Z: pass", memo=memo)
+    memo.invalidate()
+    get = class_grandparents_env.overlay("b", code="class Z: pass", memo=memo)
+    assert get("b.Z", "") == []
+
+    # saved updates clear the memo
+    memo = OverlayMemo()
+    get = class_grandparents_env.overlay("b", code=overlaid_code, memo=memo)
+    assert get("b.W", "") == ["a.Y"]
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y: pass
+    """)
+    assert get("b.W", "") == ["a.Y"]
+    assert len([key for key in memo.values if key[0] is ast_env]) == 1
+    assert memo.parses == 2
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+from scaling_benchmark import PROTOTYPES, measure
+from synthetic_codebase import ProjectShape, generate
+
+
+def test_an_edit_costs_the_same_in_a_bigger_project():
+    small, big = (generate(ProjectShape(modules=modules, classes_per_module=3)) for modules in (6, 24))
+    session_class = PROTOTYPES["wrap_memory"]
+    assert (
+        measure(session_class, small, "single_edit")["produce_value_calls"]
+        == measure(session_class, big, "single_edit")["produce_value_calls"]
+    )
+    # ... while a cold start scales with the project.
+    assert measure(session_class, big, "cold")["produce_value_calls"] > 3 * measure(session_class, small, "cold")["produce_value_calls"]
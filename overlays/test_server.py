@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import asyncio
+import io
+
+from load_generator import run
+from server import FOCUSED_PRIORITY, Connection, Server, encode_message, read_message
+from session_trace import read_trace
+from wrap_memory import SlowOperationLog
+
+
+CODE = {
+    "a": """
+        class X: pass
+        class Y(a.X): pass
+    """,
+    "b": """
+        class Z(a.X): pass
+        class W(b.Z): pass
+    """,
+}
+
+
+def responses(buffer: io.BytesIO):
+    async def decode():
+        reader = asyncio.StreamReader()
+        reader.feed_data(buffer.getvalue())
+        reader.feed_eof()
+        messages = []
+        while (message := await read_message(reader)) is not None:
+            messages.append(message)
+        return messages
+
+    return asyncio.run(decode())
+
+
+def request(id, method, key):
+    return {"jsonrpc": "2.0", "id": id, "method": method, "params": {"key": key}}
+
+
+def notification(method, **params):
+    return {"jsonrpc": "2.0", "method": method, "params": params}
+
+
+def test_framing_round_trip():
+    buffer = io.BytesIO(encode_message(request(1, "parents", "b.W")) + encode_message(request(2, "parents", "b.Z")))
+    assert [message["id"] for message in responses(buffer)] == [1, 2]
+
+
+def test_unsaved_and_saved_edits():
+    buffer = io.BytesIO()
+    connection = Connection(write=buffer.write)
+
+    async def session():
+        server = Server(dict(CODE), window=10)
+        for message in [
+            request(1, "grandparents", "b.W"),
+            notification("textDocument/didOpen", module="b", text=CODE["b"]),
+            notification("textDocument/didChange", module="b", text="""
+                class Z(a.Y): pass
+                class W(b.Z): pass
+            """),
+            request(2, "grandparents", "b.W"),
+            request(3, "class_body", "b.Z"),
+            # save a.py while b.py is unsaved
+            notification("textDocument/didSave", module="a", text="""
+                class X(a.Y): pass
+                class Y: pass
+            """),
+            request(4, "grandparents", "b.W"),
+            # closing b.py drops its unsaved contents
+            notification("textDocument/didClose", module="b"),
+            request(5, "grandparents", "b.W"),
+            request(6, "nonsense", "b.W"),
+        ]:
+            server.handle_message(connection, message)
+            # answer everything in between so that the order is deterministic
+            while server.requests:
+                server.answer(server.requests.pop(0))
+
+    asyncio.run(session())
+    results = {message["id"]: message.get("result", message.get("error")) for message in responses(buffer)}
+    assert results[1] == ["a.X"]
+    assert results[2] == ["a.Y"]
+    assert results[3] == "class Z(a.Y):\n    pass"
+    assert results[4] == ["a.Y"]
+    assert results[5] == ["a.X"]
+    assert results[6]["code"] == -32601
+
+
+def test_open_with_unsaved_text():
+    buffer = io.BytesIO()
+    connection = Connection(write=buffer.write)
+
+    async def session():
+        server = Server(dict(CODE), window=10)
+        server.handle_message(connection, notification("textDocument/didOpen", module="a", text=CODE["a"]))
+        assert server.edit_queue.pending == {}
+        # reopening a buffer that still has edits from an earlier session
+        server.handle_message(connection, notification("textDocument/didOpen", module="b", text="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """))
+        assert list(server.edit_queue.pending) == ["b"]
+        server.handle_message(connection, request(1, "grandparents", "b.W"))
+        server.answer(server.requests.pop(0))
+
+    asyncio.run(session())
+    assert [message["result"] for message in responses(buffer)] == [["a.Y"]]
+
+
+def test_record_session():
+    buffer = io.BytesIO()
+    connection = Connection(write=buffer.write)
+    log = io.StringIO()
+    edited = CODE["b"].replace("class Z(a.X)", "class Z(a.Y)")
+
+    async def session():
+        server = Server(dict(CODE), window=10, record=log)
+        for message in [
+            request(1, "grandparents", "b.W"),
+            notification("textDocument/didChange", module="b", text=edited),
+            request(2, "grandparents", "b.W"),
+            notification("textDocument/didSave", module="b", text=edited),
+        ]:
+            server.handle_message(connection, message)
+            while server.requests:
+                server.answer(server.requests.pop(0))
+
+    asyncio.run(session())
+    code, operations = read_trace(io.StringIO(log.getvalue()))
+    assert code == CODE
+    assert [(operation.kind, operation.name, operation.saved) for operation in operations] == [
+        ("get", "b.W", False),
+        ("update", "b", False),
+        ("get", "b.W", False),
+        ("update", "b", True),
+    ]
+
+
+def test_slow_operations():
+    buffer = io.BytesIO()
+    connection = Connection(write=buffer.write)
+    edited = CODE["b"].replace("class Z(a.X)", "class Z(a.Y)")
+
+    async def session():
+        server = Server(dict(CODE), window=10, slow_operation_ms=0)
+        for message in [
+            request(1, "grandparents", "a.Y"),
+            notification("textDocument/didSave", module="b", text=edited),
+            request(2, "slow_operations", "b.W"),
+            request(3, "slow_operations", ""),
+        ]:
+            server.handle_message(connection, message)
+            while server.requests:
+                server.answer(server.requests.pop(0))
+
+    try:
+        asyncio.run(session())
+    finally:
+        SlowOperationLog.configure(None)
+    results = {message["id"]: message["result"] for message in responses(buffer)}
+    [update] = results[2]
+    assert (update["kind"], update["key"], update["path"]) == ("update", "b", "saved")
+    assert [(entry["kind"], entry["key"]) for entry in results[3]] == [("get", "a.Y"), ("update", "b")]
+
+
+def test_focused_module_is_answered_first():
+    buffer = io.BytesIO()
+    connection = Connection(write=buffer.write)
+    server = Server(dict(CODE))
+    server.handle_message(connection, notification("textDocument/didOpen", module="b", text=CODE["b"]))
+
+    async def session():
+        for id, key in enumerate(["a.X", "a.Y", "b.W", "a.X", "b.Z"]):
+            server.handle_message(connection, request(id, "parents", key))
+        assert server.requests[0].priority == FOCUSED_PRIORITY
+        worker = asyncio.ensure_future(server.worker())
+        while server.requests:
+            await asyncio.sleep(0)
+        worker.cancel()
+
+    asyncio.run(session())
+    assert [message["id"] for message in responses(buffer)] == [2, 4, 0, 1, 3]
+
+
+def test_load_generator():
+    report = asyncio.run(run(
+        editors=2,
+        edits=3,
+        queries_per_edit=2,
+        think_time=0,
+        window=0.001,
+        classes_per_module=4,
+    ))
+    assert sum(
+        row["count"]
+        for kind, row in report.items()
+        if kind != "edit_queue"
+    ) == 2 * 3 * 2
+    for kind, row in report.items():
+        if kind != "edit_queue":
+            assert row["p50_ms"] <= row["p99_ms"]
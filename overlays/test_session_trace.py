@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import io
+
+import wrap_env
+import wrap_memory
+from scaling_benchmark import PROTOTYPES
+from session_trace import Operation, Recorder, read_trace, record_typing_session, report, splice
+from synthetic_codebase import ProjectShape
+
+
+CODE = {
+    "a": """
+        class X: pass
+        class Y(a.X): pass
+    """,
+    "b": """
+        class Z(a.X): pass
+        class W(b.Z): pass
+    """,
+}
+
+
+def test_splice():
+    for old, new in [("abc", "abxc"), ("abc", "ac"), ("", "abc"), ("abc", "abc"), ("aaa", "aaaa"), ("abc", "xyz")]:
+        start, end, inserted = splice(old, new)
+        assert old[:start] + inserted + old[end:] == new
+
+
+def test_recorded_operations_round_trip():
+    log = io.StringIO()
+    *_, env = wrap_memory.create_env_stack(code=dict(CODE))
+    recorder = Recorder(env, CODE, log)
+    assert recorder.get("b.W", None, use_saved_contents_of_dependents=True) == ["a.X"]
+    edited = CODE["b"].replace("class Z(a.X)", "class Z(a.Y)")
+    recorder.update("b", edited, is_saved_content=False)
+    assert recorder.get("b.W", None, False) == ["a.Y"]
+    recorder.update("b", edited, True)
+    # everything else is passed through
+    assert recorder.upstream_env is env.upstream_env
+
+    code, operations = read_trace(io.StringIO(log.getvalue()))
+    assert code == CODE
+    assert operations == [
+        Operation("get", "b.W", True),
+        Operation("update", "b", False, edited),
+        Operation("get", "b.W", False),
+        Operation("update", "b", True, edited),
+    ]
+
+
+def test_overlay_updates_are_recorded_as_unsaved():
+    log = io.StringIO()
+    *_, env = wrap_env.create_env_stack(code=dict(CODE))
+    recorder = Recorder(env, CODE, log)
+    recorder.get("b.W", "")
+    recorder.update("b", CODE["b"] + "# typed\n", in_overlay=True)
+    recorder.update("a", CODE["a"] + "# saved\n")
+    _, operations = read_trace(io.StringIO(log.getvalue()))
+    assert [(operation.kind, operation.saved) for operation in operations] == [
+        ("get", True), ("update", False), ("update", True),
+    ]
+
+
+def test_replay_every_prototype():
+    log = io.StringIO()
+    record_typing_session(log, ProjectShape(modules=4, classes_per_module=2))
+    results = report(io.StringIO(log.getvalue()))
+    assert set(results) == set(PROTOTYPES)
+    for kinds in results.values():
+        assert kinds["unsaved_update"]["count"] == len("# try another base") + 1
+        assert kinds["saved_update"]["count"] == 1
+        assert all(row["errors"] == 0 for row in kinds.values())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import ast
+
+from synthetic_codebase import ProjectShape, generate
+
+
+def test_projects_are_deterministic_and_well_formed():
+    shape = ProjectShape(modules=6, classes_per_module=4, hubs=2, hub_ratio=0.5)
+    project = generate(shape)
+    assert project.code == generate(shape).code
+    assert project.code != generate(ProjectShape(modules=6, classes_per_module=4, seed=1)).code
+    assert project.hub_keys == ["m0.Hub0", "m0.Hub1"]
+
+    defined = set()
+    for module, keys in project.classes.items():
+        tree = ast.parse(project.code[module])
+        assert [f"{module}.{class_def.name}" for class_def in tree.body] == keys
+        for key in keys:
+            # Every base is defined before the class that uses it.
+            assert set(project.bases[key]) <= defined
+            defined.add(key)
+    assert all(project.bases[key] for key in project.classes["m3"])
+
+
+def test_edits_change_one_class_at_a_time():
+    project = generate(ProjectShape(modules=4, classes_per_module=3))
+    texts = [project.edit("m2", step) for step in range(6)]
+    assert all(text != project.code["m2"] for text in texts)
+    assert all(before != after for before, after in zip(texts, texts[1:]))
+    for text in texts:
+        changed = [
+            line for line, original in zip(text.splitlines(), project.code["m2"].splitlines())
+            if line != original
+        ]
+        assert len(changed) == 1
+    # Editing the hub module gives a hub another base.
+    assert project.edit("m0", 0).splitlines()[1] == "class Hub1(m0.Hub0): pass"
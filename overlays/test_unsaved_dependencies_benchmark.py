@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import contextlib
+
+import wrap_memory
+from unsaved_dependencies_benchmark import Counter, counting_produce_value, single_dag
+
+
+def save_under_unsaved_buffer(single: bool):
+    """Save `a` while `b` has an unsaved buffer that no longer reads it."""
+    with single_dag() if single else contextlib.nullcontext():
+        *_, env = wrap_memory.create_env_stack(code={
+            "a": "class X: pass\n",
+            "b": "class Z(a.X): pass\n",
+            "c": "class X: pass\n",
+        })
+        env.get("b.Z", None, use_saved_contents_of_dependents=True)
+        env.update("b", "class Z(c.X): pass\n", is_saved_content=False)
+        env.get("b.Z", None, use_saved_contents_of_dependents=False)
+        counter = Counter()
+        with counting_produce_value(counter):
+            env.update("a", "class Y: pass\nclass X(a.Y): pass\n", is_saved_content=True)
+        return counter.calls, env.get("b.Z", None, use_saved_contents_of_dependents=False)
+
+
+def test_saves_skip_unsaved_values_that_do_not_read_them():
+    single_calls, single_value = save_under_unsaved_buffer(single=True)
+    split_calls, split_value = save_under_unsaved_buffer(single=False)
+    assert split_value == single_value == []
+    # With one DAG the save also recomputes the unsaved grandparents of b.Z.
+    assert split_calls == single_calls - 1
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+from cancellation_benchmark import traces
+from version_ring_benchmark import replay, toggle_trace
+
+
+def test_toggling_back_is_served_from_the_ring():
+    code, _ = traces()["steady"]
+    trace = toggle_trace(code, toggles=4)
+    with_ring = replay(code, trace, max_unsaved_versions=8)
+    without_ring = replay(code, trace, max_unsaved_versions=0)
+    assert with_ring["final_values"] == without_ring["final_values"]
+    # The last two flips go back to texts the ring kept.
+    assert with_ring["edits"]["restore"] == 2
+    assert with_ring["produce_value_calls"] < without_ring["produce_value_calls"]
@@ -360,3 +360,192 @@ def test_edge_case__now_fixed() -> None:
     assert class_grandparents_env.get("b.B1", "") == ["a.X"]
     with pytest.raises(KeyError):
         class_grandparents_env.children["b"]
+
+
+def test_overlay_shares_parent_cache() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("a.Y", "") == []
+    assert class_grandparents_env.get("b.Z", "") == []
+    saved = class_grandparents_env.snapshot()
+
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    overlay = class_grandparents_env.children["b"]
+    # the overlay shares everything but the saved values of `b`...
+    assert overlay.cache.cached.get("a.Y") is saved.get("a.Y")
+    assert "b.Z" not in overlay.cache.cached
+    # ... and only stores what it overrides, once it is read
+    assert overlay.overridden == set()
+    assert overlay.get("b.Z", "") == ["a.X"]
+    assert overlay.overridden == {"b.Z"}
+
+    # ... and the parent computing a key of `b` later does not leak into the
+    # overlay when it rebases on the next push
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y(a.X): pass
+    """, in_overlay=False)
+    assert overlay.get("b.W", "") == ["a.Y"]
+
+    # snapshots are unaffected by later updates
+    assert "b.W" not in saved
+    assert saved["b.Z"] == []
+
+
+def test_overlay_layers_are_materialized_on_first_use() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    # opening a buffer at the top only creates the top overlay...
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+    """, in_overlay=True)
+    assert "b" not in code_env.children and "b" not in class_parents_env.children
+    # ... and edits before it is read are just remembered
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    assert class_grandparents_env.children["b"].get("b.W", "") == ["a.Y"]
+    assert "b" in code_env.children
+
+    # a buffer that is only looked at in the `AstEnv` never reaches past it
+    ast_env.update("a", code="class X: pass", in_overlay=True)
+    assert [class_def.name for class_def in ast_env.children["a"].get("a", "").body] == ["X"]
+    assert "a" in code_env.children
+    assert "a" not in class_body_env.children
+
+
+def test_overlay_edited_after_a_lower_layer_read_it() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == ["a.X"]
+
+    # the `AstEnv` overlay of `b` is read with the first text...
+    ast_env.update("b", code="""
+        class Z(a.X): pass
+        class W(b.Z): pass
+        # opened
+    """, in_overlay=True)
+    assert len(ast_env.children["b"].get("b", "b.Z").body) == 2
+    # ... and reused, with the second, by the overlay at the top
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, in_overlay=True)
+    assert class_grandparents_env.children["b"].get("b.W", "") == ["a.Y"]
+
+
+def test_save_while_an_unread_overlay_is_open() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(b.Z): pass
+        """,
+        "b": """
+            class Z: pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "") == []
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y(b.Z): pass
+        # opened
+    """, in_overlay=True)
+    class_grandparents_env.update("b", code="""
+        class Q: pass
+        class Z(b.Q): pass
+        class W(b.Z): pass
+    """, in_overlay=False)
+    assert class_grandparents_env.children["a"].get("b.W", "") == ["b.Q"]
+    assert class_grandparents_env.children["a"].get("a.Y", "") == ["b.Q"]
+
+
+def test_rebase_keeps_saved_values_of_the_overlaid_module_out() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+            class V(a.Y): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.V", "") == ["a.X"]
+    class_grandparents_env.update("b", code="""
+        class Z(a.X): pass
+        class W(b.Z): pass
+        class V(a.X): pass
+    """, in_overlay=True)
+    overlay = class_grandparents_env.children["b"]
+    assert overlay.get("b.W", "") == ["a.X"]
+    # the push rebases the overlay on the parent's map, which still has the
+    # saved value of b.V
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y(a.X): pass
+        # a comment
+    """, in_overlay=False)
+    assert overlay.get("b.V", "") == []
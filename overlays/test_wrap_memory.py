@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
-from wrap_memory import create_env_stack
+import pytest
+
+from wrap_memory import (
+    AstEnv, CachePolicy, ClassBodyEnv, ClassGrandparentsEnv, ClassParentsEnv, CodeEnv, LayerCachePolicy,
+    LruCacheTable, SlowOperationLog, UpdateCancelled, create_env_stack,
+)
 
 
 def test_env_stack():
@@ -356,3 +361,560 @@ def test_edge_case__now_fixed() -> None:
     # ... regardless of the order in which we call `get`
     assert class_grandparents_env.get("b.B1", "", use_saved_contents_of_dependents=False) == ["a.X"]
     assert class_grandparents_env.get("b.B1", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+
+def test_cancelled_unsaved_push_marks_keys_dirty() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=True) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+    # Edit 1 is superseded as soon as the ast of `b` has been recomputed.
+    with pytest.raises(UpdateCancelled):
+        class_grandparents_env.update("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False, is_cancelled=lambda: True)
+
+    assert "b" in ast_env.writable_env.dirty_unsaved_keys
+    assert {"b.Z", "b.W"} <= class_parents_env.writable_env.dirty_unsaved_keys
+    assert {"b.Z", "b.W"} <= class_grandparents_env.writable_env.dirty_unsaved_keys
+    # The saved contents are untouched by the unsaved edit.
+    assert code_env.writable_env.saved_contents_cache_table["b"].strip().startswith("class Z(a.X)")
+
+    # Dirty values are recomputed on demand...
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+    assert "b.W" not in class_grandparents_env.writable_env.dirty_unsaved_keys
+
+    # ... and the restarted push with the newest text cleans up everything else.
+    class_grandparents_env.update("b", code="""
+        class Z: pass
+        class W(b.Z): pass
+    """, is_saved_content=False, is_cancelled=lambda: False)
+    for env in (ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        assert env.writable_env.dirty_unsaved_keys == set()
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=False) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+
+def test_saved_miss_leaves_dirty_unsaved_value_dirty() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    class_grandparents_env.update("b", code="""
+        class Z(a.X): pass
+        class W(b.Z): pass
+        # opened
+    """, is_saved_content=False)
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.X"]
+    with pytest.raises(UpdateCancelled):
+        class_grandparents_env.update("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False, is_cancelled=lambda: True)
+    assert "b.W" in class_grandparents_env.writable_env.dirty_unsaved_keys
+
+    # b.W was never computed in the saved view, so this misses...
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    # ... but the unsaved value is still stale, and gets recomputed.
+    assert "b.W" in class_grandparents_env.writable_env.dirty_unsaved_keys
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+
+
+def test_saved_push_is_never_cancelled() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, is_saved_content=True, is_cancelled=lambda: True)
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.Y"]
+
+
+def test_save_promotes_unsaved_values() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+        "c": """
+            class V(b.W): pass
+        """,
+    })
+    assert class_grandparents_env.get("a.Y", "", use_saved_contents_of_dependents=True) == []
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=True) == ["b.Z"]
+
+    edited = """
+        class Z(a.Y): pass
+        class W(a.Y): pass
+    """
+    class_grandparents_env.update("b", code=edited, is_saved_content=False)
+    unsaved_ast = ast_env.get("b", None, use_saved_contents_of_dependents=False)
+    unsaved_w = class_grandparents_env.get("b.W", None, use_saved_contents_of_dependents=False)
+    assert unsaved_w == ["a.X"]
+
+    # Saving the unsaved text moves the unsaved values over as they are...
+    class_grandparents_env.update("b", code=edited, is_saved_content=True)
+    assert ast_env.writable_env.saved_contents_cache_table["b"] is unsaved_ast
+    assert class_grandparents_env.writable_env.saved_contents_cache_table["b.W"] is unsaved_w
+    for env in (code_env, ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        assert env.writable_env.unsaved_modules == set()
+        assert env.writable_env.unsaved_contents_cache_table == {}
+    # ... and still recomputes the saved values of other modules.
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=True) == ["a.Y"]
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    # The unsaved values read `a.Y` through unsaved-DAG edges, which are now
+    # saved-DAG edges.
+    assert "b.W" in class_parents_env.writable_env.dependencies["a.Y"]
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y: pass
+    """, is_saved_content=True)
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == []
+
+
+def test_revert_to_saved_and_unchanged_edits() -> None:
+    saved_b = """
+        class Z(a.X): pass
+        class W(b.Z): pass
+    """
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": saved_b,
+    })
+    assert class_grandparents_env.get("a.Y", "", use_saved_contents_of_dependents=True) == []
+    saved_w = class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True)
+
+    # Saving the text that is already saved does nothing at all.
+    assert not class_grandparents_env.update("b", code=saved_b, is_saved_content=True)
+    assert class_grandparents_env.writable_env.saved_contents_cache_table["b.W"] is saved_w
+
+    edited = """
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """
+    class_grandparents_env.update("b", code=edited, is_saved_content=False)
+    unsaved_w = class_grandparents_env.get("b.W", None, use_saved_contents_of_dependents=False)
+    assert unsaved_w == ["a.Y"]
+    # Re-sending the same unsaved text does not push again.
+    assert not class_grandparents_env.update("b", code=edited, is_saved_content=False)
+    assert class_grandparents_env.writable_env.unsaved_contents_cache_table["b.W"] is unsaved_w
+
+    # Undoing back to the saved text makes `b` a saved module again.
+    assert not class_grandparents_env.update("b", code=saved_b, is_saved_content=False)
+    for env in (code_env, ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        assert env.writable_env.unsaved_modules == set()
+        assert env.writable_env.unsaved_contents_cache_table == {}
+    assert class_grandparents_env.get("b.W", None, use_saved_contents_of_dependents=False) is saved_w
+
+
+def test_saved_and_unsaved_pushes_follow_their_own_edges() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+        """,
+        "b": """
+            class Z(a.X): pass
+        """,
+        "d": """
+            class Q: pass
+            class R(d.Q): pass
+        """,
+    })
+    assert class_grandparents_env.get("d.R", "", use_saved_contents_of_dependents=True) == []
+    saved_z = class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=True)
+    assert saved_z == []
+
+    class_grandparents_env.update("b", code="""
+        class Z(d.R): pass
+    """, is_saved_content=False)
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=False) == ["d.Q"]
+    # Only the unsaved value of `b.Z` read `d.R`.
+    assert "b.Z" in class_parents_env.writable_env.unsaved_dependencies["d.R"]
+    assert "b.Z" not in class_parents_env.writable_env.dependencies["d.R"]
+
+    # So saving `d` recomputes the unsaved value but not the saved one.
+    class_grandparents_env.update("d", code="""
+        class Q: pass
+        class P: pass
+        class R(d.P): pass
+    """, is_saved_content=True)
+    assert class_grandparents_env.writable_env.saved_contents_cache_table["b.Z"] is saved_z
+    assert class_grandparents_env.writable_env.unsaved_contents_cache_table["b.Z"] == ["d.P"]
+
+
+def test_unsaved_dependents_see_module_become_unsaved() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+        "c": """
+            class V(b.W): pass
+        """,
+    })
+    assert class_grandparents_env.get("a.Y", "", use_saved_contents_of_dependents=True) == []
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=True) == ["b.Z"]
+
+    class_grandparents_env.update("c", code="""
+        class V(b.W): pass
+        class U: pass
+    """, is_saved_content=False)
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=False) == ["b.Z"]
+
+    # `c.V` read the saved view of `b.W`, so the push has to get from the
+    # saved-DAG edges within `b` to the unsaved-DAG edge out of `b.W`.
+    class_grandparents_env.update("b", code="""
+        class Z(a.X): pass
+        class W(a.Y): pass
+    """, is_saved_content=False)
+    assert class_grandparents_env.writable_env.unsaved_contents_cache_table["c.V"] == ["a.Y"]
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=True) == ["b.Z"]
+
+    # Once `b` is saved, no unsaved-DAG edge is left for its values.
+    class_grandparents_env.update("b", code="""
+        class Z(a.X): pass
+        class W(a.X): pass
+    """, is_saved_content=True)
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    assert class_grandparents_env.writable_env.unsaved_contents_cache_table["c.V"] == ["a.X"]
+    for env in (code_env, ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        assert not any(
+            dependent.startswith("b.") or dependent == "b"
+            for dependents in env.writable_env.unsaved_dependencies.values()
+            for dependent in dependents
+        )
+
+
+def test_cache_policies(monkeypatch) -> None:
+    code = {
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    }
+    parses = []
+    produce_ast = AstEnv.produce_value
+    monkeypatch.setattr(AstEnv, "produce_value", staticmethod(
+        lambda key, upstream_get, current_env_getter: parses.append(key) or produce_ast(key, upstream_get, current_env_getter)
+    ))
+
+    def parses_of_b_for_unsaved_w(ast_policy: CachePolicy) -> int:
+        (
+            code_env,
+            ast_env,
+            class_body_env,
+            class_parents_env,
+            class_grandparents_env
+        ) = create_env_stack(code=dict(code), cache_policies={
+            AstEnv: LayerCachePolicy(unsaved=ast_policy),
+            ClassBodyEnv: LayerCachePolicy(unsaved=CachePolicy("none")),
+            ClassParentsEnv: LayerCachePolicy(unsaved=CachePolicy("none")),
+            ClassGrandparentsEnv: LayerCachePolicy(unsaved=CachePolicy("none")),
+        })
+        assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+        class_grandparents_env.update("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False)
+        parses.clear()
+        assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+        assert ast_env.writable_env.unsaved_contents_cache_table == {}
+        assert class_body_env.writable_env.unsaved_contents_cache_table == {}
+        # The saved tables are still persistent.
+        assert "b" in ast_env.writable_env.saved_contents_cache_table
+        return parses.count("b")
+
+    # The class bodies of `b.W` and `b.Z` both need the ast of `b`.
+    assert parses_of_b_for_unsaved_w(CachePolicy("none")) == 2
+    assert parses_of_b_for_unsaved_w(CachePolicy("transient")) == 1
+
+
+def test_bounded_cache_table() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    }, cache_policies={ClassParentsEnv: LayerCachePolicy(saved=CachePolicy(max_entries=2))})
+    for key in ["a.X", "a.Y", "b.Z", "b.W"]:
+        class_grandparents_env.get(key, "", use_saved_contents_of_dependents=True)
+    saved_parents = class_parents_env.writable_env.saved_contents_cache_table
+    assert len(saved_parents) == 2
+    assert isinstance(saved_parents, LruCacheTable) and saved_parents.evictions > 0
+
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, is_saved_content=True)
+    assert len(saved_parents) <= 2
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.Y"]
+    assert class_grandparents_env.get("b.Z", "", use_saved_contents_of_dependents=True) == ["a.X"]
+
+    with pytest.raises(ValueError):
+        create_env_stack(code={}, cache_policies={CodeEnv: LayerCachePolicy(saved=CachePolicy("none"))})
+    with pytest.raises(ValueError):
+        CachePolicy("transient", max_entries=10)
+
+
+def test_undo_restores_recent_unsaved_versions() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+        "c": """
+            class V(b.W): pass
+        """,
+    })
+    assert class_grandparents_env.get("a.Y", "", use_saved_contents_of_dependents=True) == []
+    assert class_grandparents_env.get("c.V", "", use_saved_contents_of_dependents=True) == ["b.Z"]
+    class_grandparents_env.update("c", code="""
+        class V(b.W): pass
+        class U: pass
+    """, is_saved_content=False)
+
+    first = """
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """
+    second = """
+        class Z(a.Y): pass
+        class W(a.Y): pass
+    """
+    class_grandparents_env.update("b", code=first, is_saved_content=False)
+    first_ast = ast_env.get("b", None, use_saved_contents_of_dependents=False)
+    first_w = class_grandparents_env.get("b.W", None, use_saved_contents_of_dependents=False)
+    assert first_w == ["a.Y"]
+    assert class_grandparents_env.get("c.V", None, use_saved_contents_of_dependents=False) == ["b.Z"]
+    class_grandparents_env.update("b", code=second, is_saved_content=False)
+    assert class_grandparents_env.get("b.W", None, use_saved_contents_of_dependents=False) == ["a.X"]
+    assert class_grandparents_env.get("c.V", None, use_saved_contents_of_dependents=False) == ["a.Y"]
+
+    # Undo brings back the values we had for `first`...
+    assert code_env.classify_edit("b", first, is_saved_content=False) == "restore"
+    class_grandparents_env.update("b", code=first, is_saved_content=False)
+    assert ast_env.writable_env.unsaved_contents_cache_table["b"] is first_ast
+    assert class_grandparents_env.writable_env.unsaved_contents_cache_table["b.W"] is first_w
+    # ... and still pushes to the other unsaved modules.
+    assert class_grandparents_env.writable_env.unsaved_contents_cache_table["c.V"] == ["b.Z"]
+    # Redo works the same way.
+    assert code_env.classify_edit("b", second, is_saved_content=False) == "restore"
+
+    # Editing anything else invalidates the versions.
+    class_grandparents_env.update("a", code="""
+        class X: pass
+        class Y: pass
+    """, is_saved_content=True)
+    for env in (code_env, ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        assert env.writable_env.unsaved_versions == {}
+    assert code_env.classify_edit("b", second, is_saved_content=False) == "change"
+    class_grandparents_env.update("b", code=second, is_saved_content=False)
+    assert class_grandparents_env.get("b.W", None, use_saved_contents_of_dependents=False) == []
+
+
+def test_stats() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    for _ in range(2):
+        assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+    stats = class_grandparents_env.stats()
+    assert list(stats) == ["CodeEnv", "AstEnv", "ClassBodyEnv", "ClassParentsEnv", "ClassGrandparentsEnv"]
+    grandparents = stats["ClassGrandparentsEnv"]["saved"]
+    assert (grandparents["gets"], grandparents["hits"], grandparents["misses"]) == (2, 1, 1)
+    assert grandparents["produce_value_calls"] == 1 and grandparents["produce_value_ns"] > 0
+    assert grandparents["size"] == 1
+    # b.W, then b.Z from b.W's produce_value
+    assert stats["ClassParentsEnv"]["saved"]["misses"] == 2
+    assert stats["AstEnv"]["saved"]["size"] == 1
+    assert stats["ClassGrandparentsEnv"]["unsaved"]["gets"] == 0
+
+    class_grandparents_env.update("b", code="""
+        class Z(a.Y): pass
+        class W(b.Z): pass
+    """, is_saved_content=False)
+    assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+    stats = class_grandparents_env.stats()
+    assert stats["CodeEnv"]["unsaved"]["push_waves"] == 1
+    assert stats["CodeEnv"]["unsaved"]["dependents"] == 1
+    # The push recomputes the unsaved values of b that were looked at, so
+    # the `get` hits...
+    grandparents = stats["ClassGrandparentsEnv"]["unsaved"]
+    assert (grandparents["push_waves"], grandparents["keys_pushed"]) == (1, 1)
+    assert (grandparents["gets"], grandparents["hits"], grandparents["produce_value_calls"]) == (1, 1, 1)
+    assert stats["ClassParentsEnv"]["unsaved"]["keys_pushed"] == 2
+    # ... and the saved tables are left alone.
+    assert stats["AstEnv"]["saved"]["push_waves"] == 0
+    assert stats["ClassGrandparentsEnv"]["saved"]["gets"] == 2
+
+    class_grandparents_env.reset_stats()
+    stats = class_grandparents_env.stats()
+    for tables in stats.values():
+        for table in tables.values():
+            assert table["gets"] == table["produce_value_calls"] == table["push_waves"] == 0
+    assert stats["ClassGrandparentsEnv"]["unsaved"]["size"] == 1
+
+
+def test_slow_operation_log() -> None:
+    (
+        code_env,
+        ast_env,
+        class_body_env,
+        class_parents_env,
+        class_grandparents_env
+    ) = create_env_stack(code={
+        "a": """
+            class X: pass
+            class Y(a.X): pass
+        """,
+        "b": """
+            class Z(a.X): pass
+            class W(b.Z): pass
+        """,
+    })
+    SlowOperationLog.configure(threshold_ms=0, max_entries=2)
+    try:
+        assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=True) == ["a.X"]
+        # Only the outermost `get` is an operation.
+        [get] = SlowOperationLog.entries
+        assert (get.kind, get.key, get.path, get.error) == ("get", "b.W", "saved", None)
+        # The code is there from the start.
+        assert get.recomputed == {"AstEnv": 1, "ClassBodyEnv": 2, "ClassParentsEnv": 2, "ClassGrandparentsEnv": 1}
+        assert len(get.top_keys) == 5
+        assert sum(ms for _, _, ms in get.top_keys) <= get.duration_ms
+
+        class_grandparents_env.update("b", code="""
+            class Z(a.Y): pass
+            class W(b.Z): pass
+        """, is_saved_content=False)
+        update = SlowOperationLog.entries[-1]
+        assert (update.kind, update.key, update.path) == ("update", "b", "unsaved")
+        assert update.recomputed["ClassGrandparentsEnv"] == 1
+        assert class_grandparents_env.get("b.W", "", use_saved_contents_of_dependents=False) == ["a.Y"]
+        # A ring buffer of the last 2.
+        assert [(entry.kind, entry.path) for entry in SlowOperationLog.entries] == [("update", "unsaved"), ("get", "unsaved")]
+        assert SlowOperationLog.entries[-1].recomputed == {}
+
+        SlowOperationLog.configure(threshold_ms=1000)
+        class_grandparents_env.get("a.Y", "", use_saved_contents_of_dependents=True)
+        assert not SlowOperationLog.entries
+    finally:
+        SlowOperationLog.configure(threshold_ms=None)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Count the `produce_value` calls of a `wrap_memory.py` editing session with
+many unsaved buffers and frequent saves of other files, once with a single
+dependency DAG and once with separate saved and unsaved DAGs.
+
+- single: every edge is recorded in both DAGs, which is what sharing one
+  `dependencies` map between saved and unsaved values amounted to: a save
+  recomputes the saved values of keys that only their unsaved values depend
+  on, and the other way around.
+- split: an edge is only recorded in the DAG of the value that read it (what
+  `wrap_memory.py` does now).
+
+In the project, class `m{j}.C{i}` inherits from `m{j-1}.C{i}`. Each unsaved
+buffer points its classes at a module on the other side of the project, so
+the saved and unsaved DAGs of the buffers diverge. Each round saves one of
+the other modules (toggling where its classes inherit from), sometimes
+types into one of the buffers, and then looks at every buffer.
+
+Run it with `python unsaved_dependencies_benchmark.py [modules] [classes] [unsaved_buffers] [rounds]`.
+"""
+import contextlib
+import sys
+from typing import Any, Callable, Dict, Iterator, List
+
+import wrap_memory
+
+
+def _module_code(module_index: int, classes: int, base_module: int) -> str:
+    return "\n".join(
+        f"class C{i}: pass" if base_module < 0 else f"class C{i}(m{base_module}.C{i}): pass"
+        for i in range(classes)
+    ) + "\n"
+
+
+def _project(modules: int, classes: int) -> Dict[str, str]:
+    return {
+        f"m{j}": _module_code(j, classes, j - 1)
+        for j in range(modules)
+    }
+
+
+@contextlib.contextmanager
+def single_dag() -> Iterator[None]:
+    original = wrap_memory.record_dependency
+
+    def record_in_both(writable_env: Any, key: str, dependency: Any, use_saved_contents_of_dependents: bool) -> None:
+        original(writable_env, key, dependency, True)
+        original(writable_env, key, dependency, False)
+
+    wrap_memory.record_dependency = record_in_both
+    try:
+        yield
+    finally:
+        wrap_memory.record_dependency = original
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.calls = 0
+
+
+@contextlib.contextmanager
+def counting_produce_value(counter: Counter) -> Iterator[None]:
+    classes = [
+        wrap_memory.CodeEnv,
+        wrap_memory.AstEnv,
+        wrap_memory.ClassBodyEnv,
+        wrap_memory.ClassParentsEnv,
+        wrap_memory.ClassGrandparentsEnv,
+    ]
+    originals = {cls: cls.__dict__["produce_value"] for cls in classes}
+
+    def counted(produce_value: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            counter.calls += 1
+            return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", staticmethod(counted(original.__func__)))
+        yield
+    finally:
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", original)
+
+
+def session(modules: int, classes: int, unsaved_buffers: int, rounds: int) -> Dict[str, Any]:
+    code = _project(modules, classes)
+    *_, env = wrap_memory.create_env_stack(code=dict(code))
+    keys = {name: [f"{name}.C{i}" for i in range(classes)] for name in code}
+    buffers = [f"m{j}" for j in range(1, 1 + unsaved_buffers)]
+    saved_modules = [name for name in code if name not in buffers]
+
+    def unsaved_text(buffer: str, typed: int) -> str:
+        index = int(buffer[1:])
+        return _module_code(index, classes, (index + modules // 2) % modules) + f"# typed {typed}\n"
+
+    for module_keys in keys.values():
+        for key in module_keys:
+            env.get(key, None, use_saved_contents_of_dependents=True)
+    for buffer in buffers:
+        env.update(buffer, unsaved_text(buffer, 0), is_saved_content=False)
+        for key in keys[buffer]:
+            env.get(key, None, use_saved_contents_of_dependents=False)
+
+    counter = Counter()
+    push_calls = 0
+    query_calls = 0
+    with counting_produce_value(counter):
+        for round in range(rounds):
+            saved = saved_modules[round % len(saved_modules)]
+            index = int(saved[1:])
+            # toggle between inheriting from the previous module and from m0
+            base_module = 0 if (round // len(saved_modules)) % 2 == 0 and index > 1 else index - 1
+            env.update(saved, _module_code(index, classes, base_module), is_saved_content=True)
+            if round % 4 == 0:
+                buffer = buffers[round % len(buffers)]
+                env.update(buffer, unsaved_text(buffer, round), is_saved_content=False)
+            push_calls += counter.calls
+            counter.calls = 0
+
+            for buffer in buffers:
+                for key in keys[buffer]:
+                    env.get(key, None, use_saved_contents_of_dependents=False)
+            query_calls += counter.calls
+            counter.calls = 0
+
+    final_values = {
+        key: (
+            env.get(key, None, use_saved_contents_of_dependents=True),
+            env.get(key, None, use_saved_contents_of_dependents=False),
+        )
+        for module_keys in keys.values()
+        for key in module_keys
+    }
+    return {
+        "push_produce_value_calls": push_calls,
+        "query_produce_value_calls": query_calls,
+        "final_values": final_values,
+    }
+
+
+def report(
+    modules: int = 40,
+    classes: int = 10,
+    unsaved_buffers: int = 10,
+    rounds: int = 60,
+) -> Dict[str, Dict[str, int]]:
+    with single_dag():
+        single = session(modules, classes, unsaved_buffers, rounds)
+    split = session(modules, classes, unsaved_buffers, rounds)
+    if single["final_values"] != split["final_values"]:
+        raise RuntimeError("the split DAGs diverged from the single DAG")
+    return {
+        name: {
+            "push_produce_value_calls": result["push_produce_value_calls"],
+            "query_produce_value_calls": result["query_produce_value_calls"],
+        }
+        for name, result in [("single", single), ("split", split)]
+    }
+
+
+if __name__ == "__main__":
+    arguments: List[int] = [int(argument) for argument in sys.argv[1:]]
+    modules, classes, unsaved_buffers, rounds = arguments + [40, 10, 10, 60][len(arguments):]
+    print(f"{modules} modules of {classes} classes, {unsaved_buffers} unsaved buffers, {rounds} saves")
+    for name, row in report(modules, classes, unsaved_buffers, rounds).items():
+        print(
+            f"{name:>7}: {row['push_produce_value_calls']} produce_value calls in pushes, "
+            f"{row['query_produce_value_calls']} in queries"
+        )
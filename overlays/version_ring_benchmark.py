@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Replay editing traces that keep coming back to recent texts (undo/redo,
+toggling a line) against the `wrap_memory.py` stack, and report how often an
+edit is served from the ring of recent unsaved versions, and how many
+`produce_value` calls that saves compared to a stack without the ring.
+
+Every keystroke is pushed to completion, and after each one we look at the
+unsaved grandparents of every class of the edited module, like an editor
+refreshing its diagnostics would.
+
+Run it with `python version_ring_benchmark.py [max_unsaved_versions]`.
+"""
+import contextlib
+import sys
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import wrap_memory
+from cancellation_benchmark import traces as typing_traces
+
+
+Trace = List[str]  # successive texts of module `b`
+
+
+def undo_redo_trace(code: Dict[str, str], lines: int, comment: str, undo_depth: int) -> Trace:
+    """Like `cancellation_benchmark.typing_trace`, but after typing each
+    comment undo the last `undo_depth` keystrokes and redo them."""
+    texts = []
+    text = code["b"]
+    for line in range(lines):
+        typed = [text + "# " + comment[:length] + "\n" for length in range(1, len(comment) + 1)]
+        texts.extend(typed)
+        texts.extend(reversed(typed[-undo_depth - 1:-1]))
+        texts.extend(typed[-undo_depth:])
+        text += f"class New{line}(b.B{line}): pass\n"
+        texts.append(text)
+    return texts
+
+
+def toggle_trace(code: Dict[str, str], toggles: int) -> Trace:
+    """Flip the base of the first class back and forth, over and over."""
+    flipped = code["b"].replace("class B0(a.X)", "class B0(a.Y)", 1)
+    return [flipped if toggle % 2 == 0 else code["b"] + "# flipped back\n" for toggle in range(toggles)]
+
+
+def traces() -> Dict[str, Tuple[Dict[str, str], Trace]]:
+    code, steady = typing_traces()["steady"]
+    return {
+        "typing": (code, [keystroke.code for keystroke in steady]),
+        "undo_redo": (code, undo_redo_trace(code, lines=3, comment="fix parents", undo_depth=4)),
+        "toggle": (code, toggle_trace(code, toggles=20)),
+    }
+
+
+@contextlib.contextmanager
+def counting(edits: Dict[str, int], calls: List[int]) -> Iterator[None]:
+    classify_edit = wrap_memory.CodeEnv.classify_edit
+    env_classes = [
+        wrap_memory.AstEnv,
+        wrap_memory.ClassBodyEnv,
+        wrap_memory.ClassParentsEnv,
+        wrap_memory.ClassGrandparentsEnv,
+    ]
+    originals = {cls: cls.__dict__["produce_value"] for cls in env_classes}
+
+    def counted_classify_edit(self: Any, *args: Any, **kwargs: Any) -> Any:
+        edit = classify_edit(self, *args, **kwargs)
+        edits[edit] = edits.get(edit, 0) + 1
+        return edit
+
+    def counted(produce_value: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            calls[0] += 1
+            return produce_value(*args, **kwargs)
+        return wrapper
+
+    try:
+        wrap_memory.CodeEnv.classify_edit = counted_classify_edit  # type: ignore[method-assign]
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", staticmethod(counted(original.__func__)))
+        yield
+    finally:
+        wrap_memory.CodeEnv.classify_edit = classify_edit  # type: ignore[method-assign]
+        for cls, original in originals.items():
+            setattr(cls, "produce_value", original)
+
+
+def _class_keys(module: str, code: str) -> List[str]:
+    return [
+        f"{module}.{line.split()[1].split('(')[0].rstrip(':')}"
+        for line in code.splitlines()
+        if line.startswith("class ")
+    ]
+
+
+def replay(code: Dict[str, str], trace: Trace, max_unsaved_versions: int) -> Dict[str, Any]:
+    *_, env = wrap_memory.create_env_stack(code=dict(code), max_unsaved_versions=max_unsaved_versions)
+    for module, text in code.items():
+        for key in _class_keys(module, text):
+            env.get(key, None, use_saved_contents_of_dependents=True)
+    # `c` is open (and unsaved) too, so pushes reach other unsaved modules.
+    env.update("c", code["c"] + "# opened\n", is_saved_content=False)
+
+    edits: Dict[str, int] = {}
+    calls = [0]
+    with counting(edits, calls):
+        for text in trace:
+            env.update("b", text, is_saved_content=False)
+            for key in _class_keys("b", text):
+                env.get(key, None, use_saved_contents_of_dependents=False)
+    final_values = {
+        key: env.get(key, None, use_saved_contents_of_dependents=False)
+        for module in ("b", "c")
+        for key in _class_keys(module, trace[-1] if module == "b" else code[module])
+    }
+    return {"edits": edits, "produce_value_calls": calls[0], "final_values": final_values}
+
+
+def report(max_unsaved_versions: int = 8) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name, (code, trace) in traces().items():
+        with_ring = replay(code, trace, max_unsaved_versions)
+        without_ring = replay(code, trace, max_unsaved_versions=0)
+        if with_ring["final_values"] != without_ring["final_values"]:
+            raise RuntimeError(f"restoring versions diverged on {name}")
+        pushed = sum(count for edit, count in with_ring["edits"].items() if edit != "unchanged")
+        results[name] = {
+            "edits": len(trace),
+            "hit_rate": with_ring["edits"].get("restore", 0) / pushed if pushed else 0.0,
+            "produce_value_with_ring": with_ring["produce_value_calls"],
+            "produce_value_without_ring": without_ring["produce_value_calls"],
+        }
+    return results
+
+
+if __name__ == "__main__":
+    max_unsaved_versions = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    print(f"up to {max_unsaved_versions} versions per module")
+    for name, row in report(max_unsaved_versions).items():
+        print(
+            f"{name:>10}: {row['edits']} edits, {row['hit_rate']:.0%} restored, "
+            f"{row['produce_value_without_ring']} -> {row['produce_value_with_ring']} produce_value calls"
+        )
@@ -10,6 +10,8 @@ from typing_extensions import TypeAlias
 import textwrap
 from collections import defaultdict
 
+from persistent_map import PersistentMap
+
 
 T = TypeVar("T")
 
@@ -23,12 +25,23 @@ class ReadOnlyEnv(Generic[T], Protocol):
 class Cache(Generic[T]):
     # It's a pain to type this well so I'll place fast and loose
     # with the types here to avoid an explosion of generics
-    cached: Dict[str, T]  # object is the value type
+    #
+    # `cached` is persistent, so that an overlay can start out sharing its
+    # parent's map and only pay for the entries it overrides. Every write
+    # replaces `cached` with a new version.
+    cached: PersistentMap[str, T]  # object is the value type
     dependencies: Dict[str, Set[object]]  # object is the
+    # keys in the order they were first added, so that overlays built on an
+    # older version of `cached` can tell which keys are new
+    added_keys: List[str]
 
-    def __init__(self, cached: Optional[Dict[str, T]] = None) -> None:
-        self.cached = cached if cached is not None else {}
+    def __init__(self, cached: Optional[PersistentMap[str, T]] = None) -> None:
+        self.cached = cached if cached is not None else PersistentMap()
         self.dependencies = defaultdict(lambda: set())
+        self.added_keys = []
+
+
+_MISSING = object()
 
 
 def module_for_key(key) -> str:
@@ -36,7 +49,6 @@ def module_for_key(key) -> str:
 
 
 class EnvTable(Generic[T]):
-    upstream_env: Optional[EnvTable]
     cache: Cache[T]
     overlay: Optional[Tuple[str, EnvTable[T]]]
 
@@ -45,11 +57,43 @@ class EnvTable(Generic[T]):
     # externally, which we might do in ocaml.
     children: Dict[str, EnvTable[T]]
 
+    # An overlay's `cached` is the version of its parent's map that it was
+    # (re)based on, `base`, plus the entries it overrides. So creating an
+    # overlay is O(1), and a lookup is a single map probe whether or not the
+    # overlay owns the key.
+    #
+    # The parent's map moves on without us: lazily-computed keys are fine to
+    # miss (we fall through to the parent), and pushes, which change existing
+    # values, always reach us through `update_for_push`, where we rebase.
+    base: Optional[PersistentMap[str, T]]
+    base_added_keys: int
+    overridden: Set[str]
+
+    # Overlays are materialized one layer at a time, as in `overlay_keys.py`:
+    # the upstream overlay is only created when first needed, and until then
+    # the overlay just remembers the newest `code` of its module.
+    _upstream_env: Optional[EnvTable]
+    has_upstream: bool
+    code: Optional[str]
+
     def __init__(self, upstream_env=None, overlay=None) -> None:
-        self.upstream_env = upstream_env
+        self._upstream_env = upstream_env
         self.overlay = overlay
-        self.cache = Cache()
         self.children = {}
+        self.code = None
+        self.has_upstream = (
+            upstream_env is not None if overlay is None else overlay[1].has_upstream
+        )
+        if overlay is None:
+            self.cache = Cache()
+            self.base = None
+            self.base_added_keys = 0
+        else:
+            parent_cache = overlay[1].cache
+            self.cache = Cache(cached=parent_cache.cached)
+            self.base = parent_cache.cached
+            self.base_added_keys = len(parent_cache.added_keys)
+        self.overridden = set()
 
     @classmethod
     def new(
@@ -60,6 +104,19 @@ class EnvTable(Generic[T]):
     ) -> EnvTable[T]:
         return cls(overlay=overlay, upstream_env=upstream_env)
 
+    @property
+    def upstream_env(self) -> Optional[EnvTable]:
+        if self._upstream_env is None and self.has_upstream:
+            overlay_module, parent_env = cast(Tuple[str, EnvTable[T]], self.overlay)
+            self._upstream_env = parent_env.upstream_env.materialize_overlay(
+                overlay_module, cast(str, self.code)
+            )
+        return self._upstream_env
+
+    @property
+    def is_materialized(self) -> bool:
+        return self._upstream_env is not None or not self.has_upstream
+
     @property
     def upstream_get(self) -> ReadOnlyEnv:
         if self.upstream_env is None:
@@ -91,22 +148,79 @@ class EnvTable(Generic[T]):
         self.dependencies[key] = self.dependencies.get(key, set())
         self.dependencies[key].add(dependency)
 
+    def cache_set(self, key: str, value: T) -> None:
+        cached = self.cache.cached
+        self.cache.cached = cached.set(key, value)
+        if len(self.cache.cached) != len(cached):
+            self.cache.added_keys.append(key)
+        if self.overlay is not None:
+            self.overridden.add(key)
+
+    def snapshot(self) -> PersistentMap[str, T]:
+        """The current values of this env; later updates do not affect it."""
+        return self.cache.cached
+
+    def forget_parent_values(self) -> None:
+        # We start out sharing our parent's map, including whatever it
+        # computed from the saved text of our module. Those are exactly the
+        # keys of our module downstream of it in the dependency graph, which
+        # we can find without computing anything.
+        overlay_module, parent_env = cast(Tuple[str, EnvTable[T]], self.overlay)
+        layers = []
+        env = parent_env
+        while env is not None:
+            layers.append(env)
+            env = env.upstream_env
+        keys = {overlay_module}
+        for layer in reversed(layers[1:]):
+            keys = {dependent for key in keys for dependent in layer.dependencies.get(key, ())}
+        cached = self.cache.cached
+        for key in keys:
+            if key not in self.overridden and module_for_key(key) == overlay_module:
+                cached = cached.delete(key)
+        self.cache.cached = cached
+
+    def rebase(self) -> None:
+        if self.overlay is None:
+            return
+        overlay_module, parent_env = self.overlay
+        parent_cache = parent_env.cache
+        if parent_cache.cached is self.base:
+            return
+        cached = parent_cache.cached
+        # Keys of our module that the parent computed since our last rebase
+        # hold the parent's values, not ours.
+        for key in parent_cache.added_keys[self.base_added_keys:]:
+            if key not in self.overridden and module_for_key(key) == overlay_module:
+                cached = cached.delete(key)
+        for key in self.overridden:
+            cached = cached.set(key, self.cache.cached[key])
+        self.cache.cached = cached
+        # So do the ones it had when we were created, which we dropped then.
+        self.forget_parent_values()
+        self.base = parent_cache.cached
+        self.base_added_keys = len(parent_cache.added_keys)
+
     def get(self, key: str, dependency: str) -> T:
+        value = self.cache.cached.get(key, _MISSING)
+        if value is not _MISSING:
+            self.register_dependency(key, dependency)
+            return value
 
-        # first check whether we own the key - do nothing at all if not!
+        # if we don't own the key, let the parent compute it
         if self.overlay is not None:
             overlay_module, parent_env = self.overlay
             if module_for_key(key) != overlay_module:
                 return parent_env.get(key, dependency)
         # otherwise, do exactly the same thing `factor_out_memory.py` did
         self.register_dependency(key, dependency)
-        if key not in self.cache.cached:
-            self.cache.cached[key] = self.produce_value(
-                key,
-                self.upstream_get,
-                current_env_getter=self.cache.cached.get
-            )
-        return self.cache.cached[key]
+        value = self.produce_value(
+            key,
+            self.upstream_get,
+            current_env_getter=self.cache.cached.get
+        )
+        self.cache_set(key, value)
+        return value
 
     def update_for_push(
         self,
@@ -118,14 +232,24 @@ class EnvTable(Generic[T]):
             else self.overlay[0]
         )
         downstream_deps = set()
+        # Even an overlay that computed nothing yet shares its parent's map,
+        # which the push just replaced.
+        self.rebase()
+        if not self.is_materialized:
+            # Nothing of ours is computed yet, and so nothing of the overlays
+            # stacked on us either.
+            return downstream_deps
 
         # update as before, if this module owns the key
         for key in keys_to_update:
             if overlay_module is None or module_for_key(key) == overlay_module:
-                self.cache.cached[key] = self.produce_value(
+                self.cache_set(
                     key,
-                    self.upstream_get,
-                    current_env_getter=self.cache.cached.get
+                    self.produce_value(
+                        key,
+                        self.upstream_get,
+                        current_env_getter=self.cache.cached.get
+                    ),
                 )
                 downstream_deps |= self.dependencies[key]
 
@@ -152,17 +276,27 @@ class EnvTable(Generic[T]):
         return downstream_deps
 
     def create_overlay(self, module: str, code: str) -> EnvTable[T]:
-        if self.upstream_env is None:
-            upstream_overlay = None
-        else:
-            upstream_overlay = self.upstream_env.create_overlay(module, code)
-
-        self.children[module] = self.new(
-            upstream_env=upstream_overlay,
+        # Only this layer; the upstream overlay is created on first use.
+        child = self.new(
+            upstream_env=None,
             overlay=(module, self),
             code=code,
         )
-        return self.children[module]
+        child.code = code
+        child.forget_parent_values()
+        self.children[module] = child
+        return child
+
+    def materialize_overlay(self, module: str, code: str) -> EnvTable[T]:
+        child = self.children.get(module)
+        if child is None:
+            child = self.create_overlay(module, code)
+        elif child.code != code:
+            # The overlay was opened here too, and the edits since only
+            # reached the overlays stacked on top of it.
+            child.update(module, code)
+            child.code = code
+        return child
 
     def get_overlay(self, module: str, code: str) -> EnvTable[T]:
         if module in self.children:
@@ -176,18 +310,23 @@ class EnvTable(Generic[T]):
         return child
 
     def update(self, module: str, code: str, in_overlay: bool = False) -> Set[str]:
-        if self.upstream_env is None:
+        if not self.has_upstream:
             raise NotImplementedError()
         # switch to the child and update that. Note that upstream environments are
         # created via get_overlay, and so the update itself happens without `in_overlay`
         if in_overlay:
-            child = self.get_overlay(module, code)
-            keys_to_update = child.upstream_env.update(module, code)
-            return child.update_for_push(keys_to_update)
+            env = self.get_overlay(module, code)
         # update this stack (which will also update children)
         else:
-            keys_to_update = self.upstream_env.update(module, code)
-            return self.update_for_push(keys_to_update)
+            env = self
+        if env.overlay is not None:
+            env.code = code
+            if not env.is_materialized:
+                # Nothing has been read from this overlay yet, so there is
+                # nothing to push.
+                return set()
+        keys_to_update = env.upstream_env.update(module, code)
+        return env.update_for_push(keys_to_update)
 
     def read_only(self) -> ReadOnlyEnv:
         return self.get
@@ -207,7 +346,8 @@ class CodeEnv(EnvTable[Code]):
         code: Optional[Dict[str, Code]] = None,
     ) -> None:
         super().__init__(upstream_env=None, overlay=overlay)
-        self.cache.cached = code
+        for key, value in code.items():
+            self.cache_set(key, value)
 
     @classmethod
     def new(
@@ -232,7 +372,7 @@ class CodeEnv(EnvTable[Code]):
         if in_overlay:
             raise RuntimeError("We should never directly be updating in overlay!")
         else:
-            self.cache.cached[module] = code
+            self.cache_set(module, code)
             return cast(Set[str], self.dependencies[module])
 
 
@@ -1,17 +1,214 @@
 import ast
 import dataclasses
+import hashlib
+import time
 from typing import (
-    Any, Callable, Dict, Generic, Literal, Protocol, Set, Tuple, TypeVar, List, Optional, cast
+    Any, Callable, Deque, Dict, Generic, Literal, Protocol, Set, Tuple, Type, TypeVar, List, Optional, cast
 )
 from abc import abstractmethod
+from collections import OrderedDict, deque
 
 from typing_extensions import TypeAlias
 import textwrap
 
 
 T = TypeVar("T")
+R = TypeVar("R")
 
 
+# How a cache table keeps its values:
+# - "none": never; every `get` recomputes the value
+# - "transient": until the outermost `get` in progress returns, so that one
+#   request does not compute a value twice, but nothing outlives it
+# - "persistent": until a push invalidates them, or until they are evicted
+#   because the table holds more than `max_entries` values
+# Pushes only recompute values of persistent tables and just drop the others.
+CachePolicyKind: TypeAlias = Literal["none", "transient", "persistent"]
+
+
+@dataclasses.dataclass(frozen=True)
+class CachePolicy:
+    kind: CachePolicyKind = "persistent"
+    max_entries: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.max_entries is not None and (self.kind != "persistent" or self.max_entries < 1):
+            raise ValueError(f"Cannot bound a {self.kind} cache table to {self.max_entries} entries")
+
+
+@dataclasses.dataclass(frozen=True)
+class LayerCachePolicy:
+    saved: CachePolicy = CachePolicy()
+    unsaved: CachePolicy = CachePolicy()
+
+
+class LruCacheTable(OrderedDict):
+    """A persistent cache table that evicts its least recently used values."""
+
+    def __init__(self, max_entries: int) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.evictions = 0
+
+    def __getitem__(self, key: str) -> Any:
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+            self.evictions += 1
+
+
+class RequestScope:
+    # Like `WritableCodeEnv`, a global: the transient tables of every layer
+    # are emptied when the outermost `get` returns.
+    depth: int = 0
+    transient_tables: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def reset() -> None:
+        RequestScope.depth = 0
+        RequestScope.transient_tables = []
+
+
+def make_cache_table(policy: CachePolicy) -> Dict[str, Any]:
+    if policy.kind == "transient":
+        table: Dict[str, Any] = {}
+        RequestScope.transient_tables.append(table)
+        return table
+    if policy.kind == "persistent" and policy.max_entries is not None:
+        return LruCacheTable(policy.max_entries)
+    return {}
+
+
+@dataclasses.dataclass
+class TableStats:
+    """What one cache table of an environment did since the stats were last
+    reset. Counting is cheap enough to stay on: a `get` that hits only costs
+    an increment, and only `produce_value` calls are timed."""
+
+    gets: int = 0
+    # `get`s that had to call `produce_value`.
+    misses: int = 0
+    # Misses and recomputations by pushes. The time includes the upstream
+    # `get`s a value makes, so layers add up to more than the wall time.
+    produce_value_calls: int = 0
+    produce_value_ns: int = 0
+    # Pushes that reached the table, the keys they recomputed (or dropped),
+    # and the keys of the next environment down they handed on.
+    push_waves: int = 0
+    keys_pushed: int = 0
+    dependents: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.gets - self.misses
+
+
+@dataclasses.dataclass
+class SlowOperation:
+    """An `update`, or an outermost `get`, that took longer than the
+    threshold of `SlowOperationLog`."""
+
+    kind: Literal["get", "update"]
+    # The key asked for, or the edited module.
+    key: str
+    # "unsaved" if it went through the unsaved tables.
+    path: Literal["saved", "unsaved"]
+    started_at: float
+    duration_ms: float
+    # `produce_value` calls by environment class.
+    recomputed: Dict[str, int]
+    # The keys that took the longest, as (environment class, key, ms). Their
+    # time excludes the upstream `get`s they made, so it is their own.
+    top_keys: List[Tuple[str, str, float]]
+    # The exception it raised, e.g. "UpdateCancelled".
+    error: Optional[str] = None
+
+
+class SlowOperationLog:
+    # A global too, like `RequestScope`: only the outermost operation is
+    # measured, whichever environment it started at, and the last
+    # `max_entries` slow ones are kept. It is off until `configure` sets a
+    # threshold; then every operation costs two clock reads, and every
+    # `produce_value` a few list operations.
+    threshold_ns: Optional[int] = None
+    top_keys: int = 5
+    entries: Deque[SlowOperation] = deque(maxlen=100)
+    active: bool = False
+    # What the operation in progress recomputed so far, as (environment
+    # class, key, own ns), and how long the nested `produce_value` calls of
+    # those in progress took.
+    produced: List[Tuple[str, str, int]] = []
+    nested_ns: List[int] = []
+
+    @staticmethod
+    def configure(threshold_ms: Optional[float], max_entries: int = 100, top_keys: int = 5) -> None:
+        """Log the operations that take longer than `threshold_ms` (None
+        turns the log off). Drops what was logged so far."""
+        SlowOperationLog.threshold_ns = None if threshold_ms is None else int(threshold_ms * 1e6)
+        SlowOperationLog.top_keys = top_keys
+        SlowOperationLog.entries = deque(maxlen=max_entries)
+        SlowOperationLog.active = False
+        SlowOperationLog.produced = []
+        SlowOperationLog.nested_ns = []
+
+    @staticmethod
+    def measure(kind: Literal["get", "update"], key: str, path: Literal["saved", "unsaved"], operation: Callable[[], R]) -> R:
+        SlowOperationLog.active = True
+        start = time.perf_counter_ns()
+        error = None
+        try:
+            return operation()
+        except Exception as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            SlowOperationLog.finish(kind, key, path, time.perf_counter_ns() - start, error)
+
+    @staticmethod
+    def record_produce_value(env_class: str, key: str, elapsed_ns: int) -> None:
+        nested_ns = SlowOperationLog.nested_ns.pop()
+        if SlowOperationLog.nested_ns:
+            SlowOperationLog.nested_ns[-1] += elapsed_ns
+        SlowOperationLog.produced.append((env_class, key, elapsed_ns - nested_ns))
+
+    @staticmethod
+    def finish(
+        kind: Literal["get", "update"],
+        key: str,
+        path: Literal["saved", "unsaved"],
+        duration_ns: int,
+        error: Optional[str],
+    ) -> None:
+        produced = SlowOperationLog.produced
+        SlowOperationLog.active = False
+        SlowOperationLog.produced = []
+        SlowOperationLog.nested_ns = []
+        threshold_ns = SlowOperationLog.threshold_ns
+        if threshold_ns is None or duration_ns < threshold_ns:
+            return
+        recomputed: Dict[str, int] = {}
+        own_ns: Dict[Tuple[str, str], int] = {}
+        for env_class, produced_key, elapsed_ns in produced:
+            recomputed[env_class] = recomputed.get(env_class, 0) + 1
+            own_ns[(env_class, produced_key)] = own_ns.get((env_class, produced_key), 0) + elapsed_ns
+        top_keys = sorted(own_ns.items(), key=lambda item: -item[1])[:SlowOperationLog.top_keys]
+        SlowOperationLog.entries.append(SlowOperation(
+            kind=kind,
+            key=key,
+            path=path,
+            started_at=time.time() - duration_ns / 1e9,
+            duration_ms=duration_ns / 1e6,
+            recomputed=recomputed,
+            top_keys=[(env_class, produced_key, ns / 1e6) for (env_class, produced_key), ns in top_keys],
+            error=error,
+        ))
+
 
 class ReadOnlyEnv(Generic[T], Protocol):
     def __call__(self, key: str, dependency: str) -> T:
@@ -27,12 +224,192 @@ class WritableEnv(Generic[T]):
     saved_contents_cache_table: Dict[str, T] = dataclasses.field(default_factory=dict)
     unsaved_contents_cache_table: Dict[str, T] = dataclasses.field(default_factory=dict)
     unsaved_modules: Set[str] = dataclasses.field(default_factory=set)
-    dependencies: Dict[str, Set[object]] = dataclasses.field(default_factory=dict)
+    # The dependency edges of the two DAGs: `key -> keys whose value read it`.
+    # An edge belongs to the DAG of the table the reader's value lives in, so
+    # a saved value never shows up in `unsaved_dependencies` and vice versa.
+    dependencies: Dict[str, Set[str]] = dataclasses.field(default_factory=dict)
+    unsaved_dependencies: Dict[str, Set[str]] = dataclasses.field(default_factory=dict)
+    # Keys in the unsaved table whose value is stale because the push that
+    # would have recomputed them was cancelled by a newer edit.
+    dirty_unsaved_keys: Set[str] = dataclasses.field(default_factory=set)
+    # Only used by the code environment: digests of the texts in the two
+    # tables, so that we can tell cheaply whether an edit changes anything.
+    # Missing entries are computed on demand.
+    saved_content_hashes: Dict[str, bytes] = dataclasses.field(default_factory=dict)
+    unsaved_content_hashes: Dict[str, bytes] = dataclasses.field(default_factory=dict)
+    # The tables have to be made with `make_cache_table` to match.
+    saved_cache_policy: CachePolicy = CachePolicy()
+    unsaved_cache_policy: CachePolicy = CachePolicy()
+    # The last few versions of an unsaved module, least recent first: the
+    # hash of its unsaved text -> the (clean) unsaved values of its keys back
+    # then. Only the module being typed in has any: they are only valid as
+    # long as nothing else was edited, so every other edit clears them.
+    unsaved_versions: Dict[str, "OrderedDict[bytes, Dict[str, T]]"] = dataclasses.field(default_factory=dict)
+    max_unsaved_versions: int = 8
+    saved_stats: TableStats = dataclasses.field(default_factory=TableStats)
+    unsaved_stats: TableStats = dataclasses.field(default_factory=TableStats)
+
+    @staticmethod
+    def with_cache_policy(policy: LayerCachePolicy) -> "WritableEnv[Any]":
+        return WritableEnv(
+            saved_contents_cache_table=make_cache_table(policy.saved),
+            unsaved_contents_cache_table=make_cache_table(policy.unsaved),
+            saved_cache_policy=policy.saved,
+            unsaved_cache_policy=policy.unsaved,
+        )
+
+
+def content_hash(code: str) -> bytes:
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+
+
+# How an edit relates to what we already have, as decided by the code
+# environment before anything is pushed:
+# - "change": a real change, pushed as usual
+# - "unchanged": the text is what the target table already has; nothing to do
+# - "revert": an unsaved module is back to its saved text (typically by undo,
+#   or by saving the text that is already on disk); it becomes a saved module
+#   again and its unsaved values are dropped
+# - "promote": an unsaved module is saved with exactly its unsaved text, so
+#   its unsaved values become its saved values without recomputation
+# - "restore": an unsaved module is back to one of its recent unsaved texts
+#   (typically by undo or redo), so its unsaved values are restored from
+#   `WritableEnv.unsaved_versions` and only other modules are pushed to
+EditKind: TypeAlias = Literal["change", "unchanged", "revert", "promote", "restore"]
+
+
+class UpdateCancelled(Exception):
+    """Raised when an unsaved push is aborted because a newer edit superseded it.
+
+    `stale_keys` are the keys of the next environment down the stack whose
+    unsaved values can no longer be trusted; each environment marks the ones
+    it receives as dirty before re-raising with its own dependents.
+    """
+
+    def __init__(self, stale_keys: Set[str]) -> None:
+        super().__init__(stale_keys)
+        self.stale_keys = stale_keys
 
 
 def module(key: str) -> str:
     return key.split(".")[0]
 
+
+@dataclasses.dataclass
+class Dependents:
+    """The keys of the next environment down whose values a push made stale.
+
+    `saved` values are recomputed in the saved table and `unsaved` ones in the
+    unsaved table (if their module is unsaved), so a saved push only reaches
+    keys through saved-DAG edges and an unsaved push only through unsaved-DAG
+    edges. A saved push still has to follow unsaved edges out of saved modules,
+    since the unsaved view of a saved module is its saved value.
+    """
+
+    saved: Set[str] = dataclasses.field(default_factory=set)
+    unsaved: Set[str] = dataclasses.field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return bool(self.saved or self.unsaved)
+
+
+def record_dependency(
+    writable_env: WritableEnv[Any],
+    key: str,
+    dependency: Optional[str],
+    use_saved_contents_of_dependents: bool,
+) -> None:
+    # Like in `read_only_overlay.py`, a `None` dependency means the caller
+    # is not an environment and nothing needs to be pushed to it.
+    if dependency is None:
+        return
+    edges = (
+        writable_env.dependencies
+        if use_saved_contents_of_dependents
+        else writable_env.unsaved_dependencies
+    )
+    edges.setdefault(key, set()).add(dependency)
+
+
+def record_push(writable_env: WritableEnv[Any], pushed: Dependents, downstream_deps: Dependents) -> None:
+    for stats, keys, dependents in [
+        (writable_env.saved_stats, pushed.saved, downstream_deps.saved),
+        (writable_env.unsaved_stats, pushed.unsaved, downstream_deps.unsaved),
+    ]:
+        if keys:
+            stats.push_waves += 1
+            stats.keys_pushed += len(keys)
+        stats.dependents += len(dependents)
+
+
+def table_stats(writable_env: WritableEnv[Any]) -> Dict[str, Dict[str, int]]:
+    """The stats of both cache tables, along with their current sizes."""
+    result = {}
+    for name, stats, table in [
+        ("saved", writable_env.saved_stats, writable_env.saved_contents_cache_table),
+        ("unsaved", writable_env.unsaved_stats, writable_env.unsaved_contents_cache_table),
+    ]:
+        result[name] = dict(
+            dataclasses.asdict(stats),
+            hits=stats.hits,
+            size=len(table),
+            evictions=getattr(table, "evictions", 0),
+        )
+    return result
+
+
+def reset_table_stats(writable_env: WritableEnv[Any]) -> None:
+    writable_env.saved_stats = TableStats()
+    writable_env.unsaved_stats = TableStats()
+    for table in [writable_env.saved_contents_cache_table, writable_env.unsaved_contents_cache_table]:
+        if isinstance(table, LruCacheTable):
+            table.evictions = 0
+
+
+def unsaved_dependents(writable_env: WritableEnv[Any], keys: Set[str], edited_module: Optional[str]) -> Set[str]:
+    downstream_deps = set()
+    for key in keys:
+        downstream_deps |= writable_env.unsaved_dependencies.get(key, set())
+    # When a saved module becomes unsaved, the unsaved view of its keys moves
+    # from the saved table to the unsaved one, but everything that read them
+    # so far did so through saved-DAG edges. Only its own keys can care:
+    # other modules either read the saved view anyway, or are unsaved and
+    # read us through unsaved edges.
+    if edited_module is not None and edited_module in writable_env.unsaved_modules:
+        for key in keys:
+            if module(key) == edited_module:
+                downstream_deps |= {
+                    dependent
+                    for dependent in writable_env.dependencies.get(key, set())
+                    if module(dependent) == edited_module
+                }
+    return downstream_deps
+
+
+def drop_unsaved_entries(writable_env: WritableEnv[Any], module_name: str, promoted: bool = False) -> None:
+    """Forget the unsaved values of a module that is saved again.
+
+    The unsaved-DAG edges read by those values go with them, unless they were
+    `promoted` to saved values, in which case they become saved-DAG edges.
+    """
+    # The unsaved table only holds keys of unsaved modules, so scanning
+    # it is cheap. The same goes for the unsaved edges.
+    for key in [key for key in writable_env.unsaved_contents_cache_table if module(key) == module_name]:
+        del writable_env.unsaved_contents_cache_table[key]
+        writable_env.dirty_unsaved_keys.discard(key)
+    for key, dependents in list(writable_env.unsaved_dependencies.items()):
+        retired = {dependent for dependent in dependents if module(dependent) == module_name}
+        if not retired:
+            continue
+        if promoted:
+            writable_env.dependencies.setdefault(key, set()).update(retired)
+        dependents -= retired
+        if not dependents:
+            del writable_env.unsaved_dependencies[key]
+
+
+_MISSING = object()
+
 @dataclasses.dataclass
 class EnvTable(Generic[T]):
     writable_env: WritableEnv[T]
@@ -49,12 +426,89 @@ class EnvTable(Generic[T]):
         "Must be implemented by child environments"
         raise NotImplementedError()
 
-    def register_dependency(self, key: str, dependency: str) -> None:
-        self.writable_env.dependencies[key] = self.writable_env.dependencies.get(key, set())
-        self.writable_env.dependencies[key].add(dependency)
-
-    def get(self, key: str, dependency: str, use_saved_contents_of_dependents: bool) -> T:
-        self.register_dependency(key, dependency)
+    def produce(self, key: str, use_saved_contents: bool, table: Dict[str, T], stats: TableStats) -> T:
+        # A `produce_value` that raises is counted, but its time is not.
+        stats.produce_value_calls += 1
+        is_logged = SlowOperationLog.active
+        if is_logged:
+            SlowOperationLog.nested_ns.append(0)
+        start = time.perf_counter_ns()
+        value = self.produce_value(
+            key,
+            self.upstream_get(use_saved_contents_of_dependents=use_saved_contents),
+            current_env_getter=table.get
+        )
+        elapsed_ns = time.perf_counter_ns() - start
+        stats.produce_value_ns += elapsed_ns
+        if is_logged:
+            SlowOperationLog.record_produce_value(type(self).__name__, key, elapsed_ns)
+        return value
+
+    def register_dependency(self, key: str, dependency: Optional[str], use_saved_contents_of_dependents: bool = True) -> None:
+        record_dependency(self.writable_env, key, dependency, use_saved_contents_of_dependents)
+
+    def unsaved_dependents(self, keys: Set[str], edited_module: Optional[str] = None) -> Set[str]:
+        return unsaved_dependents(self.writable_env, keys, edited_module)
+
+    def drop_unsaved_entries(self, module_name: str, promoted: bool = False) -> None:
+        drop_unsaved_entries(self.writable_env, module_name, promoted)
+
+    def record_unsaved_version(self, module_name: str, text_hash: Optional[bytes]) -> None:
+        if text_hash is None or self.writable_env.max_unsaved_versions <= 0:
+            return
+        versions = self.writable_env.unsaved_versions.setdefault(module_name, OrderedDict())
+        versions[text_hash] = {
+            key: value
+            for key, value in self.writable_env.unsaved_contents_cache_table.items()
+            if module(key) == module_name and key not in self.writable_env.dirty_unsaved_keys
+        }
+        versions.move_to_end(text_hash)
+        while len(versions) > self.writable_env.max_unsaved_versions:
+            versions.popitem(last=False)
+
+    def restore_unsaved_version(self, module_name: str, text_hash: bytes) -> None:
+        # An environment that has no such version (say, because an async
+        # stack edited the module in between) just drops the values, which
+        # are then recomputed on demand.
+        version = self.writable_env.unsaved_versions.get(module_name, {}).pop(text_hash, {})
+        table = self.writable_env.unsaved_contents_cache_table
+        for key in [key for key in table if module(key) == module_name]:
+            del table[key]
+            self.writable_env.dirty_unsaved_keys.discard(key)
+        table.update(version)
+
+    def keep_unsaved_versions(self, module_name: Optional[str]) -> None:
+        versions = self.writable_env.unsaved_versions
+        kept = versions.get(module_name) if module_name is not None else None
+        versions.clear()
+        if kept is not None:
+            versions[module_name] = kept
+
+    def code_env(self) -> "CodeEnv":
+        env = self
+        while env.upstream_env is not None:
+            env = env.upstream_env
+        return cast(CodeEnv, env)
+
+    def get(self, key: str, dependency: Optional[str], use_saved_contents_of_dependents: bool) -> T:
+        RequestScope.depth += 1
+        try:
+            if SlowOperationLog.threshold_ns is None or SlowOperationLog.active:
+                return self._get(key, dependency, use_saved_contents_of_dependents)
+            return SlowOperationLog.measure(
+                "get",
+                key,
+                "saved" if use_saved_contents_of_dependents or module(key) not in self.writable_env.unsaved_modules else "unsaved",
+                lambda: self._get(key, dependency, use_saved_contents_of_dependents),
+            )
+        finally:
+            RequestScope.depth -= 1
+            if RequestScope.depth == 0:
+                for table in RequestScope.transient_tables:
+                    table.clear()
+
+    def _get(self, key: str, dependency: Optional[str], use_saved_contents_of_dependents: bool) -> T:
+        self.register_dependency(key, dependency, use_saved_contents_of_dependents)
         use_saved_contents = (
             use_saved_contents_of_dependents or
             module(key) not in self.writable_env.unsaved_modules
@@ -64,52 +518,164 @@ class EnvTable(Generic[T]):
             if use_saved_contents
             else self.writable_env.unsaved_contents_cache_table
         )
+        policy = (
+            self.writable_env.saved_cache_policy
+            if use_saved_contents
+            else self.writable_env.unsaved_cache_policy
+        )
+        stats = self.writable_env.saved_stats if use_saved_contents else self.writable_env.unsaved_stats
+        stats.gets += 1
+        # A dirty unsaved value was left behind by a cancelled push, so it
+        # has to be recomputed just like a cache miss.
+        is_dirty = (
+            not use_saved_contents
+            and key in self.writable_env.dirty_unsaved_keys
+        )
         # Update the saved_contents_cache_table whether the module is
         # saved or unsaved.
-        if key not in target_cache_table:
-            target_cache_table[key] = self.produce_value(
-                key,
-                self.upstream_get(
-                    use_saved_contents_of_dependents=use_saved_contents
-                ),
-                current_env_getter=target_cache_table.get
-            )
+        if key not in target_cache_table or is_dirty:
+            stats.misses += 1
+            value = self.produce(key, use_saved_contents, target_cache_table, stats)
+            # Recomputing the saved value does not clean the unsaved one.
+            if not use_saved_contents:
+                self.writable_env.dirty_unsaved_keys.discard(key)
+            if policy.kind == "none":
+                return value
+            target_cache_table[key] = value
 
         return target_cache_table[key]
 
-    def update_for_push(self, keys_to_update: Set[str], is_saved_content: bool) -> Set[str]:
+    def update_for_push(
+        self,
+        keys_to_update: Dependents,
+        edited_module: Optional[str],
+        is_saved_content: bool,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+        edit: EditKind = "change",
+        saved_is_current: bool = False,
+    ) -> Dependents:
         def update_table(table: Dict[str, T], key: str, use_saved_contents_of_dependents: bool) -> None:
-            table[key] = self.produce_value(
-                key,
-                self.upstream_get(use_saved_contents_of_dependents=use_saved_contents_of_dependents),
-                current_env_getter=table.get
+            policy, stats = (
+                (self.writable_env.saved_cache_policy, self.writable_env.saved_stats)
+                if use_saved_contents_of_dependents
+                else (self.writable_env.unsaved_cache_policy, self.writable_env.unsaved_stats)
             )
+            if policy.kind != "persistent":
+                table.pop(key, None)
+                return
+            table[key] = self.produce(key, use_saved_contents_of_dependents, table, stats)
+
+        saved_keys = keys_to_update.saved
+        unsaved_keys = keys_to_update.unsaved
+        if not is_saved_content:
+            # Pick up whatever a previously-cancelled push left unfinished.
+            unsaved_keys = unsaved_keys | self.writable_env.dirty_unsaved_keys
+
+        downstream_deps = Dependents()
+        ordered_keys = list(saved_keys | unsaved_keys)
+        for index, key in enumerate(ordered_keys):
+            # Saved pushes always run to completion: the saved tables are
+            # shared and must never be left half-updated.
+            if not is_saved_content and is_cancelled is not None and is_cancelled():
+                stale_keys = set(ordered_keys[index:])
+                self.writable_env.dirty_unsaved_keys |= stale_keys
+                record_push(
+                    self.writable_env,
+                    Dependents(saved_keys - stale_keys, unsaved_keys - stale_keys),
+                    downstream_deps,
+                )
+                raise UpdateCancelled(downstream_deps.unsaved | self.unsaved_dependents(stale_keys, edited_module))
 
-        downstream_deps = set()
-        for key in keys_to_update:
             is_unsaved_module = module(key) in self.writable_env.unsaved_modules
 
-            if is_saved_content:
-                # Update saved_contents_cache_table whether the module is saved or unsaved.
-                update_table(self.writable_env.saved_contents_cache_table, key,
-                             use_saved_contents_of_dependents=True)
-
-                # If the module is unsaved, also update
-                # unsaved_contents_cache_table. Newly-saved content needs to
-                # propagate to both saved and unsaved cache tables.
-                if is_unsaved_module:
+            if key in saved_keys:
+                if saved_is_current:
+                    # Someone else already recomputed the (shared) saved table.
+                    pass
+                elif edit == "promote" and module(key) == edited_module:
+                    # The unsaved value was computed from the text that is now
+                    # saved (and from saved contents of every other module), so
+                    # it *is* the saved value. Keys without a (clean) unsaved
+                    # value are dropped and recomputed if anyone asks for them.
+                    unsaved_value = self.writable_env.unsaved_contents_cache_table.pop(key, _MISSING)
+                    if (
+                        unsaved_value is _MISSING
+                        or key in self.writable_env.dirty_unsaved_keys
+                        or self.writable_env.saved_cache_policy.kind != "persistent"
+                    ):
+                        self.writable_env.saved_contents_cache_table.pop(key, None)
+                    else:
+                        self.writable_env.saved_contents_cache_table[key] = unsaved_value
+                    self.writable_env.dirty_unsaved_keys.discard(key)
+                else:
+                    update_table(self.writable_env.saved_contents_cache_table, key,
+                                 use_saved_contents_of_dependents=True)
+                downstream_deps.saved |= self.writable_env.dependencies.get(key, set())
+                if not is_unsaved_module:
+                    # The saved value is also what unsaved modules see.
+                    downstream_deps.unsaved |= self.writable_env.unsaved_dependencies.get(key, set())
+
+            if key in unsaved_keys:
+                # Restored values are already up to date, but whatever read
+                # the values they replace is not.
+                if is_unsaved_module and not (edit == "restore" and module(key) == edited_module):
                     update_table(self.writable_env.unsaved_contents_cache_table, key,
                                  use_saved_contents_of_dependents=False)
-            elif is_unsaved_module:
-                update_table(self.writable_env.unsaved_contents_cache_table, key,
-                             use_saved_contents_of_dependents=False)
-
-            downstream_deps |= self.writable_env.dependencies.get(key, set())
+                    self.writable_env.dirty_unsaved_keys.discard(key)
+                # The unsaved view of a saved module only changes when the
+                # edited module itself stops being unsaved (see `revert`).
+                if is_unsaved_module or module(key) == edited_module:
+                    downstream_deps.unsaved |= self.unsaved_dependents({key}, edited_module)
 
+        record_push(self.writable_env, Dependents(saved_keys, unsaved_keys), downstream_deps)
         return downstream_deps
 
-    def update(self, module: str, code: str, is_saved_content: bool) -> Set[str]:
-        if is_saved_content:
+    def update(
+        self,
+        module: str,
+        code: str,
+        is_saved_content: bool,
+        is_cancelled: Optional[Callable[[], bool]] = None,
+        edit: Optional[EditKind] = None,
+    ) -> Dependents:
+        """Push an edit of `module` down the stack.
+
+        For unsaved edits, `is_cancelled` is polled before every key; once it
+        returns True the push stops, the keys it did not get to are marked
+        dirty in every environment and `UpdateCancelled` is raised. The caller
+        is expected to retry with the newest text of the module.
+
+        `edit` is decided by the code environment (see `EditKind`) on the way
+        in, and passed down so that every environment agrees on it.
+        """
+        if SlowOperationLog.threshold_ns is None or SlowOperationLog.active:
+            return self._update(module, code, is_saved_content, is_cancelled, edit)
+        return SlowOperationLog.measure(
+            "update",
+            module,
+            "saved" if is_saved_content else "unsaved",
+            lambda: self._update(module, code, is_saved_content, is_cancelled, edit),
+        )
+
+    def _update(
+        self,
+        module: str,
+        code: str,
+        is_saved_content: bool,
+        is_cancelled: Optional[Callable[[], bool]],
+        edit: Optional[EditKind],
+    ) -> Dependents:
+        if edit is None:
+            edit = self.code_env().classify_edit(module, code, is_saved_content)
+        if edit == "unchanged":
+            return Dependents()
+
+        was_unsaved = module in self.writable_env.unsaved_modules
+        is_typing = not is_saved_content and edit in ("change", "restore")
+        self.keep_unsaved_versions(module if is_typing else None)
+        if is_typing and was_unsaved:
+            self.record_unsaved_version(module, self.code_env().content_hash(module, saved=False))
+        if is_saved_content or edit == "revert":
             self.writable_env.unsaved_modules.discard(module)
         else:
             self.writable_env.unsaved_modules.add(module)
@@ -117,8 +683,58 @@ class EnvTable(Generic[T]):
         if self.upstream_env is None:
             raise NotImplementedError()
         else:
-            keys_to_update = self.upstream_env.update(module, code, is_saved_content)
-            return self.update_for_push(keys_to_update, is_saved_content)
+            try:
+                keys_to_update = self.upstream_env.update(
+                    module, code, is_saved_content, is_cancelled, edit=edit
+                )
+            except UpdateCancelled as cancelled:
+                self.writable_env.dirty_unsaved_keys |= cancelled.stale_keys
+                raise UpdateCancelled(self.unsaved_dependents(cancelled.stale_keys, module))
+            if edit == "restore":
+                self.restore_unsaved_version(module, content_hash(code))
+            if edit == "revert":
+                # Only the unsaved values of *other* unsaved modules can have
+                # seen our unsaved text.
+                downstream_deps = (
+                    self.update_for_push(keys_to_update, module, is_saved_content=False, is_cancelled=is_cancelled)
+                    if self.writable_env.unsaved_modules
+                    else Dependents()
+                )
+            else:
+                downstream_deps = self.update_for_push(
+                    keys_to_update, module, is_saved_content, is_cancelled, edit=edit
+                )
+            if was_unsaved and module not in self.writable_env.unsaved_modules:
+                self.drop_unsaved_entries(module, promoted=edit == "promote")
+            return downstream_deps
+
+    def follow_saved_push(self, module: str) -> Dependents:
+        """Catch up with a saved edit of `module` pushed through another stack
+        that shares our saved tables (see `multi_client_memory.py`).
+
+        The saved values are up to date already, so this only recomputes our
+        unsaved values that read the new saved ones. Whether `module` is
+        unsaved here is up to us, so it stays that way.
+        """
+        self.keep_unsaved_versions(None)
+        if self.upstream_env is None:
+            raise NotImplementedError()
+        keys_to_update = self.upstream_env.follow_saved_push(module)
+        return self.update_for_push(keys_to_update, None, is_saved_content=True, saved_is_current=True)
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """The stats of every environment from the code environment down to
+        this one, by environment class and then by table ("saved" or
+        "unsaved"). Sizes are counted when this is called."""
+        envs = [self]
+        while envs[-1].upstream_env is not None:
+            envs.append(envs[-1].upstream_env)
+        return {type(env).__name__: table_stats(env.writable_env) for env in reversed(envs)}
+
+    def reset_stats(self) -> None:
+        reset_table_stats(self.writable_env)
+        if self.upstream_env is not None:
+            self.upstream_env.reset_stats()
 
     def read_only(self, use_saved_contents_of_dependents: bool) -> ReadOnlyEnv:
         return lambda key, dependency: self.get(key, dependency, use_saved_contents_of_dependents=use_saved_contents_of_dependents)
@@ -167,7 +783,47 @@ class CodeEnv(EnvTable[Code]):
     def produce_value(key: Module, upstream_get: Any, current_env_getter: Any) -> Code:
         return current_env_getter(key)
 
-    def update(self, module: str, code: str, is_saved_content: bool) -> Set[str]:
+    def content_hash(self, module: str, saved: bool) -> Optional[bytes]:
+        hashes, table = (
+            (self.writable_env.saved_content_hashes, self.writable_env.saved_contents_cache_table)
+            if saved
+            else (self.writable_env.unsaved_content_hashes, self.writable_env.unsaved_contents_cache_table)
+        )
+        if module not in hashes:
+            if module not in table:
+                return None
+            hashes[module] = content_hash(table[module])
+        return hashes[module]
+
+    def classify_edit(self, module: str, code: str, is_saved_content: bool) -> EditKind:
+        new_hash = content_hash(code)
+        is_unsaved = module in self.writable_env.unsaved_modules
+        if new_hash == self.content_hash(module, saved=True):
+            return "revert" if is_unsaved else "unchanged"
+        if (
+            not is_saved_content
+            and is_unsaved
+            and new_hash in self.writable_env.unsaved_versions.get(module, {})
+        ):
+            return "restore"
+        if not is_unsaved or new_hash != self.content_hash(module, saved=False):
+            return "change"
+        if not is_saved_content:
+            return "unchanged"
+        # The unsaved values of the module may also have seen the unsaved
+        # text of other modules, in which case they are not its saved values.
+        if self.writable_env.unsaved_modules == {module}:
+            return "promote"
+        return "change"
+
+    def _update(
+        self,
+        module: str,
+        code: str,
+        is_saved_content: bool,
+        is_cancelled: Optional[Callable[[], bool]],
+        edit: Optional[EditKind],
+    ) -> Dependents:
         # Note 1: I was a bit sleepy when I wrote this function, so
         # double-check the logic here.
 
@@ -175,13 +831,79 @@ class CodeEnv(EnvTable[Code]):
         # whether `module` is saved or unsaved, we want to set its contents.
 
         # `CodeEnv` does not have an upstream environment. So, we have to
-        # override the default `update` method to set the value before we
+        # override the default `_update` method to set the value before we
         # "produce" it. (This is what `basic.py` does too.)
-        target_cache_table = (self.writable_env.unsaved_contents_cache_table
-                              if module in self.writable_env.unsaved_modules
-                              else self.writable_env.saved_contents_cache_table)
-        target_cache_table[module] = code
-        return cast(Set[str], self.writable_env.dependencies[module])
+        #
+        # We still have to track which modules are unsaved ourselves, though,
+        # otherwise unsaved code would overwrite the saved contents.
+        if edit is None:
+            edit = self.classify_edit(module, code, is_saved_content)
+        if edit == "unchanged":
+            return Dependents()
+        was_unsaved = module in self.writable_env.unsaved_modules
+        # The code environment only keeps versions (of the text itself) so
+        # that `classify_edit` knows which ones the other environments have.
+        is_typing = not is_saved_content and edit in ("change", "restore")
+        self.keep_unsaved_versions(module if is_typing else None)
+        if is_typing and was_unsaved:
+            self.record_unsaved_version(module, self.content_hash(module, saved=False))
+            self.writable_env.unsaved_versions.get(module, {}).pop(content_hash(code), None)
+        if is_saved_content or edit == "revert":
+            self.writable_env.unsaved_modules.discard(module)
+        else:
+            self.writable_env.unsaved_modules.add(module)
+        if edit != "revert":
+            record_code(self.writable_env, module, code, is_saved_content=module not in self.writable_env.unsaved_modules)
+        downstream_deps = code_dependents(self.writable_env, module, is_saved_content, edit)
+        record_push(
+            self.writable_env,
+            Dependents(saved={module}) if is_saved_content else Dependents(unsaved={module}),
+            downstream_deps,
+        )
+        # A saved module has no unsaved text.
+        if was_unsaved and module not in self.writable_env.unsaved_modules:
+            self.drop_unsaved_entries(module, promoted=edit == "promote")
+            self.writable_env.unsaved_content_hashes.pop(module, None)
+        return downstream_deps
+
+    def follow_saved_push(self, module: str) -> Dependents:
+        self.keep_unsaved_versions(None)
+        return Dependents(
+            saved=set(self.writable_env.dependencies.get(module, set())),
+            # If the module is unsaved here, we do not see its saved text.
+            unsaved=(
+                set()
+                if module in self.writable_env.unsaved_modules
+                else set(self.writable_env.unsaved_dependencies.get(module, set()))
+            ),
+        )
+
+
+def code_dependents(writable_env: WritableEnv[Code], module: str, is_saved_content: bool, edit: EditKind) -> Dependents:
+    """What an edit of `module`'s text makes stale (nothing depends on a module that was never read)."""
+    return Dependents(
+        # A revert does not touch the saved text.
+        saved=(
+            set(writable_env.dependencies.get(module, set()))
+            if is_saved_content and edit != "revert"
+            else set()
+        ),
+        # A promotion does not change what the unsaved view sees.
+        unsaved=(
+            unsaved_dependents(writable_env, {module}, module)
+            if edit != "promote"
+            else set()
+        ),
+    )
+
+
+def record_code(writable_env: WritableEnv[Code], module: str, code: Code, is_saved_content: bool) -> None:
+    if is_saved_content:
+        writable_env.saved_contents_cache_table[module] = code
+        writable_env.saved_content_hashes[module] = content_hash(code)
+    else:
+        writable_env.unsaved_contents_cache_table[module] = code
+        writable_env.unsaved_content_hashes[module] = content_hash(code)
 
 
 @dataclasses.dataclass
@@ -237,19 +959,39 @@ class ClassGrandparentsEnv(EnvTable[ClassAncestors]):
 
 
 
-def create_env_stack(code: Dict[str, str]) -> Tuple[
+def create_env_stack(
+    code: Dict[str, str],
+    cache_policies: Optional[Dict[Type[EnvTable[Any]], LayerCachePolicy]] = None,
+    max_unsaved_versions: int = 8,
+) -> Tuple[
     CodeEnv,
     AstEnv,
     ClassBodyEnv,
     ClassParentsEnv,
     ClassGrandparentsEnv,
 ]:
+    """
+    `cache_policies` picks how each layer above the code caches its values;
+    the default is to persist everything. `max_unsaved_versions` bounds the
+    recent versions each layer keeps of the module being typed in (0 turns
+    them off).
+    """
+    cache_policies = cache_policies or {}
+    if CodeEnv in cache_policies:
+        raise ValueError("The code environment holds the code itself, so it cannot be configured")
+
+    def writable_env(env_class: Type[EnvTable[Any]]) -> WritableEnv[Any]:
+        return WritableEnv.with_cache_policy(cache_policies.get(env_class, LayerCachePolicy()))
+
     WritableCodeEnv.clear()
+    RequestScope.reset()
     code_env = CodeEnv(writable_env=WritableCodeEnv.get_env(code), upstream_env=None)
-    ast_env = AstEnv(writable_env=WritableEnv[ast.AST](), upstream_env=code_env)
-    class_body_env = ClassBodyEnv(writable_env=WritableEnv[ast.ClassDef](), upstream_env=ast_env)
-    class_parents_env = ClassParentsEnv(writable_env=WritableEnv[ClassAncestors](), upstream_env=class_body_env)
-    class_grandparents_env = ClassGrandparentsEnv(writable_env=WritableEnv[ClassAncestors](), upstream_env=class_parents_env)
+    ast_env = AstEnv(writable_env=writable_env(AstEnv), upstream_env=code_env)
+    class_body_env = ClassBodyEnv(writable_env=writable_env(ClassBodyEnv), upstream_env=ast_env)
+    class_parents_env = ClassParentsEnv(writable_env=writable_env(ClassParentsEnv), upstream_env=class_body_env)
+    class_grandparents_env = ClassGrandparentsEnv(writable_env=writable_env(ClassGrandparentsEnv), upstream_env=class_parents_env)
+    for env in (code_env, ast_env, class_body_env, class_parents_env, class_grandparents_env):
+        env.writable_env.max_unsaved_versions = max_unsaved_versions
     return (
         code_env,
         ast_env,